@@ -0,0 +1,307 @@
+"""
+AgriPal - Analysis result cache
+Results of segment_analyze_plant and analyze_nutrition_deficiency keyed by
+the image content hash + pipeline configuration, persisted on local disk
+under a size budget with least-recently-used eviction.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import tempfile
+import threading
+
+import segment2
+import nutrition_analyzer
+from segment2 import (
+    AnalysisWorkspace, OPTIMIZATION_PROFILES, image_megapixels, resolve_profile,
+    segment_analyze_plant, stage_decode_factor
+)
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.environ.get('AGRIPAL_CACHE_DIR', os.path.join('cache', 'analysis'))
+CACHE_MAX_BYTES = int(os.environ.get('AGRIPAL_CACHE_MAX_MB', 128)) * 1024 * 1024
+
+
+class AnalysisCache:
+    """
+    Disk-backed key → pickled result store.
+
+    Recency is the file mtime (touched on every hit), so the LRU order
+    survives restarts and is shared by all workers using the directory.
+    """
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0}
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.pkl")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = pickle.load(f)
+            os.utime(path)
+        except FileNotFoundError:
+            self._count('misses')
+            return None
+        except Exception as e:
+            logger.warning(f"⚠️ Dropping unreadable cache entry {key[:12]}: {e}")
+            self._remove(path)
+            self._count('misses')
+            return None
+
+        self._count('hits')
+        return value
+
+    def put(self, key, value):
+        try:
+            fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self._path(key))
+        except Exception as e:
+            logger.warning(f"⚠️ Could not store cache entry {key[:12]}: {e}")
+            return
+
+        self._count('stores')
+        self.evict()
+
+    def evict(self):
+        """Remove least-recently-used entries until under the size budget."""
+        with self._lock:
+            entries = []
+            total = 0
+            for name in os.listdir(self.directory):
+                if not name.endswith('.pkl'):
+                    continue
+                try:
+                    st = os.stat(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, name))
+                total += st.st_size
+
+            entries.sort()
+            for _, size, name in entries:
+                if total <= self.max_bytes:
+                    break
+                self._remove(os.path.join(self.directory, name))
+                total -= size
+                self._counters['evictions'] += 1
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+
+        entries = 0
+        size = 0
+        for name in os.listdir(self.directory):
+            if name.endswith('.pkl'):
+                entries += 1
+                size += os.path.getsize(os.path.join(self.directory, name))
+
+        lookups = counters['hits'] + counters['misses']
+        counters.update({
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            'hit_rate': round(counters['hits'] / lookups, 3) if lookups else 0.0,
+        })
+        return counters
+
+    def _count(self, name):
+        with self._lock:
+            self._counters[name] += 1
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+analysis_cache = AnalysisCache()
+
+
+# =====================================================
+# KEYS
+# =====================================================
+def read_image_bytes(image_source):
+    """Raw encoded bytes for a path or bytes-like source."""
+    if isinstance(image_source, (bytes, bytearray, memoryview)):
+        return bytes(image_source)
+    with open(image_source, 'rb') as f:
+        return f.read()
+
+
+def segment_config_fingerprint(profile, decode_factor=1):
+    """`decode_factor` is the stage's stage_decode_factor() (1 = full-size decode)."""
+    return {
+        'version': segment2.ANALYZER_VERSION,
+        'profile': profile,
+        'config': OPTIMIZATION_PROFILES[profile],
+        'decode_factor': decode_factor,
+    }
+
+
+def nutrition_config_fingerprint(profile=None, reduced_decode=None, decode_factor=None):
+    """
+    `profile` and `decode_factor` describe a shared stage (None = standalone);
+    `reduced_decode` as passed to analyze_nutrition_deficiency().
+    """
+    data_path = 'nutrition_deficiency.json'
+    return {
+        'version': nutrition_analyzer.ANALYZER_VERSION,
+        'segmentation_profile': profile,
+        'segmentation_config': OPTIMIZATION_PROFILES[profile] if profile else None,
+        'max_size': nutrition_analyzer.ANALYSIS_MAX_SIZE,
+        'ranges': nutrition_analyzer.PATTERN_HSV_RANGES,
+        'margin_band': nutrition_analyzer.MARGIN_BAND_WIDTH,
+        'low_memory': nutrition_analyzer.LOW_MEMORY,
+        'reduced_decode': reduced_decode,
+        'stage_decode_factor': decode_factor,
+        'data_mtime': os.path.getmtime(data_path) if os.path.exists(data_path) else None,
+    }
+
+
+def make_cache_key(kind, image_bytes, fingerprint):
+    h = hashlib.sha256()
+    h.update(kind.encode())
+    h.update(json.dumps(fingerprint, sort_keys=True, default=str).encode())
+    h.update(hashlib.sha256(image_bytes).digest())
+    return h.hexdigest()
+
+
+# =====================================================
+# SEGMENT2 (LEAF SEVERITY)
+# =====================================================
+def lookup_segment_result(image_bytes, workspace, profile, decode_factor=1):
+    """
+    Cached (leaf_results, plant_severity, plant_level) for a resolved
+    profile name and decode factor, or None. On a hit the stored leaf crops /
+    report are restored into `workspace` and the leaf paths are rewritten
+    to point at it.
+    """
+    key = make_cache_key('segment', image_bytes, segment_config_fingerprint(profile, decode_factor))
+    entry = analysis_cache.get(key)
+    if entry is None:
+        return None
+
+    workspace.import_artifacts(entry['artifacts'])
+    leaf_results = entry['leaf_results']
+    for r in leaf_results:
+        r['leaf'] = workspace.path_for(r['leaf'])
+
+    logger.info(f"⚡ Analysis cache hit (segment) → workspace {workspace.job_id}")
+    return leaf_results, entry['plant_severity'], entry['plant_level']
+
+
+def store_segment_result(image_bytes, workspace, result, profile, decode_factor=1):
+    leaf_results, plant_severity, plant_level = result
+    stored_leaves = []
+    for r in leaf_results:
+        if workspace.in_memory:
+            leaf_key = r['leaf']
+        else:
+            leaf_key = os.path.relpath(r['leaf'], workspace.root).replace(os.sep, '/')
+        stored_leaves.append(dict(r, leaf=leaf_key))
+
+    key = make_cache_key('segment', image_bytes, segment_config_fingerprint(profile, decode_factor))
+    analysis_cache.put(key, {
+        'leaf_results': stored_leaves,
+        'plant_severity': plant_severity,
+        'plant_level': plant_level,
+        'artifacts': workspace.export_artifacts(),
+    })
+
+
+def cached_segment_analyze_plant(image_source, workspace=None, stage=None, profile=None):
+    """
+    Drop-in for segment_analyze_plant() that consults the cache first.
+    `image_source` is a file path or the encoded image bytes. An "auto"
+    profile is resolved up front so the lookup and the run agree.
+    """
+    workspace = workspace or AnalysisWorkspace()
+    image_bytes = read_image_bytes(image_source)
+    if stage is not None:
+        profile, decode_factor = stage["profile"], stage["decode_factor"]
+    else:
+        profile, config = resolve_profile(profile, image_megapixels(image_bytes))
+        decode_factor = stage_decode_factor(image_bytes, config)
+
+    cached = lookup_segment_result(image_bytes, workspace, profile, decode_factor)
+    if cached is not None:
+        return cached
+
+    label = image_source if isinstance(image_source, str) else image_bytes
+    result = segment_analyze_plant(label, workspace=workspace, stage=stage, profile=profile)
+    store_segment_result(image_bytes, workspace, result, profile, decode_factor)
+    return result
+
+
+# =====================================================
+# NUTRITION ANALYZER
+# =====================================================
+def lookup_nutrition_result(image_bytes, profile=None, reduced_decode=None, decode_factor=None):
+    """
+    Cached analyze_nutrition_deficiency() result or None. Cached results
+    carry no segmented_image array (it is dropped before storing).
+    """
+    key = make_cache_key('nutrition', image_bytes,
+                         nutrition_config_fingerprint(profile, reduced_decode, decode_factor))
+    result = analysis_cache.get(key)
+    if result is not None:
+        logger.info("⚡ Analysis cache hit (nutrition)")
+    return result
+
+
+def store_nutrition_result(image_bytes, result, profile=None, reduced_decode=None, decode_factor=None):
+    if not result.get('success'):
+        return
+
+    stored = dict(result)
+    stored.pop('memory', None)  # per-run measurement, not part of the result
+    if stored.get('color_analysis'):
+        stored['color_analysis'] = dict(stored['color_analysis'], segmented_image=None)
+
+    key = make_cache_key('nutrition', image_bytes,
+                         nutrition_config_fingerprint(profile, reduced_decode, decode_factor))
+    analysis_cache.put(key, stored)
+
+
+def cached_analyze_nutrition_deficiency(image_path, stage=None, reduced_decode=None):
+    """
+    Drop-in for analyze_nutrition_deficiency() that consults the cache first.
+    `image_path` may also be the encoded image bytes.
+    """
+    image_bytes = read_image_bytes(image_path)
+
+    profile, decode_factor = None, None
+    if stage is not None:
+        # Nothing is decoded here with a shared stage; key on how the stage was
+        profile, decode_factor = stage["profile"], stage["decode_factor"]
+        reduced_decode = None
+
+    cached = lookup_nutrition_result(image_bytes, profile, reduced_decode, decode_factor)
+    if cached is not None:
+        return cached
+
+    result = nutrition_analyzer.analyze_nutrition_deficiency(
+        image_path, stage=stage, reduced_decode=reduced_decode
+    )
+    store_nutrition_result(image_bytes, result, profile, reduced_decode, decode_factor)
+    return result
+
+
+def cache_stats():
+    return analysis_cache.stats()
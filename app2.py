@@ -1,4 +1,4 @@
-from flask import Flask, request, render_template, jsonify, url_for, redirect, flash
+from flask import Flask, request, render_template, jsonify, url_for, redirect, flash, send_file
 from flask_cors import CORS
 from PIL import Image
 import numpy as np
@@ -8,14 +8,37 @@ import uuid
 import json
 import logging
 
-import cv2
 import shutil
 import traceback
 from sklearn.metrics.pairwise import cosine_similarity
 from urllib.parse import quote_plus
 from datetime import datetime
 import random
-from segment2 import segment_analyze_plant
+from concurrent.futures import ThreadPoolExecutor
+from segment2 import (
+    segment_analyze_plant, prepare_segmentation, AnalysisWorkspace, OPTIMIZATION_PROFILES, ADAPTIVE_PROFILE,
+    heatmap_for_job, calculate_plant_severity_fast
+)
+from plant_pipeline import analyze_plant_combined
+from video_analysis import analyze_video, VIDEO_EXTENSIONS
+from job_queue import (
+    submit as submit_job, get_job, wait_for_job, queue_metrics, job_image_references,
+    start_workers as start_job_workers
+)
+from analysis_cache import cached_analyze_nutrition_deficiency, cached_segment_analyze_plant, cache_stats
+from memory_budget import memory_report
+from disease_classifier import CLASS_NAMES, get_classifier, classifier_status, leaf_crops
+import feature_classifier  # noqa: F401 — registers the model-free "features" backend
+from plant_check import check_plant_image, log_plant_check
+from upload_decode import read_image_upload, UploadError, request_size_limit, max_body_size
+from image_quality import quality_gate, record_pipeline_time, quality_gate_stats
+from upload_store import upload_store, store_stats
+from disease_knowledge import DiseaseKnowledge, freeze
+from dosage import DOSAGE_CONFIG, to_hectares, severity_multiplier, plan_bulk_dosage
+from functools import lru_cache
+from image_derivatives import (
+    DERIVATIVE_CONFIG, get_derivative, negotiate_format, resolve_static_source
+)
 
 # ===== KISANAI CHATBOT IMPORTS =====
 import time as _time
@@ -54,7 +77,6 @@ from model import db, User, LoginHistory, DiseaseDetection, WeeklyAssessment
 from routes.auth import auth_bp
 
 from nutrition_analyzer import (
-    analyze_nutrition_deficiency,
     calculate_fertilizer_dosage,
     load_nutrition_deficiency_data
 )
@@ -113,6 +135,7 @@ app.config['SERVER_START_TIME'] = SERVER_START_TIME.isoformat()
 # ===== OTHER CONFIGURATIONS =====
 app.config['UPLOAD_FOLDER'] = os.path.join('static', 'uploads')
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg'}
+app.config['MAX_CONTENT_LENGTH'] = max_body_size()
 app.config['DEBUG'] = True
 
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -148,44 +171,17 @@ def preprocess_image(image):
         raise
 
 
-# ===== MODEL: DISABLED FOR RENDER CLOUD DEPLOYMENT =====
+# ===== MODEL: TENSORFLOW REMOVED FOR RENDER CLOUD DEPLOYMENT =====
 # TensorFlow removed to stay within Render free-tier memory limits (512 MB).
-# The model variable is set to None so all model-dependent code gracefully
-# falls through to the cloud-mode placeholder response in /predict.
+# Disease classification now runs on the lightweight int8 ONNX / NumPy
+# backends in disease_classifier.py, loaded lazily on the first /predict.
+# `model` stays None; without a classifier model /predict falls through to
+# the cloud-mode placeholder response.
 model = None
-logger.warning("⚠️  TensorFlow disabled — running in Cloud/Maintenance mode.")
+logger.warning("⚠️  TensorFlow disabled — using disease_classifier backends when a model is present.")
 
 
-def load_disease_treatments():
-    try:
-        treatment_path = 'disease_treatments.json'
-        if os.path.exists(treatment_path):
-            with open(treatment_path, 'r') as f:
-                data = json.load(f)
-                logger.info(f"Successfully loaded disease treatments from {treatment_path}")
-                return data
-        else:
-            logger.error(f"Disease treatments file not found at: {os.path.abspath(treatment_path)}")
-            return {}
-    except (FileNotFoundError, json.JSONDecodeError) as e:
-        logger.error(f"Error loading disease treatments: {e}")
-        return {}
-
-
-class_names = [
-    "Apple_Apple_scab", "Apple_Black_rot", "Apple_Cedar_apple_rust", "Apple_healthy",
-    "Blueberry_healthy", "Cherry_(including_sour)Powdery_mildew", "Cherry(including_sour)_healthy",
-    "Corn_(maize)Cercospora_leaf_spot_Gray_leaf_spot", "Corn(maize)_Common_rust",
-    "Corn_(maize)Northern_Leaf_Blight", "Corn(maize)_healthy", "Grape_Black_rot",
-    "Grape_Esca_(Black_Measles)", "Grape_Leaf_blight_(Isariopsis_Leaf_Spot)", "Grape_healthy",
-    "Orange_Haunglongbing_(Citrus_greening)", "Peach_Bacterial_spot", "Peach_healthy",
-    "Pepper_bell_Bacterial_spot", "Pepper_bell_healthy", "Potato_Early_blight",
-    "Potato_Late_blight", "Potato_healthy", "Raspberry_healthy", "Soybean_healthy",
-    "Squash_Powdery_mildew", "Strawberry_Leaf_scorch", "Strawberry_healthy",
-    "Tomato_Bacterial_spot", "Tomato_Early_blight", "Tomato_Late_blight", "Tomato_Leaf_Mold",
-    "Tomato_Septoria_leaf_spot", "Tomato_Spider_mites_Two-spotted_spider_mite", "Tomato_Target_Spot",
-    "Tomato_Tomato_Yellow_Leaf_Curl_Virus", "Tomato_Tomato_mosaic_virus", "Tomato_healthy"
-]
+class_names = CLASS_NAMES
 
 CONFIDENCE_THRESHOLD = 50.0
 SUPPORTED_PLANTS = {
@@ -261,155 +257,20 @@ COMMON_QUESTIONS = {
     ]
 }
 
-disease_treatments = load_disease_treatments()
-logger.info(f"Loaded {len(disease_treatments)} disease treatments")
-
-
-def normalize_disease_info(disease_info):
-    if not disease_info or 'pesticide' not in disease_info:
-        return disease_info
-
-    import copy
-    normalized = copy.deepcopy(disease_info)
-
-    logger.info("=" * 80)
-    logger.info("📄 NORMALIZING DISEASE INFO FIELDS")
-    logger.info("=" * 80)
-
-    for treatment_type in ['chemical', 'organic']:
-        if treatment_type not in normalized['pesticide']:
-            logger.warning(f"⚠️ No {treatment_type} treatment found")
-            continue
-
-        treatment = normalized['pesticide'][treatment_type]
-        logger.info(f"📦 Processing {treatment_type.upper()} treatment...")
-
-        if 'application_frequency' in treatment and 'frequency' not in treatment:
-            treatment['frequency'] = treatment['application_frequency']
-            logger.info(f"  ✅ Mapped application_frequency -> frequency")
-        elif 'frequency' not in treatment or not treatment.get('frequency'):
-            treatment['frequency'] = "Apply according to product label recommendations and disease pressure."
-            logger.warning(f"  ⚠️ No frequency field found, added fallback")
-
-        if 'precautions' in treatment and 'safety' not in treatment:
-            treatment['safety'] = treatment['precautions']
-            logger.info(f"  ✅ Mapped precautions -> safety")
-        elif 'safety' not in treatment or not treatment.get('safety'):
-            if treatment_type == 'chemical':
-                treatment['safety'] = "Wear protective equipment. Follow all label precautions. Keep away from water sources."
-            else:
-                treatment['safety'] = "Safe for beneficial insects when used as directed. Apply during cooler parts of day."
-            logger.warning(f"  ⚠️ No safety field found, added fallback")
-
-        if 'usage' not in treatment or not treatment.get('usage') or len(treatment.get('usage', '').strip()) < 10:
-            treatment['usage'] = "Apply as directed on product label. Ensure thorough coverage of all affected plant surfaces. Repeat applications as needed based on disease pressure."
-            logger.warning(f"  ⚠️ Missing or short usage, added fallback")
-
-        required_fields = {
-            'name': f"{treatment_type.title()} Treatment",
-            'dosage_per_hectare': 0.0,
-            'unit': 'L',
-            'usage': 'Apply as directed',
-            'frequency': 'As needed',
-            'safety': 'Follow product label instructions'
-        }
-
-        for field, default_value in required_fields.items():
-            if field not in treatment or not treatment.get(field):
-                treatment[field] = default_value
-                logger.warning(f"  ⚠️ Missing {field}, added default: {default_value}")
-
-    logger.info("=" * 80)
-    logger.info("✅ NORMALIZATION COMPLETE")
-    logger.info("=" * 80)
-
-    return normalized
+# Treatment records: normalized + frozen once per file version, hot-reloaded
+disease_knowledge = DiseaseKnowledge('disease_treatments.json')
+logger.info(f"Loaded {len(disease_knowledge)} disease treatments")
 
 
 def get_disease_info(disease_name):
+    """
+    Read-only treatment record for a disease (exact key, alias or fuzzy
+    match; see disease_knowledge.py), or None. Use thaw() for a mutable copy.
+    """
     try:
-        logger.info("=" * 80)
-        logger.info(f"🔍 DISEASE LOOKUP: {disease_name}")
-        logger.info("=" * 80)
-        logger.info(f"📚 Database has {len(disease_treatments)} diseases")
-
-        disease_info = disease_treatments.get(disease_name, None)
-
-        if not disease_info:
-            logger.info(f"⚠️ No exact match, trying variations...")
-            cleaned_name = disease_name.replace('_', ' ').replace('(', '').replace(')', '').strip()
-
-            for key, value in disease_treatments.items():
-                if cleaned_name.lower() in key.lower() or key.lower() in cleaned_name.lower():
-                    disease_info = value
-                    logger.info(f"✅ Found match with key: {key}")
-                    break
-
-        if not disease_info:
+        disease_info = disease_knowledge.get(disease_name)
+        if disease_info is None:
             logger.error(f"❌ NO DISEASE INFO FOUND for: {disease_name}")
-            available = list(disease_treatments.keys())[:5]
-            logger.info(f"📝 Available diseases (first 5): {available}")
-            return None
-
-        logger.info(f"✅ Raw disease info found")
-        logger.info(f"📋 Raw keys: {list(disease_info.keys())}")
-
-        disease_info = normalize_disease_info(disease_info)
-
-        logger.info("=" * 80)
-        logger.info("📊 FINAL VALIDATION")
-        logger.info("=" * 80)
-        logger.info(f"✅ Disease Name: {disease_info.get('name')}")
-        logger.info(f"✅ Description: {len(disease_info.get('description', ''))} chars")
-        logger.info(f"✅ Treatment Steps: {len(disease_info.get('treatment', []))}")
-        logger.info(f"✅ Severity: {disease_info.get('severity')}")
-
-        if 'pesticide' in disease_info:
-            for treatment_type in ['chemical', 'organic']:
-                if treatment_type in disease_info['pesticide']:
-                    t = disease_info['pesticide'][treatment_type]
-                    logger.info(f"")
-                    logger.info(f"📦 {treatment_type.upper()}:")
-                    logger.info(f"  Name: {t.get('name')}")
-                    logger.info(f"  Usage: {len(t.get('usage', ''))} chars - {bool(t.get('usage'))}")
-                    logger.info(f"  Frequency: {len(t.get('frequency', ''))} chars - {bool(t.get('frequency'))}")
-                    logger.info(f"  Safety: {len(t.get('safety', ''))} chars - {bool(t.get('safety'))}")
-                    logger.info(f"  Dosage: {t.get('dosage_per_hectare')} {t.get('unit')}/hectare")
-
-        if 'pesticide' in disease_info:
-            for treatment_type in ['chemical', 'organic']:
-                if treatment_type not in disease_info['pesticide']:
-                    continue
-
-                treatment = disease_info['pesticide'][treatment_type]
-
-                if 'video_sources' in treatment:
-                    video_sources = treatment['video_sources']
-
-                    if 'search_terms' in video_sources:
-                        search_urls = []
-                        for term in video_sources['search_terms']:
-                            search_urls.append({
-                                'term': term,
-                                'url': f"https://www.youtube.com/results?search_query={quote_plus(term)}"
-                            })
-                        video_sources['search_urls'] = search_urls
-                        logger.info(f"✅ Added {len(search_urls)} YouTube URLs for {treatment_type}")
-
-                    if 'reliable_channels' in video_sources:
-                        channel_urls = []
-                        for channel in video_sources['reliable_channels']:
-                            channel_urls.append({
-                                'name': channel,
-                                'url': f"https://www.youtube.com/results?search_query={quote_plus(channel + ' ' + disease_name.replace('_', ' '))}"
-                            })
-                        video_sources['channel_urls'] = channel_urls
-                        logger.info(f"✅ Added {len(channel_urls)} channel URLs for {treatment_type}")
-
-        logger.info("=" * 80)
-        logger.info("✅ DISEASE INFO PROCESSING COMPLETE")
-        logger.info("=" * 80)
-
         return disease_info
 
     except Exception as e:
@@ -418,13 +279,47 @@ def get_disease_info(disease_name):
         return None
 
 
+# Distinct disease combinations kept by combine_disease_treatments()
+COMBINED_PLAN_CACHE_SIZE = 128
+
+
 def combine_disease_treatments(unique_diseases):
+    """
+    Combined treatment plan for a multi-disease result.
+
+    The plan depends only on which diseases were found and on the treatment
+    data, so it is memoized on (frozenset of names, data version) and shared
+    read-only between requests; only the per-disease leaf counts and
+    confidences are filled in per call. Plans built from older treatment
+    data are never hit again and age out of the LRU.
+    """
+    plan, included = _combined_treatment_plan(frozenset(unique_diseases), disease_knowledge.version)
+    combined = dict(plan)
+    combined['diseases'] = [
+        {
+            'name': disease,
+            'display_name': disease.replace('_', ' '),
+            'count': unique_diseases[disease]['count'],
+            'avg_confidence': unique_diseases[disease]['total_confidence'] / unique_diseases[disease]['count']
+        }
+        for disease in included
+    ]
+    return combined
+
+
+@lru_cache(maxsize=COMBINED_PLAN_CACHE_SIZE)
+def _combined_treatment_plan(diseases, version):
+    """
+    (frozen plan, names of the diseases that had treatment records).
+    Diseases are combined in name order so the plan doesn't depend on
+    the order they were detected in. `version` only keys the cache.
+    """
     logger.info("=" * 80)
     logger.info("🔀 COMBINING TREATMENTS FROM MULTIPLE DISEASES")
     logger.info("=" * 80)
 
+    included = []
     combined = {
-        'diseases': [],
         'description': '',
         'treatment': [],
         'severity': 'Unknown',
@@ -468,22 +363,16 @@ def combine_disease_treatments(unique_diseases):
     unique_treatments = set()
     unique_guides = set()
 
-    logger.info(f"📊 Processing {len(unique_diseases)} diseases...")
+    logger.info(f"📊 Processing {len(diseases)} diseases...")
 
-    for disease, data in unique_diseases.items():
-        disease_info = data['disease_info']
+    for disease in sorted(diseases):
+        disease_info = get_disease_info(disease)
         if not disease_info:
             logger.warning(f"⚠️ No disease info for {disease}")
             continue
 
         logger.info(f"   Processing: {disease}")
-
-        combined['diseases'].append({
-            'name': disease,
-            'display_name': disease.replace('_', ' '),
-            'count': data['count'],
-            'avg_confidence': data['total_confidence'] / data['count']
-        })
+        included.append(disease)
 
         if disease_info.get('description'):
             combined['description'] += f"**{disease.replace('_', ' ')}**: {disease_info['description']}\n\n"
@@ -533,7 +422,11 @@ def combine_disease_treatments(unique_diseases):
                     if safety not in combined['pesticide'][treatment_type]['safety']:
                         combined['pesticide'][treatment_type]['safety'].append(safety)
 
-                dosage = treatment.get('dosage_per_hectare', 0)
+                try:
+                    dosage = float(treatment.get('dosage_per_hectare', 0) or 0)
+                except (TypeError, ValueError):
+                    logger.warning(f"⚠️ Non-numeric {treatment_type} dosage_per_hectare for {disease} — counted as 0")
+                    dosage = 0.0
                 combined['pesticide'][treatment_type]['dosage_per_hectare'] += dosage
 
                 if treatment.get('video_sources'):
@@ -574,7 +467,7 @@ def combine_disease_treatments(unique_diseases):
             combined['pesticide'][treatment_type]['usage'] = "Apply treatments according to product labels for each specific disease."
 
         if combined['pesticide'][treatment_type]['frequency']:
-            unique_freq = list(set(combined['pesticide'][treatment_type]['frequency']))
+            unique_freq = combined['pesticide'][treatment_type]['frequency']  # deduplicated on insert
             if len(unique_freq) == 1:
                 combined['pesticide'][treatment_type]['frequency'] = unique_freq[0]
             else:
@@ -584,12 +477,12 @@ def combine_disease_treatments(unique_diseases):
 
         if combined['pesticide'][treatment_type]['safety']:
             combined['pesticide'][treatment_type]['safety'] = " • ".join(
-                list(set(combined['pesticide'][treatment_type]['safety']))
+                combined['pesticide'][treatment_type]['safety']
             )
         else:
             combined['pesticide'][treatment_type]['safety'] = "Follow all safety guidelines on product labels. Wear protective equipment."
 
-        num_diseases = len(unique_diseases)
+        num_diseases = len(diseases)
         if num_diseases > 0 and combined['pesticide'][treatment_type]['dosage_per_hectare'] > 0:
             combined['pesticide'][treatment_type]['dosage_per_hectare'] /= num_diseases
             logger.info(f"   {treatment_type.title()} avg dosage: {combined['pesticide'][treatment_type]['dosage_per_hectare']:.2f}")
@@ -615,12 +508,12 @@ def combine_disease_treatments(unique_diseases):
 
     logger.info("=" * 80)
     logger.info("✅ COMBINED TREATMENT PLAN READY")
-    logger.info(f"   Diseases: {len(combined['diseases'])}")
+    logger.info(f"   Diseases: {len(included)}")
     logger.info(f"   Treatment steps: {len(combined['treatment'])}")
     logger.info(f"   Overall severity: {combined['severity']}")
     logger.info("=" * 80)
 
-    return combined
+    return freeze(combined), tuple(included)
 
 
 def calculate_dosage(area, area_unit, pesticide_info, infection_pct=100.0):
@@ -669,13 +562,7 @@ def calculate_dosage(area, area_unit, pesticide_info, infection_pct=100.0):
                 logger.warning(f"⚠️ Invalid/zero area ({area}) — defaulting to 1 ha for display")
                 area_float = 1.0
 
-            conversion_factors = {
-                'hectare': 1.0,
-                'acre': 0.404686,
-                'square_meter': 0.0001,
-                'square_feet': 0.0000092903
-            }
-            hectare_conversion = area_float * conversion_factors.get(area_unit, 1.0)
+            hectare_conversion = to_hectares(area_float, area_unit)
             logger.info(f"📐 Total area: {area_float} {area_unit} = {hectare_conversion:.4f} ha")
 
         except (ValueError, TypeError) as e:
@@ -683,28 +570,20 @@ def calculate_dosage(area, area_unit, pesticide_info, infection_pct=100.0):
             hectare_conversion = 1.0
 
         effective_hectares = hectare_conversion * (infection_pct / 100.0)
-
-        if infection_pct >= 75:
-            severity_multiplier = 1.25
-        elif infection_pct >= 50:
-            severity_multiplier = 1.10
-        elif infection_pct >= 25:
-            severity_multiplier = 1.00
-        else:
-            severity_multiplier = 0.85
+        dosage_multiplier = severity_multiplier(infection_pct)
 
         logger.info(f"📊 Effective area (infected): {effective_hectares:.4f} ha")
-        logger.info(f"📊 Severity multiplier: x{severity_multiplier}")
+        logger.info(f"📊 Severity multiplier: x{dosage_multiplier}")
 
         if chemical_dosage_per_hectare > 0:
-            chemical_dosage = chemical_dosage_per_hectare * effective_hectares * severity_multiplier
-            logger.info(f"✅ Chemical dosage: {chemical_dosage_per_hectare} × {effective_hectares:.4f} × {severity_multiplier} = {chemical_dosage:.4f}")
+            chemical_dosage = chemical_dosage_per_hectare * effective_hectares * dosage_multiplier
+            logger.info(f"✅ Chemical dosage: {chemical_dosage_per_hectare} × {effective_hectares:.4f} × {dosage_multiplier} = {chemical_dosage:.4f}")
         else:
             logger.warning("⚠️ Chemical dosage_per_hectare is 0 or missing")
 
         if organic_dosage_per_hectare > 0:
-            organic_dosage = organic_dosage_per_hectare * effective_hectares * severity_multiplier
-            logger.info(f"✅ Organic dosage: {organic_dosage_per_hectare} × {effective_hectares:.4f} × {severity_multiplier} = {organic_dosage:.4f}")
+            organic_dosage = organic_dosage_per_hectare * effective_hectares * dosage_multiplier
+            logger.info(f"✅ Organic dosage: {organic_dosage_per_hectare} × {effective_hectares:.4f} × {dosage_multiplier} = {organic_dosage:.4f}")
         else:
             logger.warning("⚠️ Organic dosage_per_hectare is 0 or missing")
 
@@ -713,7 +592,7 @@ def calculate_dosage(area, area_unit, pesticide_info, infection_pct=100.0):
         logger.info(f"   Total area:        {hectare_conversion:.4f} ha")
         logger.info(f"   Infection %:        {infection_pct}%")
         logger.info(f"   Effective area:    {effective_hectares:.4f} ha")
-        logger.info(f"   Severity mult:     x{severity_multiplier}")
+        logger.info(f"   Severity mult:     x{dosage_multiplier}")
         logger.info(f"   Chemical dosage:   {chemical_dosage}")
         logger.info(f"   Organic  dosage:   {organic_dosage}")
         logger.info("=" * 60)
@@ -734,123 +613,17 @@ def calculate_dosage(area, area_unit, pesticide_info, infection_pct=100.0):
 def is_plant_image(image_path):
     """
     Check if the uploaded image is likely a plant image using multiple validation techniques.
+    Criteria run cheapest-first on a thumbnail and stop as soon as the
+    decision is settled (see plant_check.py).
     """
     try:
-        img = cv2.imread(image_path)
-        if img is None:
+        result = check_plant_image(image_path)
+        if result["exit"] == "unreadable":
             logger.warning("Could not read image file")
             return False
 
-        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
-        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
-
-        green_ranges = [
-            ([35, 50, 50], [85, 255, 255]),
-            ([25, 30, 30], [75, 255, 200]),
-            ([15, 40, 40], [35, 255, 255])
-        ]
-
-        total_green_pixels = 0
-        for lower, upper in green_ranges:
-            mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
-            total_green_pixels += cv2.countNonZero(mask)
-
-        total_pixels = img.shape[0] * img.shape[1]
-        green_ratio = total_green_pixels / total_pixels
-
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        texture_variance = np.var(gray)
-
-        edges = cv2.Canny(gray, 50, 150)
-        edge_pixels = cv2.countNonZero(edges)
-        edge_ratio = edge_pixels / total_pixels
-
-        color_std = np.std(rgb, axis=(0, 1))
-        color_mean = np.mean(color_std)
-
-        brightness = np.mean(gray)
-        contrast = np.std(gray)
-
-        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        organic_shapes = 0
-        for contour in contours:
-            area = cv2.contourArea(contour)
-            if area > 100:
-                perimeter = cv2.arcLength(contour, True)
-                if perimeter > 0:
-                    circularity = 4 * np.pi * area / (perimeter * perimeter)
-                    if 0.1 < circularity < 0.8:
-                        organic_shapes += 1
-
-        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=50, minLineLength=50, maxLineGap=10)
-        straight_lines = len(lines) if lines is not None else 0
-
-        horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (25, 1))
-        horizontal_lines = cv2.morphologyEx(edges, cv2.MORPH_OPEN, horizontal_kernel)
-        text_like_pixels = cv2.countNonZero(horizontal_lines)
-        text_ratio = text_like_pixels / total_pixels
-
-        height, width = img.shape[:2]
-
-        is_reasonable_size = height > 100 and width > 100
-        has_significant_green = green_ratio > 0.12
-        has_organic_texture = texture_variance > 500
-        has_natural_edges = 0.02 < edge_ratio < 0.25
-        has_natural_colors = color_mean > 15
-        reasonable_brightness = 30 < brightness < 220
-        good_contrast = contrast > 20
-        has_organic_shapes = organic_shapes > 0
-        not_too_geometric = straight_lines < 10
-        not_text_heavy = text_ratio < 0.05
-
-        score = 0
-        criteria_met = []
-
-        if has_significant_green:
-            score += 3
-            criteria_met.append("green_content")
-        if has_organic_texture:
-            score += 2
-            criteria_met.append("organic_texture")
-        if has_natural_edges:
-            score += 2
-            criteria_met.append("natural_edges")
-        if has_natural_colors:
-            score += 1
-            criteria_met.append("natural_colors")
-        if reasonable_brightness:
-            score += 1
-            criteria_met.append("good_brightness")
-        if good_contrast:
-            score += 1
-            criteria_met.append("good_contrast")
-        if has_organic_shapes:
-            score += 2
-            criteria_met.append("organic_shapes")
-        if not_too_geometric:
-            score += 1
-            criteria_met.append("not_geometric")
-        if not_text_heavy:
-            score += 1
-            criteria_met.append("not_text_heavy")
-
-        logger.info(f"Plant image analysis for {image_path}:")
-        logger.info(f"  - Green ratio: {green_ratio:.3f} (threshold: 0.12)")
-        logger.info(f"  - Texture variance: {texture_variance:.1f} (threshold: 500)")
-        logger.info(f"  - Edge ratio: {edge_ratio:.3f} (range: 0.02-0.25)")
-        logger.info(f"  - Color variation: {color_mean:.1f} (threshold: 15)")
-        logger.info(f"  - Brightness: {brightness:.1f} (range: 30-220)")
-        logger.info(f"  - Contrast: {contrast:.1f} (threshold: 20)")
-        logger.info(f"  - Organic shapes: {organic_shapes}")
-        logger.info(f"  - Straight lines: {straight_lines} (threshold: <10)")
-        logger.info(f"  - Text ratio: {text_ratio:.3f} (threshold: <0.05)")
-        logger.info(f"  - Total score: {score}/14")
-        logger.info(f"  - Criteria met: {criteria_met}")
-
-        is_plant = (score >= 7 and has_significant_green and is_reasonable_size)
-        logger.info(f"  - Final decision: {'PLANT' if is_plant else 'NOT PLANT'}")
-
-        return is_plant
+        log_plant_check(image_path, result)
+        return result["is_plant"]
 
     except Exception as e:
         logger.error(f"Error in enhanced plant image validation: {e}")
@@ -937,6 +710,62 @@ def get_detailed_error_message(error_type, image_analysis=None):
                 "Ensure the image clearly shows the plant type"
             ]
         }
+    elif error_type == "blurry":
+        return {
+            "title": "Photo Is Out of Focus",
+            "message": "The leaves in this photo are too blurred to measure disease or deficiency spots.",
+            "suggestions": [
+                "Hold the phone steady, or rest it on something, while taking the photo",
+                "Tap the leaf on the screen so the camera focuses on it",
+                "Keep about 20-30 cm between the camera and the leaf",
+                "Wipe the camera lens before taking the photo"
+            ],
+            "technical_details": image_analysis
+        }
+    elif error_type == "underexposed":
+        return {
+            "title": "Photo Is Too Dark",
+            "message": "There is not enough light in this photo to see the leaf colours.",
+            "suggestions": [
+                "Take the photo in daylight",
+                "Avoid photographing leaves in deep shade or at dusk",
+                "Do not cover the flash or light sensor"
+            ],
+            "technical_details": image_analysis
+        }
+    elif error_type == "overexposed":
+        return {
+            "title": "Photo Is Too Bright",
+            "message": "The photo is washed out, so leaf colours and spots cannot be seen.",
+            "suggestions": [
+                "Avoid direct midday sun on the leaf — shade it with your hand or body",
+                "Do not point the camera towards the sun",
+                "Turn off the flash for close-up photos"
+            ],
+            "technical_details": image_analysis
+        }
+    elif error_type == "low_leaf_coverage":
+        return {
+            "title": "Not Enough Leaf in the Photo",
+            "message": "Leaves cover only a small part of this photo.",
+            "suggestions": [
+                "Move closer so the affected leaves fill most of the frame",
+                "Keep soil, sky and background out of the photo where possible",
+                "Photograph one plant at a time"
+            ],
+            "technical_details": image_analysis
+        }
+    elif error_type == "too_small":
+        return {
+            "title": "Photo Resolution Too Low",
+            "message": "The photo is too small to analyse individual leaves.",
+            "suggestions": [
+                "Upload the original photo instead of a thumbnail or screenshot",
+                "Check that your messaging app did not compress the photo",
+                "Use the phone's normal camera mode"
+            ],
+            "technical_details": image_analysis
+        }
     else:
         return {
             "title": "Analysis Error",
@@ -949,6 +778,21 @@ def get_detailed_error_message(error_type, image_analysis=None):
         }
 
 
+def quality_rejection_page(quality, back_link):
+    """error.html with get_detailed_error_message() feedback for a quality-gate rejection."""
+    details = get_detailed_error_message(quality['issues'][0]['type'], quality['metrics'])
+    return render_template(
+        "error.html",
+        back_link     = back_link,
+        error_message = details['message'],
+        error_details = {
+            'reason'     : details['title'],
+            'issues'     : [issue['message'] for issue in quality['issues']],
+            'suggestions': details['suggestions'],
+        },
+    )
+
+
 def initialize_enhanced_gemini():
     """AI removed - chatbot runs in rule-based mode only"""
     return False, "AI not configured"
@@ -1418,6 +1262,37 @@ def init_database():
             logger.warning(f"⚠️ Auto-migration warning: {_me}")
 
 
+# Single-image upload routes → page to send the user back to on rejection
+UPLOAD_BACK_LINKS = {
+    'analyze'            : '/detection-tool',
+    'analyze_nutrition'  : '/nutrition-testing',
+    'submit_expert'      : '/talk-to-expert',
+    'predict_batch'      : '/detection-tool',
+    'analyze_combined'   : '/detection-tool',
+    'submit_analysis_job': '/detection-tool',
+}
+
+# Upload routes that answer in JSON / accept several photos per request
+JSON_UPLOAD_ENDPOINTS  = {'predict_batch', 'analyze_combined', 'submit_analysis_job'}
+BATCH_UPLOAD_ENDPOINTS = {'predict_batch'}
+
+
+@app.before_request
+def reject_oversized_uploads():
+    """Refuse oversized uploads from Content-Length, before the body is parsed."""
+    back_link = UPLOAD_BACK_LINKS.get(request.endpoint)
+    if back_link is None or request.content_length is None:
+        return
+    limit = request_size_limit(batch=request.endpoint in BATCH_UPLOAD_ENDPOINTS)
+    if request.content_length > limit:
+        logger.warning(f"⚠️ Rejected {request.content_length} byte upload to {request.path} (limit {limit})")
+        message = f"Upload is too large (maximum {limit // (1024 * 1024)} MB)."
+        if request.endpoint in JSON_UPLOAD_ENDPOINTS:
+            return jsonify({'success': False, 'error': message}), 413
+        flash(f"Error: {message}", "error")
+        return render_template("error.html", back_link=back_link), 413
+
+
 @app.before_request
 def validate_session():
     if request.endpoint and (
@@ -1425,7 +1300,8 @@ def validate_session():
         request.endpoint.startswith('auth.') or
         request.endpoint == 'index' or
         request.endpoint == 'health_check' or
-        request.endpoint == 'api_info'
+        request.endpoint == 'api_info' or
+        request.endpoint == 'image_variant'
     ):
         return
 
@@ -1700,7 +1576,7 @@ def chat_status():
             'ai_available': False,
             'detected_disease': detected_disease,
             'detection_time': detection_time,
-            'model_loaded': model is not None,
+            'model_loaded': classifier_status()['loaded'],
             'supported_plants': len(SUPPORTED_PLANTS)
         })
     except Exception as e:
@@ -1961,6 +1837,113 @@ def upload_file():
 from flask_login import login_required, current_user
 
 
+# ============================================================================
+# LEAF CLASSIFICATION (lightweight ONNX / NumPy backends)
+# ============================================================================
+
+def plant_type_for_class(disease_class):
+    """SUPPORTED_PLANTS name for a classifier label ('Detected Plant' if unknown)."""
+    for plant, classes in SUPPORTED_PLANTS.items():
+        if disease_class in classes:
+            return plant
+    return "Detected Plant"
+
+
+def classify_plant_leaves(image_path, reduced_decode=None, profile=None):
+    """
+    Segment the photo with segment2 and classify every leaf crop in one
+    batched forward pass. Returns None when no classifier model is
+    available, so callers keep their placeholder behaviour.
+    `image_path` may also be the uploaded bytes (see upload_decode).
+    """
+    classifier = get_classifier()
+    if classifier is None:
+        return None
+
+    workspace = AnalysisWorkspace()
+    stage = prepare_segmentation(image_path, profile=profile, reduced_decode=reduced_decode)
+    leaf_results, plant_severity, plant_level = segment_analyze_plant(
+        image_path, workspace=workspace, stage=stage
+    )
+
+    # No separable leaves → classify the whole segmented plant
+    crops = leaf_crops(stage["segmented"], leaf_results) or [stage["segmented"]]
+    t0 = _time.time()
+    predictions = classifier.classify(crops)
+    logger.info(f"🧠 Classified {len(crops)} crop(s) with {classifier.name} in {_time.time() - t0:.3f}s")
+
+    all_predictions = []
+    unique_diseases = {}
+    for leaf, prediction in zip(leaf_results, predictions):
+        name = prediction["predicted_class"]
+        all_predictions.append({
+            "leaf_number"         : leaf["leaf_number"],
+            "leaf_url"            : "/" + leaf["leaf"].replace(os.sep, "/"),
+            "leaf_area"           : leaf["leaf_area"],
+            "predicted_class"     : name,
+            "confidence"          : prediction["confidence"],
+            "top_predictions"     : prediction["top_predictions"],
+            "color_severity"      : leaf["severity_percent"],
+            "color_severity_level": leaf["severity_level"],
+        })
+        entry = unique_diseases.setdefault(name, {"count": 0, "total_confidence": 0.0, "leaves": []})
+        entry["count"] += 1
+        entry["total_confidence"] += prediction["confidence"]
+        entry["leaves"].append(leaf["leaf_number"])
+
+    if unique_diseases:
+        # Most leaves wins; summed confidence breaks ties
+        predicted_class = max(
+            unique_diseases, key=lambda k: (unique_diseases[k]["count"], unique_diseases[k]["total_confidence"])
+        )
+        confidence = unique_diseases[predicted_class]["total_confidence"] / unique_diseases[predicted_class]["count"]
+    else:
+        predicted_class = predictions[0]["predicted_class"]
+        confidence = predictions[0]["confidence"]
+
+    for name, entry in unique_diseases.items():
+        entry["disease_info"] = get_disease_info(name)
+
+    return {
+        "predicted_class"     : predicted_class,
+        "confidence"          : round(confidence, 2),
+        "plant_type"          : plant_type_for_class(predicted_class),
+        "all_predictions"     : all_predictions,
+        "unique_diseases"     : unique_diseases,
+        "leaf_results"        : leaf_results,
+        "plant_severity"      : plant_severity,
+        "plant_severity_level": plant_level,
+        "job_id"              : workspace.job_id,
+        "backend"             : classifier.name,
+    }
+
+
+def weekly_treatment_fields(backend, treatment_source=None, chemical_dosage=None, confidence=None):
+    """
+    Treatment columns for a WeeklyAssessment row. A classifier diagnosis
+    records its recommended chemical treatment and dosage; the cloud-mode
+    placeholders are only used when no classifier backend ran.
+    """
+    if backend is None:
+        return {
+            'pesticide_used'    : 'N/A — Cloud Mode',
+            'pesticide_type'    : 'none',
+            'dosage_applied'    : 0.0,
+            'application_method': 'N/A',
+            'farmer_notes'      : 'Recorded during cloud/maintenance deployment.',
+        }
+
+    chemical = ((treatment_source or {}).get('pesticide') or {}).get('chemical') or {}
+    return {
+        'pesticide_used'    : chemical.get('name') or 'Not specified',
+        'pesticide_type'    : 'chemical' if chemical else 'none',
+        'dosage_applied'    : round(float(chemical_dosage or 0.0), 4),
+        'application_method': 'Spray' if chemical else 'N/A',
+        'farmer_notes'      : f'Diagnosed by the {backend} classifier ({confidence}% confidence); '
+                              'recommended treatment recorded.',
+    }
+
+
 # ============================================================================
 # /predict — CLOUD MODE WITH FULL WEEKLY ASSESSMENT CONTINUITY
 # ============================================================================
@@ -1973,11 +1956,16 @@ def analyze():
 
     TensorFlow / .h5 model has been removed to stay within Render free-tier
     memory limits (512 MB).  This route:
-      - Saves the uploaded image
+      - Validates the upload from its header and decodes it from memory
+        (see upload_decode.py); the original is written to the upload store
+        in the background (see upload_store.py)
+      - Classifies every segmented leaf with the lightweight disease
+        classifier when a model is installed (see disease_classifier.py)
       - Calls analyze_weekly_progress() so the week counter advances each upload
       - Calls save_weekly_assessment()  so dashboard graphs stay populated
       - Records a DiseaseDetection row so the history log keeps updating
-      - Renders result1.html with a maintenance placeholder
+      - Renders result1.html with the prediction, or a maintenance
+        placeholder when no classifier model is available
 
     Dashboard continuity is preserved: every upload creates a new weekly
     data-point even while the AI model is offline.
@@ -2009,6 +1997,18 @@ def analyze():
         flash("Error: Invalid file type. Please upload PNG, JPG, or JPEG.", "error")
         return render_template("error.html", back_link="/detection-tool")
 
+    try:
+        upload = read_image_upload(image_file)
+    except UploadError as e:
+        logger.warning(f"⚠️ Rejected upload ({e.error_type}): {e}")
+        flash(f"Error: {e}", "error")
+        return render_template("error.html", back_link="/detection-tool")
+
+    # ── Quality gate: blurred / badly exposed / leafless photos stop here ────
+    quality = quality_gate(upload.data, "disease")
+    if not quality['ok']:
+        return quality_rejection_page(quality, "/detection-tool")
+
     try:
         # ── Get form data ─────────────────────────────────────────────────────
         location   = request.form.get("location", "").strip()
@@ -2033,16 +2033,68 @@ def analyze():
             logger.warning(f"⚠️ Could not save user profile data: {user_save_error}")
             db.session.rollback()
 
-        # ── Save uploaded image ───────────────────────────────────────────────
-        image_filename = str(uuid.uuid4()) + os.path.splitext(image_file.filename)[1]
-        image_path     = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-        image_file.save(image_path)
-        logger.info(f"✅ Image saved to: {image_path}")
+        # ── Store uploaded image (background; analysis decodes from memory) ──
+        image_filename, image_saved = upload_store.put_async(upload.data)
+
+        # ── Classify leaves (falls back to the placeholder without a model) ───
+        classification = None
+        try:
+            classify_start = _time.time()
+            classification = classify_plant_leaves(upload.data, reduced_decode=True)
+            if classification:
+                record_pipeline_time("disease", _time.time() - classify_start)
+        except Exception as classify_error:
+            logger.error(f"⚠️ Leaf classification failed (using placeholder): {classify_error}")
+            logger.error(traceback.format_exc())
+
+        if classification:
+            predicted_class     = classification['predicted_class']
+            confidence          = classification['confidence']
+            dominant_plant_type = classification['plant_type']
+            plant_severity      = classification['plant_severity']
+            plant_severity_level= classification['plant_severity_level']
+            overall_severity    = plant_severity_level
+            all_predictions     = classification['all_predictions']
+            unique_diseases     = classification['unique_diseases']
+            is_multi_disease    = len(unique_diseases) > 1
+            logger.info(f"✅ Prediction: {predicted_class} ({confidence}%) via {classification['backend']}")
+        else:
+            # ── Cloud-mode placeholder values ─────────────────────────────────
+            predicted_class     = "Cloud Mode — Review Required"
+            confidence          = 0.0
+            overall_severity    = "Maintenance"
+            dominant_plant_type = "Detected Plant"
+            plant_severity      = 0
+            plant_severity_level= "N/A"
+            all_predictions     = []
+            unique_diseases     = {}
+            is_multi_disease    = False
+
+        # ── Disease info + infection-aware dosage ─────────────────────────────
+        disease_info        = None
+        combined_treatments = None
+        chemical_dosage     = None
+        organic_dosage      = None
+        hectare_conversion  = 0
+        try:
+            infection_percent = max(1.0, min(100.0, float(request.form.get("infection_percent", 50))))
+        except (ValueError, TypeError):
+            infection_percent = 50.0
+        effective_pct = max(1.0, min(100.0, max(infection_percent, plant_severity)))
 
-        # ── Cloud-mode placeholder values ─────────────────────────────────────
-        predicted_class    = "Cloud Mode — Review Required"
-        overall_severity   = "Maintenance"
-        dominant_plant_type = "Detected Plant"
+        treatment_source    = None
+        if classification:
+            if predicted_class in unique_diseases:
+                disease_info = unique_diseases[predicted_class]['disease_info']
+            else:
+                disease_info = get_disease_info(predicted_class)
+            if is_multi_disease:
+                combined_treatments = combine_disease_treatments(unique_diseases)
+            treatment_source = combined_treatments or disease_info
+            if treatment_source and 'pesticide' in treatment_source:
+                chemical_dosage, organic_dosage, hectare_conversion = calculate_dosage(
+                    area, area_unit, treatment_source['pesticide'], infection_pct=effective_pct
+                )
 
         # ── Determine detection mode from session ─────────────────────────────
         # Honour whatever mode the user set via /api/plant-session/set;
@@ -2054,8 +2106,8 @@ def analyze():
         current_detection_data = {
             'disease'            : predicted_class,
             'severity'           : overall_severity,
-            'color_severity'     : 0,
-            'affected_percentage': 0,
+            'color_severity'     : plant_severity,
+            'affected_percentage': plant_severity,
             'image_filename'     : image_filename,
         }
 
@@ -2096,14 +2148,13 @@ def analyze():
             save_detection_data = {
                 'disease'           : predicted_class,
                 'severity'          : overall_severity,
-                'color_severity'    : 0,
-                'affected_percentage': 0,
+                'color_severity'    : plant_severity,
+                'affected_percentage': plant_severity,
                 'image_filename'    : image_filename,
-                'pesticide_used'    : 'N/A — Cloud Mode',
-                'pesticide_type'    : 'none',
-                'dosage_applied'    : 0.0,
-                'application_method': 'N/A',
-                'farmer_notes'      : 'Recorded during cloud/maintenance deployment.',
+                **weekly_treatment_fields(
+                    classification['backend'] if classification else None,
+                    treatment_source, chemical_dosage, confidence
+                ),
             }
             save_weekly_assessment(
                 current_user.id,
@@ -2122,7 +2173,7 @@ def analyze():
             detection = DiseaseDetection(
                 user_id              = current_user.id,
                 detected_disease     = predicted_class,
-                confidence           = 0.0,
+                confidence           = confidence,
                 severity             = overall_severity,
                 plant_type           = dominant_plant_type,
                 image_filename       = image_filename,
@@ -2130,15 +2181,15 @@ def analyze():
                 farm_area            = area_float,
                 farm_area_unit       = area_unit,
                 farm_location        = location,
-                total_leaves_analyzed= 0,
-                unique_diseases_count= 0,
-                is_multi_disease     = False,
-                chemical_dosage      = None,
-                organic_dosage       = None
+                total_leaves_analyzed= len(all_predictions),
+                unique_diseases_count= len(unique_diseases),
+                is_multi_disease     = is_multi_disease,
+                chemical_dosage      = chemical_dosage,
+                organic_dosage       = organic_dosage
             )
             db.session.add(detection)
             db.session.commit()
-            logger.info("✅ Detection record saved to database (cloud-mode)")
+            logger.info("✅ Detection record saved to database")
         except Exception as db_error:
             logger.error(f"❌ Could not save detection record: {db_error}")
             db.session.rollback()
@@ -2148,51 +2199,55 @@ def analyze():
             with open("detected_disease.json", "w") as f:
                 json.dump({
                     "disease"    : predicted_class,
-                    "confidence" : 0.0,
+                    "confidence" : confidence,
                     "severity"   : overall_severity,
                     "plant_type" : dominant_plant_type,
                     "timestamp"  : str(datetime.now()),
-                    "cloud_mode" : True
+                    "cloud_mode" : classification is None
                 }, f, indent=2)
         except Exception as json_error:
             logger.warning(f"⚠️ Could not write detected_disease.json: {json_error}")
 
         # ── Build disease_info placeholder for the result page ────────────────
-        disease_info = {
-            "name"       : "Manual Review Required",
-            "description": (
-                "The AI prediction engine is currently in maintenance mode for "
-                "the cloud deployment. Your image has been logged successfully and "
-                "your weekly progress record has been updated. "
-                "Please use the KisanAI Chatbot for immediate crop advice or "
-                "visit the 'Talk to Expert' section to send this photo to our team."
-            ),
-            "treatment"  : [
-                "Use the KisanAI Chatbot below for immediate disease guidance.",
-                "Upload clear photos of affected leaves and describe symptoms.",
-                "Consult the 'Talk to Expert' section to reach our agronomists.",
-                "Check the Plant Library for common disease identification tips.",
-            ],
-            "severity"   : overall_severity,
-            "pesticide"  : {
-                "chemical": {
-                    "name"               : "Consult Chatbot / Expert",
-                    "dosage_per_hectare" : 0,
-                    "unit"               : "L",
-                    "usage"              : "Please use the KisanAI Chatbot for treatment recommendations.",
-                    "frequency"          : "N/A",
-                    "safety"             : "Always follow product label instructions."
-                },
-                "organic" : {
-                    "name"               : "Consult Chatbot / Expert",
-                    "dosage_per_hectare" : 0,
-                    "unit"               : "L",
-                    "usage"              : "Please use the KisanAI Chatbot for organic treatment recommendations.",
-                    "frequency"          : "N/A",
-                    "safety"             : "Safe for environment — always follow label."
+        # (no classifier model, or no treatment record for the predicted class)
+        if not disease_info:
+            disease_info = {
+                "name"       : "Manual Review Required",
+                "description": (
+                    ("The AI prediction engine is currently in maintenance mode for "
+                     "the cloud deployment. " if classification is None else
+                     f"No treatment record is available for {predicted_class.replace('_', ' ')}. ") +
+                    "Your image has been logged successfully and "
+                    "your weekly progress record has been updated. "
+                    "Please use the KisanAI Chatbot for immediate crop advice or "
+                    "visit the 'Talk to Expert' section to send this photo to our team."
+                ),
+                "treatment"  : [
+                    "Use the KisanAI Chatbot below for immediate disease guidance.",
+                    "Upload clear photos of affected leaves and describe symptoms.",
+                    "Consult the 'Talk to Expert' section to reach our agronomists.",
+                    "Check the Plant Library for common disease identification tips.",
+                ],
+                "severity"   : overall_severity,
+                "pesticide"  : {
+                    "chemical": {
+                        "name"               : "Consult Chatbot / Expert",
+                        "dosage_per_hectare" : 0,
+                        "unit"               : "L",
+                        "usage"              : "Please use the KisanAI Chatbot for treatment recommendations.",
+                        "frequency"          : "N/A",
+                        "safety"             : "Always follow product label instructions."
+                    },
+                    "organic" : {
+                        "name"               : "Consult Chatbot / Expert",
+                        "dosage_per_hectare" : 0,
+                        "unit"               : "L",
+                        "usage"              : "Please use the KisanAI Chatbot for organic treatment recommendations.",
+                        "frequency"          : "N/A",
+                        "safety"             : "Safe for environment — always follow label."
+                    }
                 }
             }
-        }
 
         # ── Determine whether to show dosage-change banner on result page ─────
         show_dosage_change = (
@@ -2200,7 +2255,10 @@ def analyze():
             assessment_result.get('dosage_recommendation') != 'maintain'
         )
 
-        logger.info("📦 Rendering cloud-mode result page")
+        image_saved.result()  # the result page links the stored image
+        logger.info(f"✅ Image stored as: {image_filename}")
+
+        logger.info(f"📦 Rendering {'prediction' if classification else 'cloud-mode'} result page")
         logger.info(f"   Week number  : {assessment_result.get('week_number', 1)}")
         logger.info(f"   Show dosage  : {show_dosage_change}")
         logger.info("=" * 80)
@@ -2211,25 +2269,26 @@ def analyze():
             # ── Images ────────────────────────────────────────────────────────
             image_url          = url_for("static", filename=f"uploads/{image_filename}"),
             gradcam_url        = None,
-            heatmap_url        = None,
+            heatmap_url        = (url_for("job_heatmap", job_id=classification["job_id"])
+                                  if classification else None),
             segmented_image_url= None,
 
-            # ── Prediction data (placeholder) ─────────────────────────────────
+            # ── Prediction data (placeholder without a classifier model) ──────
             predicted_class    = predicted_class,
-            confidence         = 0.0,
+            confidence         = confidence,
             severity           = overall_severity,
-            total_leaves       = 0,
-            all_predictions    = [],
+            total_leaves       = len(all_predictions),
+            all_predictions    = all_predictions,
 
             # ── Plant & disease info ──────────────────────────────────────────
             dominant_plant_type= dominant_plant_type,
-            unique_diseases    = None,
-            combined_treatments= None,
-            is_multi_disease   = False,
+            unique_diseases    = unique_diseases or None,
+            combined_treatments= combined_treatments,
+            is_multi_disease   = is_multi_disease,
 
             # ── Plant severity ────────────────────────────────────────────────
-            plant_severity       = 0,
-            plant_severity_level = "N/A",
+            plant_severity       = plant_severity,
+            plant_severity_level = plant_severity_level,
 
             # ── Disease information ───────────────────────────────────────────
             result             = disease_info,
@@ -2240,19 +2299,19 @@ def analyze():
             location           = location,
 
             # ── Dosage (not calculated in cloud mode) ─────────────────────────
-            chemical_dosage    = None,
-            organic_dosage     = None,
-            hectare_conversion = 0,
+            chemical_dosage    = chemical_dosage,
+            organic_dosage     = organic_dosage,
+            hectare_conversion = hectare_conversion,
 
             # ── Infection-aware fields ────────────────────────────────────────
-            infection_percent      = 0,
-            plant_severity_pct     = 0,
-            effective_infection_pct= 0,
-            area_in_hectares       = 0,
-            effective_area_hectares= 0,
+            infection_percent      = infection_percent if classification else 0,
+            plant_severity_pct     = plant_severity,
+            effective_infection_pct= effective_pct if classification else 0,
+            area_in_hectares       = hectare_conversion,
+            effective_area_hectares= hectare_conversion * effective_pct / 100.0 if classification else 0,
 
             # ── Leaf results ──────────────────────────────────────────────────
-            leaf_results       = [],
+            leaf_results       = all_predictions,
 
             # ── Comparison / history ──────────────────────────────────────────
             has_previous       = False,
@@ -2281,19 +2340,348 @@ def analyze():
 # ============================================================================
 
 
+# ============================================================================
+# /predict-batch — N PHOTOS OF ONE FIELD, ONE ASSESSMENT
+# ============================================================================
+
+MAX_BATCH_IMAGES   = 20
+BATCH_MAX_WORKERS  = 2   # concurrent segment2 runs per batch request
+
+
+def _analyze_batch_image(image_path, profile):
+    """
+    Leaf analysis for one batch photo: classified leaves when a classifier
+    backend is available, segment2 severity alone otherwise. Errors are
+    returned, not raised.
+    """
+    try:
+        started = _time.time()
+        analysis = classify_plant_leaves(image_path, reduced_decode=True, profile=profile)
+        if analysis is None:
+            workspace = AnalysisWorkspace()
+            leaf_results, severity, level = cached_segment_analyze_plant(
+                image_path, workspace=workspace, profile=profile
+            )
+            analysis = {
+                'leaf_results'        : leaf_results,
+                'plant_severity'      : severity,
+                'plant_severity_level': level,
+                'job_id'              : workspace.job_id,
+            }
+        record_pipeline_time("disease", _time.time() - started)
+        return analysis
+    except Exception as e:
+        logger.error(f"❌ Batch image failed ({image_path}): {e}")
+        return {'error': str(e)}
+
+
+def _pool_batch_diagnosis(analyses):
+    """
+    Field-level diagnosis from the classified photos: leaf votes pooled
+    over the whole batch, ranked like classify_plant_leaves() ranks one
+    photo. Returns (predicted_class, confidence, unique_diseases, backend)
+    or None when no photo was classified.
+    """
+    pooled, backend = {}, None
+    for analysis in analyses:
+        if 'predicted_class' not in analysis:
+            continue
+        backend = analysis['backend']
+        votes = analysis['unique_diseases'] or {
+            analysis['predicted_class']: {'count': 1, 'total_confidence': analysis['confidence']}
+        }
+        for name, vote in votes.items():
+            entry = pooled.setdefault(name, {'count': 0, 'total_confidence': 0.0})
+            entry['count'] += vote['count']
+            entry['total_confidence'] += vote['total_confidence']
+
+    if not pooled:
+        return None
+    predicted_class = max(pooled, key=lambda k: (pooled[k]['count'], pooled[k]['total_confidence']))
+    confidence = round(pooled[predicted_class]['total_confidence'] / pooled[predicted_class]['count'], 2)
+    return predicted_class, confidence, pooled, backend
+
+
+@app.route('/predict-batch', methods=['POST'])
+@login_required
+def predict_batch():
+    """
+    Batch variant of /predict for one field.
+
+    Accepts up to MAX_BATCH_IMAGES files under `images`. Each photo is
+    validated (read_image_upload) and quality-gated like a single upload;
+    rejected photos are reported and skipped. The rest are analysed with
+    a bounded worker pool — leaves are classified when a classifier
+    backend exists — and the field severity is the leaf-area-weighted
+    average over every leaf found. Writes ONE WeeklyAssessment and ONE
+    DiseaseDetection row for the whole batch. Returns JSON.
+    """
+    logger.info("=" * 80)
+    logger.info("🚀 PREDICT-BATCH ENDPOINT")
+    logger.info("=" * 80)
+
+    image_files = [f for f in request.files.getlist('images') if f and f.filename]
+
+    if not image_files:
+        return jsonify({'success': False, 'error': 'No images uploaded'}), 400
+
+    if len(image_files) > MAX_BATCH_IMAGES:
+        return jsonify({
+            'success': False,
+            'error'  : f'Too many images ({len(image_files)}). Maximum is {MAX_BATCH_IMAGES} per batch.'
+        }), 400
+
+    invalid = [f.filename for f in image_files if not allowed_file(f.filename)]
+    if invalid:
+        return jsonify({
+            'success': False,
+            'error'  : f"Invalid file type: {', '.join(invalid)}. Please upload PNG, JPG, or JPEG."
+        }), 400
+
+    profile = request.values.get('profile')
+    if profile and profile.lower() not in list(OPTIMIZATION_PROFILES) + [ADAPTIVE_PROFILE]:
+        return jsonify({'success': False, 'error': f"Unknown profile '{profile}'"}), 400
+
+    location  = request.form.get("location", "").strip()
+    area      = request.form.get("area", "0")
+    area_unit = request.form.get("area_unit", "square_meter")
+    try:
+        area_float = float(area) if area else 0.0
+    except ValueError:
+        area_float = -1.0
+    if not area_float >= 0:
+        return jsonify({'success': False, 'error': f"Invalid area '{area}'"}), 400
+
+    # ── Validate, gate and store each photo (one in memory at a time) ────────
+    photos = []
+    for image_file in image_files:
+        try:
+            upload = read_image_upload(image_file)
+        except UploadError as e:
+            logger.warning(f"⚠️ Rejected batch upload {image_file.filename} ({e.error_type}): {e}")
+            return jsonify({
+                'success'   : False,
+                'error'     : f"{image_file.filename}: {e}",
+                'error_type': e.error_type,
+            }), 400
+
+        quality = quality_gate(upload.data, "disease")
+        photo = {'filename': image_file.filename, 'image_filename': None, 'quality': quality}
+        if quality['ok']:
+            photo['image_filename'] = upload_store.put(upload.data)
+        photos.append(photo)
+        upload = None
+
+    accepted = [p for p in photos if p['image_filename']]
+    if not accepted:
+        return jsonify({
+            'success': False,
+            'error'  : 'None of the photos passed the quality check',
+            'images' : [{'filename': p['filename'], 'issues': p['quality']['issues']} for p in photos],
+        }), 400
+    logger.info(f"✅ Stored {len(accepted)} images ({len(photos) - len(accepted)} rejected by the quality gate)")
+
+    try:
+        start_time = _time.time()
+
+        try:
+            if location:
+                current_user.location = location
+            if area_float > 0:
+                current_user.land_area = area_float
+                current_user.area_unit = area_unit
+            db.session.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ Could not save user data: {e}")
+            db.session.rollback()
+
+        # ── Analyse concurrently (bounded pool) ───────────────────────────────
+        paths = [os.path.join(app.config['UPLOAD_FOLDER'], p['image_filename']) for p in accepted]
+        with ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS) as executor:
+            analyses = list(executor.map(_analyze_batch_image, paths, [profile] * len(paths)))
+        for photo, analysis in zip(accepted, analyses):
+            photo['analysis'] = analysis
+
+        # ── Field-level aggregation (leaf-area weighted) ──────────────────────
+        all_leaves = [leaf for a in analyses for leaf in a.get('leaf_results', [])]
+        field_severity, field_level = calculate_plant_severity_fast(all_leaves)
+        analysed_ok = sum(1 for a in analyses if 'error' not in a)
+
+        if analysed_ok == 0:
+            return jsonify({'success': False, 'error': 'None of the images could be analysed'}), 422
+
+        logger.info(f"🌱 Field severity: {field_severity}% ({field_level}) "
+                    f"from {len(all_leaves)} leaves in {analysed_ok}/{len(paths)} images")
+
+        diagnosis = _pool_batch_diagnosis(analyses)
+        if diagnosis:
+            predicted_class, confidence, unique_diseases, backend = diagnosis
+            dominant_plant_type = plant_type_for_class(predicted_class)
+            disease_info        = get_disease_info(predicted_class)
+            logger.info(f"✅ Field diagnosis: {predicted_class} ({confidence}%) via {backend}")
+        else:
+            predicted_class     = "Cloud Mode — Review Required"
+            confidence          = 0.0
+            unique_diseases     = {}
+            backend             = None
+            dominant_plant_type = "Detected Plant"
+            disease_info        = None
+        detection_mode = session.get('detection_mode', 'continue')
+
+        first_image = accepted[0]['image_filename']
+        detection_data = {
+            'disease'            : predicted_class,
+            'severity'           : field_level,
+            'color_severity'     : field_severity,
+            'affected_percentage': field_severity,
+            'image_filename'     : first_image,
+        }
+
+        # ── ONE weekly assessment for the batch ───────────────────────────────
+        try:
+            assessment_result = analyze_weekly_progress(
+                current_user.id, dominant_plant_type, detection_data,
+                detection_mode=detection_mode
+            )
+        except Exception as assessment_error:
+            logger.error(f"⚠️ Weekly assessment error (non-fatal): {assessment_error}")
+            assessment_result = {
+                'is_first_assessment' : True,
+                'week_number'         : 1,
+                'dosage_recommendation': 'maintain',
+                'next_assessment_date' : (datetime.now() + timedelta(days=7)).strftime('%Y-%m-%d'),
+            }
+
+        try:
+            treatment_fields = weekly_treatment_fields(backend, disease_info, None, confidence)
+            treatment_fields['farmer_notes'] = f"Batch of {len(accepted)} photos. {treatment_fields['farmer_notes']}"
+            save_weekly_assessment(
+                current_user.id, dominant_plant_type,
+                dict(detection_data, **treatment_fields),
+                assessment_result
+            )
+        except Exception as save_error:
+            logger.error(f"⚠️ Could not save weekly assessment (non-fatal): {save_error}")
+
+        # ── ONE detection row for the batch ───────────────────────────────────
+        try:
+            detection = DiseaseDetection(
+                user_id              = current_user.id,
+                detected_disease     = predicted_class,
+                confidence           = confidence,
+                severity             = field_level,
+                plant_type           = dominant_plant_type,
+                image_filename       = first_image,
+                gradcam_filename     = None,
+                farm_area            = area_float,
+                farm_area_unit       = area_unit,
+                farm_location        = location,
+                total_leaves_analyzed= len(all_leaves),
+                unique_diseases_count= len(unique_diseases),
+                is_multi_disease     = len(unique_diseases) > 1,
+                chemical_dosage      = None,
+                organic_dosage       = None
+            )
+            db.session.add(detection)
+            db.session.commit()
+        except Exception as db_error:
+            logger.error(f"❌ Could not save detection record: {db_error}")
+            db.session.rollback()
+
+        images = []
+        for photo in photos:
+            entry = {'filename': photo['filename']}
+            if not photo['image_filename']:
+                entry['error']  = 'Rejected by the quality check'
+                entry['issues'] = photo['quality']['issues']
+                images.append(entry)
+                continue
+            entry['image_url'] = url_for('static', filename=f"uploads/{photo['image_filename']}")
+            analysis = photo['analysis']
+            if 'error' in analysis:
+                entry['error'] = analysis['error']
+            else:
+                entry.update({
+                    'job_id'              : analysis['job_id'],
+                    'heatmap_url'         : url_for('job_heatmap', job_id=analysis['job_id']),
+                    'total_leaves'        : len(analysis['leaf_results']),
+                    'plant_severity'      : analysis['plant_severity'],
+                    'plant_severity_level': analysis['plant_severity_level'],
+                    'leaf_area'           : sum(l['leaf_area'] for l in analysis['leaf_results']),
+                })
+                if 'predicted_class' in analysis:
+                    entry['predicted_class'] = analysis['predicted_class']
+                    entry['confidence']      = analysis['confidence']
+            images.append(entry)
+
+        return jsonify({
+            'success'             : True,
+            'field_severity'      : field_severity,
+            'field_severity_level': field_level,
+            'predicted_class'     : predicted_class,
+            'confidence'          : confidence,
+            'plant_type'          : dominant_plant_type,
+            'classifier'          : backend,
+            'total_images'        : len(photos),
+            'images_rejected'     : len(photos) - len(accepted),
+            'images_analyzed'     : analysed_ok,
+            'total_leaves'        : len(all_leaves),
+            'images'              : images,
+            'assessment'          : {
+                'week_number'          : assessment_result.get('week_number', 1),
+                'dosage_recommendation': assessment_result.get('dosage_recommendation'),
+                'next_assessment_date' : assessment_result.get('next_assessment_date'),
+            },
+            'processing_time'     : round(_time.time() - start_time, 2),
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        logger.error("❌ ERROR IN PREDICT-BATCH ROUTE")
+        logger.error(traceback.format_exc())
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @app.route('/health')
 def health_check():
+    classifier = classifier_status()
     health_status = {
         "status"            : "ok",
-        "model_loaded"      : model is not None,
-        "treatments_loaded" : len(disease_treatments) > 0,
+        "model_loaded"      : classifier["loaded"],
+        "classifier"        : classifier,
+        "treatments_loaded" : len(disease_knowledge) > 0,
         "upload_dir_exists" : os.path.exists(app.config['UPLOAD_FOLDER']),
-        "total_diseases"    : len(disease_treatments),
-        "cloud_mode"        : True
+        "total_diseases"    : len(disease_knowledge),
+        "treatments_version": disease_knowledge.version,
+        "combined_plan_cache": _combined_treatment_plan.cache_info()._asdict(),
+        "cloud_mode"        : not classifier["loaded"]
     }
     return jsonify(health_status)
 
 
+@app.route('/api/analysis-cache/stats')
+def analysis_cache_stats():
+    return jsonify(cache_stats())
+
+
+@app.route('/api/quality-gate/stats')
+def quality_gate_stats_api():
+    """Quality-gate rejections and the pipeline time they saved."""
+    return jsonify(quality_gate_stats())
+
+
+@app.route('/api/uploads/stats')
+def upload_store_stats():
+    """Content-addressed upload store: dedup hits, re-encode savings, evictions."""
+    return jsonify(store_stats())
+
+
+@app.route('/api/memory/stats')
+def memory_stats():
+    """Per-stage peak allocations (AGRIPAL_TRACK_MEMORY=1) and safe concurrency."""
+    return jsonify(memory_report())
+
+
 @app.route('/api/treatment/<disease_name>')
 def treatment_api(disease_name):
     try:
@@ -2357,21 +2745,9 @@ def calculate_dosage_api():
                 infection_pct=effective_pct
             )
 
-            CONVERSIONS = {
-                'hectare': 1.0, 'acre': 0.404686,
-                'square_meter': 0.0001, 'square_feet': 0.0000092903
-            }
-            total_ha    = float(area or 0) * CONVERSIONS.get(area_unit, 1.0)
+            total_ha    = hectare_conversion
             effective_ha= total_ha * (effective_pct / 100.0)
-
-            if effective_pct >= 75:
-                severity_mult = 1.25
-            elif effective_pct >= 50:
-                severity_mult = 1.10
-            elif effective_pct >= 25:
-                severity_mult = 1.00
-            else:
-                severity_mult = 0.85
+            severity_mult = severity_multiplier(effective_pct)
 
             chem_info = disease_info['pesticide'].get('chemical', {})
             org_info  = disease_info['pesticide'].get('organic', {})
@@ -2407,6 +2783,42 @@ def calculate_dosage_api():
         return jsonify({'error': str(e)}), 500
 
 
+@app.route('/api/calculate-dosage/bulk', methods=['POST'])
+def calculate_dosage_bulk_api():
+    """
+    Dosage plan for many plots at once (FPO-scale planning).
+    Body: {"plots": [{"id", "area", "area_unit", "disease_name" or
+    "deficiency_key", "infection_percent", "plant_severity"}, ...]}
+    Returns per-plot quantities and procurement totals per product.
+    """
+    try:
+        data  = request.get_json(silent=True) or {}
+        plots = data.get('plots')
+        if not isinstance(plots, list) or not plots:
+            return jsonify({'success': False, 'error': 'Expected a non-empty "plots" list'}), 400
+        if len(plots) > DOSAGE_CONFIG['max_plots']:
+            return jsonify({
+                'success': False,
+                'error': f"At most {DOSAGE_CONFIG['max_plots']} plots per request"
+            }), 413
+
+        def disease_pesticide(name):
+            disease_info = get_disease_info(name)
+            return disease_info.get('pesticide') if disease_info else None
+
+        def deficiency_fertilizer(key):
+            deficiency_info = nutrition_deficiency_data.get(key)
+            return deficiency_info.get('fertilizer') if deficiency_info else None
+
+        plan = plan_bulk_dosage(plots, disease_pesticide, deficiency_fertilizer)
+        return jsonify({'success': True, **plan})
+
+    except Exception as e:
+        logger.error(f"Bulk dosage calculation API error: {str(e)}")
+        logger.error(traceback.format_exc())
+        return jsonify({'error': str(e)}), 500
+
+
 # ============================================================================
 # NUTRITION TESTING ROUTES
 # ============================================================================
@@ -2442,6 +2854,17 @@ def analyze_nutrition():
         flash("Error: Invalid file type. Please upload PNG, JPG, or JPEG.", "error")
         return render_template("error.html", back_link="/nutrition-testing")
 
+    try:
+        upload = read_image_upload(image_file)
+    except UploadError as e:
+        logger.warning(f"⚠️ Rejected upload ({e.error_type}): {e}")
+        flash(f"Error: {e}", "error")
+        return render_template("error.html", back_link="/nutrition-testing")
+
+    quality = quality_gate(upload.data, "nutrition")
+    if not quality['ok']:
+        return quality_rejection_page(quality, "/nutrition-testing")
+
     try:
         location   = request.form.get("location", "").strip()
         area       = request.form.get("area", "0")
@@ -2460,16 +2883,18 @@ def analyze_nutrition():
             logger.warning(f"⚠️ Could not save user data: {e}")
             db.session.rollback()
 
-        image_filename = str(uuid.uuid4()) + os.path.splitext(image_file.filename)[1]
-        image_path     = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
-        image_file.save(image_path)
-        logger.info(f"✅ Image saved to: {image_path}")
+        # Stored in the background while the analysis decodes from memory;
+        # the result page shows the stored copy, so wait for it before rendering
+        image_filename, image_saved = upload_store.put_async(upload.data)
 
-        analysis_result = analyze_nutrition_deficiency(image_path)
+        analysis_result = cached_analyze_nutrition_deficiency(upload.data, reduced_decode=True)
+        image_saved.result()
+        logger.info(f"✅ Image stored as: {image_filename}")
 
         if not analysis_result['success']:
             flash(f"Error during analysis: {analysis_result.get('error', 'Unknown error')}", "error")
             return render_template("error.html", back_link="/nutrition-testing")
+        record_pipeline_time("nutrition", analysis_result['processing_time'])
 
         diagnoses = analysis_result['diagnoses']
 
@@ -2516,6 +2941,357 @@ def analyze_nutrition():
         return render_template("error.html", back_link="/nutrition-testing"), 500
 
 
+@app.route('/analyze-combined', methods=['POST'])
+@login_required
+def analyze_combined():
+    """
+    Disease severity + nutrition deficiency for one photo, sharing a single
+    decode and GrabCut run between the two pipelines. Returns JSON.
+
+    Optional `profile` (form or query): fast / balanced / accurate / auto.
+    """
+    logger.info("=" * 80)
+    logger.info("🔗 COMBINED ANALYSIS ENDPOINT")
+    logger.info("=" * 80)
+
+    if 'image' not in request.files:
+        return jsonify({'success': False, 'error': 'No image file uploaded'}), 400
+
+    image_file = request.files['image']
+
+    if image_file.filename == '':
+        return jsonify({'success': False, 'error': 'No image selected'}), 400
+
+    if not allowed_file(image_file.filename):
+        return jsonify({'success': False, 'error': 'Invalid file type. Please upload PNG, JPG, or JPEG.'}), 400
+
+    profile = request.values.get('profile')
+    if profile and profile.lower() not in list(OPTIMIZATION_PROFILES) + [ADAPTIVE_PROFILE]:
+        return jsonify({
+            'success': False,
+            'error'  : f"Unknown profile '{profile}'. Use one of: {', '.join(OPTIMIZATION_PROFILES)}, {ADAPTIVE_PROFILE}"
+        }), 400
+
+    try:
+        upload = read_image_upload(image_file)
+    except UploadError as e:
+        logger.warning(f"⚠️ Rejected upload ({e.error_type}): {e}")
+        return jsonify({'success': False, 'error': str(e), 'error_type': e.error_type}), 400
+
+    try:
+        quality = quality_gate(upload.data, "combined")
+        if not quality['ok']:
+            details = get_detailed_error_message(quality['issues'][0]['type'], quality['metrics'])
+            return jsonify({
+                'success'    : False,
+                'error'      : details['message'],
+                'error_type' : quality['issues'][0]['type'],
+                'issues'     : [issue['message'] for issue in quality['issues']],
+                'suggestions': details['suggestions'],
+                'quality'    : quality['metrics'],
+            }), 400
+
+        # Stored in the background while the analysis decodes from memory
+        image_filename, image_saved = upload_store.put_async(upload.data)
+
+        workspace = AnalysisWorkspace()
+        combined  = analyze_plant_combined(upload.data, workspace=workspace, profile=profile)
+        record_pipeline_time("combined", combined['processing_time'])
+        image_saved.result()  # the response links the stored image
+        logger.info(f"✅ Image stored as: {image_filename}")
+
+        disease = combined['disease']
+        leaves  = [
+            dict(leaf, leaf=_static_url(leaf['leaf']))
+            for leaf in disease['leaf_results']
+        ]
+
+        nutrition = dict(combined['nutrition'])
+        if nutrition.get('color_analysis'):
+            nutrition['color_analysis'] = {
+                k: v for k, v in nutrition['color_analysis'].items() if k != 'segmented_image'
+            }
+
+        return jsonify({
+            'success'        : True,
+            'job_id'         : workspace.job_id,
+            'image_url'      : url_for('static', filename=f'uploads/{image_filename}'),
+            'heatmap_url'    : url_for('job_heatmap', job_id=workspace.job_id),
+            'disease'        : {
+                'leaf_results'        : leaves,
+                'total_leaves'        : len(leaves),
+                'plant_severity'      : disease['plant_severity'],
+                'plant_severity_level': disease['plant_severity_level'],
+            },
+            'nutrition'      : nutrition,
+            'profile'        : combined['profile'],
+            'processing_time': combined['processing_time'],
+        })
+
+    except Exception as e:
+        logger.error("=" * 80)
+        logger.error("❌ ERROR IN COMBINED ANALYSIS")
+        logger.error("=" * 80)
+        logger.error(traceback.format_exc())
+        logger.error("=" * 80)
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/analyze-video', methods=['POST'])
+@login_required
+def analyze_video_route():
+    """
+    Field-walk video → aggregated plant/field severity. Frames are sampled,
+    near-duplicates dropped, and distinct frames run through segment2.
+    Returns JSON; the uploaded video is deleted afterwards.
+    """
+    logger.info("=" * 80)
+    logger.info("🎥 VIDEO ANALYSIS ENDPOINT")
+    logger.info("=" * 80)
+
+    if 'video' not in request.files:
+        return jsonify({'success': False, 'error': 'No video file uploaded'}), 400
+
+    video_file = request.files['video']
+
+    if video_file.filename == '':
+        return jsonify({'success': False, 'error': 'No video selected'}), 400
+
+    ext = video_file.filename.rsplit('.', 1)[-1].lower() if '.' in video_file.filename else ''
+    if ext not in VIDEO_EXTENSIONS:
+        return jsonify({
+            'success': False,
+            'error'  : f"Invalid file type. Please upload one of: {', '.join(sorted(VIDEO_EXTENSIONS))}."
+        }), 400
+
+    video_path = os.path.join(app.config['UPLOAD_FOLDER'], f"{uuid.uuid4()}.{ext}")
+    try:
+        video_file.save(video_path)
+        result = analyze_video(video_path)
+
+        if result['frames_analyzed'] == 0:
+            return jsonify({'success': False, 'error': 'No usable frames found in the video'}), 422
+
+        return jsonify(dict(result, success=True))
+
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        logger.error("❌ ERROR IN VIDEO ANALYSIS")
+        logger.error(traceback.format_exc())
+        return jsonify({'success': False, 'error': str(e)}), 500
+    finally:
+        if os.path.exists(video_path):
+            os.remove(video_path)
+
+
+# ============================================================================
+# ASYNC ANALYSIS JOBS — submit now, poll for the result
+# ============================================================================
+
+@app.route('/api/jobs', methods=['POST'])
+@login_required
+def submit_analysis_job():
+    """
+    Queue an analysis and return 202 with a job id immediately.
+    Form: image, kind = combined | segment | nutrition (default combined),
+    optional profile. Poll GET /api/jobs/<id>?wait=<s> for the result.
+    """
+    kind = request.form.get('kind', 'combined')
+    if kind not in ('combined', 'segment', 'nutrition'):
+        return jsonify({'success': False, 'error': f"Unknown job kind '{kind}'"}), 400
+
+    image_file = request.files.get('image')
+    if image_file is None or image_file.filename == '':
+        return jsonify({'success': False, 'error': 'No image file uploaded'}), 400
+
+    if not allowed_file(image_file.filename):
+        return jsonify({'success': False, 'error': 'Invalid file type. Please upload PNG, JPG, or JPEG.'}), 400
+
+    profile = request.values.get('profile')
+    if profile and profile.lower() not in list(OPTIMIZATION_PROFILES) + [ADAPTIVE_PROFILE]:
+        return jsonify({'success': False, 'error': f"Unknown profile '{profile}'"}), 400
+
+    try:
+        upload = read_image_upload(image_file)
+    except UploadError as e:
+        logger.warning(f"⚠️ Rejected job upload ({e.error_type}): {e}")
+        return jsonify({'success': False, 'error': str(e), 'error_type': e.error_type}), 400
+
+    try:
+        start_job_workers()
+
+        # Stored before queueing: a worker may pick the job up at once
+        image_filename = upload_store.put(upload.data)
+        image_path     = os.path.join(app.config['UPLOAD_FOLDER'], image_filename)
+
+        job_id = submit_job(kind, {
+            'image_path'    : image_path,
+            'image_filename': image_filename,
+            'profile'       : profile,
+        }, user_id=current_user.id)
+
+        return jsonify({
+            'success'   : True,
+            'job_id'    : job_id,
+            'status'    : 'queued',
+            'status_url': url_for('analysis_job_status', job_id=job_id),
+        }), 202
+
+    except Exception as e:
+        logger.error(f"❌ Could not queue analysis job: {e}")
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@app.route('/api/jobs/<job_id>')
+@login_required
+def analysis_job_status(job_id):
+    """
+    Job status; with ?wait=<seconds> (max 30) the request long-polls until
+    the job finishes. Finished jobs include the result with public URLs.
+    """
+    if not _re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'success': False, 'error': 'Invalid job id'}), 400
+
+    start_job_workers()
+
+    try:
+        wait = min(float(request.args.get('wait', 0)), 30.0)
+    except ValueError:
+        wait = 0.0
+
+    job = wait_for_job(job_id, timeout=wait) if wait > 0 else get_job(job_id)
+    if job is None or job['user_id'] != current_user.id:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+
+    response = {
+        'success'    : job['status'] != 'failed',
+        'job_id'     : job['id'],
+        'kind'       : job['kind'],
+        'status'     : job['status'],
+        'image_url'  : url_for('static', filename=f"uploads/{job['payload']['image_filename']}"),
+        'created_at' : job['created_at'],
+        'started_at' : job['started_at'],
+        'finished_at': job['finished_at'],
+    }
+    if job['status'] == 'queued':
+        response['queue_position'] = job.get('queue_position')
+    if job['status'] == 'failed':
+        response['error'] = job['error']
+
+    result = job['result']
+    if result:
+        if 'disease' in result:
+            disease = result['disease']
+            disease['leaf_results'] = [
+                dict(leaf, leaf=_static_url(leaf['leaf'])) for leaf in disease['leaf_results']
+            ]
+            disease['total_leaves'] = len(disease['leaf_results'])
+        if result.get('job_workspace'):
+            response['heatmap_url'] = url_for('job_heatmap', job_id=result['job_workspace'])
+        response['result'] = result
+
+    return jsonify(response)
+
+
+@app.route('/api/jobs/metrics')
+def analysis_job_metrics():
+    return jsonify(queue_metrics())
+
+
+def _static_url(path):
+    """Map a file path under ./static to its public URL."""
+    rel = os.path.relpath(path, 'static').replace(os.sep, '/')
+    return url_for('static', filename=rel)
+
+
+# ============================================================================
+# IMAGE VARIANTS — resized WebP / JPEG copies for result and dashboard pages
+# ============================================================================
+
+@app.template_global()
+def variant_url(url, width=DERIVATIVE_CONFIG['default_width']):
+    """
+    URL of a `width`-px variant of a /static image or heatmap URL.
+    Anything else (external URLs, empty values) is returned unchanged.
+    """
+    if not url:
+        return url
+    if url.startswith('/api/heatmap/'):
+        return f"{url.split('?')[0]}?max_size={width}"
+    static_prefix = url_for('static', filename='')
+    rel = url[len(static_prefix):] if url.startswith(static_prefix) else None
+    if rel is None and url.startswith('static/'):
+        rel = url[len('static/'):]
+    if rel is None:
+        return url
+    return url_for('image_variant', source=rel, w=width)
+
+
+def send_derivative(source_path, width, fmt='auto', private=False):
+    """Serve a cached variant with a strong ETag and a one-year lifetime."""
+    fmt = negotiate_format(fmt, request.headers.get('Accept'))
+    path, etag, mimetype = get_derivative(source_path, width, fmt)
+    response = send_file(path, mimetype=mimetype, etag=etag, conditional=True,
+                         max_age=DERIVATIVE_CONFIG['max_age'])
+    response.cache_control.public    = not private
+    response.cache_control.private   = private
+    response.cache_control.immutable = True
+    response.vary.add('Accept')
+    return response
+
+
+@app.route('/img/<path:source>')
+def image_variant(source):
+    """
+    Resized variant of an upload, leaf crop or job image under ./static.
+    Query: ?w=<px> (longest side, snapped to a fixed step; default 640),
+    ?fmt=webp|jpeg|auto (auto follows the Accept header).
+    """
+    path = resolve_static_source(source)
+    if path is None:
+        return jsonify({'success': False, 'error': 'Image not found'}), 404
+
+    try:
+        width = int(request.args.get('w', DERIVATIVE_CONFIG['default_width']))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'w must be an integer'}), 400
+
+    try:
+        return send_derivative(path, width, request.args.get('fmt', 'auto'))
+    except Exception as e:
+        logger.error(f"❌ Image variant failed for {source}: {e}")
+        return jsonify({'success': False, 'error': 'Image variant failed'}), 500
+
+
+@app.route('/api/heatmap/<job_id>')
+@login_required
+def job_heatmap(job_id):
+    """
+    Disease heatmap for an analysis job, rendered from its stored disease
+    mask the first time it is requested and cached per size.
+    Query: ?max_size=<px> (longest side, default 600), ?fmt=webp|jpeg|auto.
+    """
+    if not _re.fullmatch(r'[0-9a-f]{32}', job_id):
+        return jsonify({'success': False, 'error': 'Invalid job id'}), 400
+
+    try:
+        max_size = int(request.args.get('max_size', 600))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'max_size must be an integer'}), 400
+
+    try:
+        path = heatmap_for_job(job_id, max_size=max_size)
+    except Exception as e:
+        logger.error(f"❌ Heatmap rendering failed for job {job_id}: {e}")
+        return jsonify({'success': False, 'error': 'Heatmap rendering failed'}), 500
+
+    if path is None:
+        return jsonify({'success': False, 'error': 'Analysis job not found or expired'}), 404
+
+    return send_derivative(path, max_size, request.args.get('fmt', 'auto'), private=True)
+
+
 @app.route('/api/nutrition/<deficiency_key>')
 def nutrition_api(deficiency_key):
     try:
@@ -2609,6 +3385,30 @@ def init_expert_db():
 init_expert_db()
 
 
+# ============================================================
+# UPLOAD STORE REFERENCES — blobs still linked from these are kept
+# ============================================================
+def _model_image_refs(column):
+    def source():
+        with app.app_context():
+            return [name for (name,) in db.session.query(column).filter(column.isnot(None))]
+    return source
+
+
+def _expert_image_refs():
+    conn = _sq3.connect("database.db")
+    try:
+        return [path for (path,) in conn.execute("SELECT image_path FROM expert_requests WHERE image_path != ''")]
+    finally:
+        conn.close()
+
+
+upload_store.register_reference_source("disease_detections", _model_image_refs(DiseaseDetection.image_filename))
+upload_store.register_reference_source("weekly_assessments", _model_image_refs(WeeklyAssessment.image_filename))
+upload_store.register_reference_source("expert_requests", _expert_image_refs)
+upload_store.register_reference_source("analysis_jobs", job_image_references)
+
+
 @app.route("/talk-to-expert")
 def talk_to_expert():
     return render_template("talk_to_expert.html")
@@ -2623,13 +3423,30 @@ def submit_expert():
     audio       = request.files.get("audio")
     image_path, audio_path = "", ""
     if image and image.filename != "":
-        fname      = str(uuid.uuid4()) + "_" + _sfn(image.filename)
-        image_path = os.path.join(EXPERT_UPLOAD_DIR, fname)
-        image.save(image_path)
+        try:
+            upload = read_image_upload(image)
+        except UploadError as e:
+            logger.warning(f"⚠️ Rejected expert upload ({e.error_type}): {e}")
+            flash(f"Error: {e}", "error")
+            return render_template("error.html", back_link="/talk-to-expert")
+        # Stored in the background while the audio is saved; the request row
+        # must only point at a blob that exists, so wait for it below
+        stored_name, image_saved = upload_store.put_async(upload.data)
+        image_path     = f"static/uploads/{stored_name}"
     if audio and audio.filename != "":
         fname      = str(uuid.uuid4()) + "_" + _sfn(audio.filename)
         audio_path = os.path.join(EXPERT_UPLOAD_DIR, fname)
         audio.save(audio_path)
+    if image_path:
+        try:
+            image_saved.result()
+        except Exception as e:
+            logger.error(f"❌ Could not store expert request image: {e}")
+            logger.error(traceback.format_exc())
+            if audio_path and os.path.exists(audio_path):
+                os.remove(audio_path)
+            flash("Error: The image could not be saved. Please try another photo.", "error")
+            return render_template("error.html", back_link="/talk-to-expert")
     conn = _sq3.connect("database.db")
     cur  = conn.cursor()
     cur.execute(
@@ -3135,6 +3952,7 @@ if __name__ == '__main__':
 
     clear_sessions_on_startup()
     init_database()
+    start_job_workers()
 
     local_ip = get_local_ip()
 
@@ -0,0 +1,261 @@
+"""
+AgriPal - disease classifier benchmark
+Load time, resident memory and batched latency of every classifier
+backend, next to the old Keras path when TensorFlow is available.
+
+Each engine is measured in a fresh process so import / model memory is
+not shared between them.
+
+Usage (from the repo root):
+    python benchmarks/bench_classifier.py                  # models in models/ + synthetic stand-ins
+    python benchmarks/bench_classifier.py --onnx models/disease_classifier.int8.onnx
+    python benchmarks/bench_classifier.py --keras plant_disease_model.h5
+    python benchmarks/bench_classifier.py --features models/disease_features.npz
+    python benchmarks/bench_classifier.py --batch 1 --batch 8 --batch 32 --repeat 10
+
+Synthetic stand-ins (random weights, same 128×128×3 → 38 contract) are
+used for backends without a real model so the engine cost can still be
+compared: a small int8 CNN for onnx (needs the `onnx` package to build),
+an int8 MLP for numpy and a random 38 × 200 reference index for the
+feature backend. Their accuracy is meaningless.
+"""
+
+import argparse
+import multiprocessing as mp
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from disease_classifier import (  # noqa: E402
+    CLASS_NAMES, CLASSIFIER_CONFIG, NumpyBackend, OnnxBackend, quantize_onnx
+)
+from feature_classifier import FEATURE_CONFIG, FeatureBackend, FeatureIndex, descriptor_size  # noqa: E402
+from memory_budget import current_rss_mb  # noqa: E402
+
+DEFAULT_BATCHES = [1, 8, 32]
+INPUT_SIZE = CLASSIFIER_CONFIG["input_size"]
+
+
+# =====================================================
+# SYNTHETIC MODELS
+# =====================================================
+def build_synthetic_onnx(path, seed=0):
+    """Small NHWC CNN (3 conv blocks + dense), int8-quantized. Needs `onnx`."""
+    import onnx
+    from onnx import TensorProto, helper, numpy_helper
+
+    rng = np.random.default_rng(seed)
+
+    def init(name, shape):
+        return numpy_helper.from_array((rng.standard_normal(shape) * 0.05).astype(np.float32), name)
+
+    nodes = [helper.make_node("Transpose", ["input"], ["x0"], perm=[0, 3, 1, 2])]
+    inits = []
+    channels = [3, 32, 64, 128]
+    for i in range(3):
+        inits += [init(f"conv{i}_w", (channels[i + 1], channels[i], 3, 3)), init(f"conv{i}_b", (channels[i + 1],))]
+        nodes += [
+            helper.make_node("Conv", [f"x{i}", f"conv{i}_w", f"conv{i}_b"], [f"c{i}"], pads=[1, 1, 1, 1]),
+            helper.make_node("Relu", [f"c{i}"], [f"r{i}"]),
+            helper.make_node("MaxPool", [f"r{i}"], [f"x{i + 1}"], kernel_shape=[2, 2], strides=[2, 2]),
+        ]
+    inits += [init("dense_w", (128, len(CLASS_NAMES))), init("dense_b", (len(CLASS_NAMES),))]
+    nodes += [
+        helper.make_node("GlobalAveragePool", ["x3"], ["gap"]),
+        helper.make_node("Flatten", ["gap"], ["flat"]),
+        helper.make_node("MatMul", ["flat", "dense_w"], ["logits0"]),
+        helper.make_node("Add", ["logits0", "dense_b"], ["logits"]),
+        helper.make_node("Softmax", ["logits"], ["probs"], axis=1),
+    ]
+    graph = helper.make_graph(
+        nodes, "synthetic_disease_cnn",
+        [helper.make_tensor_value_info("input", TensorProto.FLOAT, ["N", INPUT_SIZE, INPUT_SIZE, 3])],
+        [helper.make_tensor_value_info("probs", TensorProto.FLOAT, ["N", len(CLASS_NAMES)])],
+        inits,
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid("", 13)])
+    model.ir_version = 8  # loadable by older onnxruntime releases
+    fp32_path = path.replace(".int8.onnx", ".fp32.onnx")
+    onnx.save(model, fp32_path)
+    quantize_onnx(fp32_path, path)
+    return path
+
+
+def build_synthetic_npz(path, pool=4, hidden=256, seed=0):
+    """int8 MLP on the average-pooled input (NumpyBackend format)."""
+    rng = np.random.default_rng(seed)
+    sizes = [(INPUT_SIZE // pool) ** 2 * 3, hidden, len(CLASS_NAMES)]
+    arrays = {"pool": np.int32(pool), "class_names": np.array(CLASS_NAMES)}
+    for i, (n_in, n_out) in enumerate(zip(sizes, sizes[1:])):
+        w = rng.standard_normal((n_in, n_out)).astype(np.float32) * 0.05
+        scale = np.abs(w).max(axis=0) / 127
+        arrays[f"w{i}_q"] = np.round(w / scale).astype(np.int8)
+        arrays[f"w{i}_scale"] = scale.astype(np.float32)
+        arrays[f"b{i}"] = np.zeros(n_out, np.float32)
+    np.savez(path, **arrays)
+    return path
+
+
+def build_synthetic_index(path, per_class=200, seed=0):
+    """Random reference descriptors (FeatureIndex format)."""
+    rng = np.random.default_rng(seed)
+    descriptors = rng.random((len(CLASS_NAMES) * per_class, descriptor_size()), dtype=np.float32)
+    labels = np.repeat(np.arange(len(CLASS_NAMES)), per_class)
+    FeatureIndex.build(descriptors, labels, CLASS_NAMES).save(path)
+    return path
+
+
+# =====================================================
+# MEASUREMENT (runs in a child process)
+# =====================================================
+class RssSampler:
+    """Peak RSS while a block runs, sampled every few milliseconds."""
+
+    def __enter__(self):
+        self.peak = current_rss_mb()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, current_rss_mb())
+            time.sleep(0.002)
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss_mb())
+
+
+def _load_engine(engine, path):
+    """Returns predict(batch) → outputs for a float32 NHWC [0, 1] batch."""
+    if engine == "onnx":
+        return OnnxBackend(path, threads=CLASSIFIER_CONFIG["threads"]).predict
+    if engine == "numpy":
+        return NumpyBackend(path).predict
+    if engine == "features":
+        return FeatureBackend(path).predict
+    if engine == "keras":
+        import tensorflow as tf
+        model = tf.keras.models.load_model(path)
+        return lambda batch: model.predict(batch, verbose=0)
+    raise ValueError(engine)
+
+
+def measure_engine(engine, path, batches, repeat, queue):
+    base = current_rss_mb()
+    try:
+        with RssSampler() as load_rss:
+            t0 = time.perf_counter()
+            predict = _load_engine(engine, path)
+            load_time = time.perf_counter() - t0
+
+        rng = np.random.default_rng(0)
+        latency, peak = {}, load_rss.peak
+        for n in batches:
+            batch = rng.random((n, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+            predict(batch)  # warm-up
+            runs = []
+            with RssSampler() as run_rss:
+                for _ in range(repeat):
+                    t0 = time.perf_counter()
+                    predict(batch)
+                    runs.append(time.perf_counter() - t0)
+            latency[n] = statistics.median(runs)
+            peak = max(peak, run_rss.peak)
+
+        queue.put({
+            "engine": engine,
+            "model": path,
+            "model_mb": round(os.path.getsize(path) / 1e6, 2),
+            "load_s": round(load_time, 3),
+            "load_rss_mb": round(load_rss.peak - base, 1),
+            "peak_rss_mb": round(peak - base, 1),
+            "latency_ms": {n: round(t * 1000, 2) for n, t in latency.items()},
+        })
+    except ImportError as e:
+        queue.put({"engine": engine, "model": path, "skipped": f"{e}"})
+    except Exception as e:
+        queue.put({"engine": engine, "model": path, "error": f"{e}"})
+
+
+def run_isolated(engine, path, batches, repeat):
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=measure_engine, args=(engine, path, batches, repeat, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def print_result(result, batches):
+    label = f"{result['engine']:<6} {os.path.basename(result['model'])}"
+    if "skipped" in result or "error" in result:
+        print(f"\n⚠️  {label}: {result.get('skipped') or result.get('error')}")
+        return
+    print(f"\n🧠 {label}  ({result['model_mb']} MB on disk)")
+    print(f"   Load     : {result['load_s']:.3f}s, +{result['load_rss_mb']} MB RSS")
+    print(f"   Peak RSS : +{result['peak_rss_mb']} MB over the process baseline")
+    print("   Latency  : " + "  ".join(
+        f"batch {n}={result['latency_ms'][n]:.1f}ms ({result['latency_ms'][n] / n:.2f}ms/leaf)" for n in batches
+    ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark disease classifier backends")
+    parser.add_argument("--onnx", help="int8 ONNX model (default: models/ or a synthetic CNN)")
+    parser.add_argument("--npz", help="NumPy .npz model (default: models/ or a synthetic MLP)")
+    parser.add_argument("--features", help="Feature reference index (default: models/ or a random index)")
+    parser.add_argument("--keras", help="Old Keras .h5 model to compare against (needs TensorFlow)")
+    parser.add_argument("--batch", type=int, action="append", help="Batch size (repeatable)")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per batch size (median)")
+    args = parser.parse_args(argv)
+    batches = args.batch or DEFAULT_BATCHES
+
+    model_dir = CLASSIFIER_CONFIG["model_dir"]
+    tmp = tempfile.mkdtemp(prefix="agripal_bench_")
+
+    engines = []
+    onnx_path = args.onnx or os.path.join(model_dir, CLASSIFIER_CONFIG["onnx_model"])
+    if not os.path.exists(onnx_path):
+        try:
+            onnx_path = build_synthetic_onnx(os.path.join(tmp, "synthetic.int8.onnx"))
+        except ImportError as e:
+            onnx_path = None
+            print(f"⚠️  No ONNX model and cannot build a synthetic one ({e})")
+    if onnx_path:
+        engines.append(("onnx", onnx_path))
+
+    npz_path = args.npz or os.path.join(model_dir, CLASSIFIER_CONFIG["numpy_model"])
+    if not os.path.exists(npz_path):
+        npz_path = build_synthetic_npz(os.path.join(tmp, "synthetic.npz"))
+    engines.append(("numpy", npz_path))
+
+    index_path = args.features or os.path.join(model_dir, FEATURE_CONFIG["index"])
+    if not os.path.exists(index_path):
+        index_path = build_synthetic_index(os.path.join(tmp, "synthetic_features.npz"))
+    engines.append(("features", index_path))
+
+    if args.keras:
+        engines.append(("keras", args.keras))
+    else:
+        print("ℹ️  No --keras model given — old Keras path not measured")
+
+    print(f"🚀 Classifier benchmark | batches: {batches} | repeat: {args.repeat}")
+    for engine, path in engines:
+        print_result(run_isolated(engine, path, batches, args.repeat), batches)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,349 @@
+"""
+AgriPal - segment2 benchmark
+Synthesizes plant photos with a known leaf count, disease-spot coverage
+and resolution, runs them through the segment2 pipeline stage by stage,
+and compares timings / peak memory / accuracy against a stored baseline.
+Per-stage peak allocations and the concurrency that fits the memory
+budget (AGRIPAL_MEMORY_BUDGET_MB, default 512) are reported as well.
+
+Usage (from the repo root):
+    python benchmarks/bench_segment2.py                     # run + compare
+    python benchmarks/bench_segment2.py --update-baseline   # record new baseline
+    python benchmarks/bench_segment2.py --scenario leaves5_2mp --repeat 5
+    python benchmarks/bench_segment2.py --profile fast
+    python benchmarks/bench_segment2.py --set max_image_size=1000 --set grabcut_iterations=2
+    python benchmarks/bench_segment2.py --set low_memory=true   # low-memory mode
+
+Exit status is 1 when any scenario misses its accuracy tolerance or is
+slower / heavier than the baseline by more than the allowed margin.
+Timings are machine specific: refresh the baseline on the machine that
+runs the comparison.
+"""
+
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import segment2  # noqa: E402
+from segment2 import (  # noqa: E402
+    AnalysisWorkspace, OPTIMIZATION_PROFILES, load_image, resize_for_speed,
+    fast_grabcut_segmentation, fast_watershed_segmentation, compute_region_stats,
+    process_single_leaf, calculate_plant_severity_fast, segment_analyze_plant,
+    REGION_STATS_BAND_ROWS
+)
+from memory_budget import (  # noqa: E402
+    GRABCUT_LOW_MEMORY_MAX_SIZE, MEMORY_BUDGET_MB, memory_report, reset_memory_report, reset_traced_peak,
+    safe_concurrency, traced_peak
+)
+
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+
+
+def baseline_path(profile):
+    name = "segment2.json" if profile == "balanced" else f"segment2_{profile}.json"
+    return os.path.join(BASELINE_DIR, name)
+
+# name → (megapixels, leaves, diseased fraction of leaf area)
+SCENARIOS = {
+    "leaves3_0.5mp": (0.5, 3, 0.05),
+    "leaves5_2mp": (2, 5, 0.15),
+    "leaves6_8mp": (8, 6, 0.25),
+    "leaves4_16mp": (16, 4, 0.10),
+}
+
+TOLERANCES = {
+    "leaf_count": 0,       # detected leaves must match exactly
+    "severity": 1.5,       # percentage points vs. ground truth
+    "time": 0.25,          # allowed slowdown vs. baseline (fraction)
+    "memory": 0.20,        # allowed peak-memory growth vs. baseline (fraction)
+}
+
+STAGES = ["decode", "resize", "grabcut", "watershed", "region_stats", "leaves", "severity"]
+
+
+# =====================================================
+# SYNTHETIC SCENES
+# =====================================================
+def synthesize_scene(megapixels, n_leaves, coverage, seed=0):
+    """
+    Grey, low-saturation background with `n_leaves` separated green leaves
+    in a grid, each carrying brown lesions over ~`coverage` of its area.
+
+    Returns (bgr_image, truth) where truth holds the leaf count and the
+    area-weighted ground-truth severity the pipeline should report.
+    """
+    rng = np.random.default_rng(seed)
+    w = int(round(np.sqrt(megapixels * 1e6 * 4 / 3)))
+    h = int(round(w * 3 / 4))
+
+    image = np.empty((h, w, 3), np.uint8)
+    image[:] = (150, 155, 160)
+    noise = rng.integers(0, 12, (h, w, 1), dtype=np.uint8)
+    cv2.add(image, np.broadcast_to(noise, image.shape).copy(), dst=image)
+
+    cols = int(np.ceil(np.sqrt(n_leaves)))
+    rows = int(np.ceil(n_leaves / cols))
+    margin = int(min(w, h) * 0.08)
+    cell_w = (w - 2 * margin) // cols
+    cell_h = (h - 2 * margin) // rows
+
+    severities, areas = [], []
+    for i in range(n_leaves):
+        cx = margin + (i % cols) * cell_w + cell_w // 2
+        cy = margin + (i // cols) * cell_h + cell_h // 2
+        axes = (int(cell_w * 0.38), int(cell_h * 0.30))
+        angle = int(rng.integers(-20, 20))
+
+        leaf_mask = np.zeros((h, w), np.uint8)
+        cv2.ellipse(leaf_mask, (cx, cy), axes, angle, 0, 360, 255, -1)
+        image[leaf_mask > 0] = (40, 150, 45)
+
+        # Lesions: random spots clipped to the leaf until coverage is met
+        leaf_px = cv2.countNonZero(leaf_mask)
+        spots = np.zeros((h, w), np.uint8)
+        radius_max = max(3, int(min(axes) * 0.12))
+        while cv2.countNonZero(cv2.bitwise_and(spots, leaf_mask)) < coverage * leaf_px:
+            px = cx + int(rng.integers(-axes[0], axes[0]) * 0.7)
+            py = cy + int(rng.integers(-axes[1], axes[1]) * 0.7)
+            cv2.circle(spots, (px, py), int(rng.integers(radius_max // 3 + 1, radius_max + 1)), 255, -1)
+        spots = cv2.bitwise_and(spots, leaf_mask)
+        image[spots > 0] = (30, 80, 150)
+
+        x, y, bw, bh = cv2.boundingRect(leaf_mask)
+        severities.append(cv2.countNonZero(spots) / leaf_px * 100)
+        areas.append(bw * bh)
+
+    truth = {
+        "leaves": n_leaves,
+        "severity": round(float(np.average(severities, weights=areas)), 2),
+        "size": [w, h],
+    }
+    return image, truth
+
+
+# =====================================================
+# MEASUREMENT
+# =====================================================
+def time_stages(encoded, config):
+    """One pass through the pipeline, timing each stage in isolation."""
+    timings = {}
+
+    t0 = time.perf_counter()
+    low_memory = config["low_memory"]
+    image = load_image(encoded, max_size=config["max_image_size"] if low_memory else None)
+    timings["decode"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    resized, _ = resize_for_speed(image, max_size=config["max_image_size"])
+    timings["resize"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    segmented, _ = fast_grabcut_segmentation(resized, iterations=config["grabcut_iterations"],
+                                             max_size=GRABCUT_LOW_MEMORY_MAX_SIZE if low_memory else None)
+    timings["grabcut"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    markers = fast_watershed_segmentation(segmented, morph_iter=config["morph_iterations"],
+                                          low_memory=low_memory)
+    timings["watershed"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    regions = compute_region_stats(segmented, markers,
+                                   band_rows=REGION_STATS_BAND_ROWS if low_memory else None)
+    regions = [r for r in regions if r["area"] >= config["min_leaf_area"]]
+    timings["region_stats"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    workspace = AnalysisWorkspace(in_memory=True)
+    leaf_results = [
+        r for r in (process_single_leaf((segmented, region, workspace, i))
+                    for i, region in enumerate(regions, 1))
+        if r is not None
+    ]
+    timings["leaves"] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    calculate_plant_severity_fast(leaf_results)
+    timings["severity"] = time.perf_counter() - t0
+
+    return timings
+
+
+def run_scenario(name, profile="balanced", repeat=3, seed=0, config=None):
+    """`config` overrides the named profile's settings (a full config dict)."""
+    megapixels, n_leaves, coverage = SCENARIOS[name]
+    image, truth = synthesize_scene(megapixels, n_leaves, coverage, seed=seed)
+    # Lossless, so JPEG chroma subsampling can't blur lesions off the ground truth
+    ok, buf = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    encoded = buf.tobytes()
+    del image
+
+    config = config or OPTIMIZATION_PROFILES[profile]
+    stage_runs = [time_stages(encoded, config) for _ in range(repeat)]
+    stages = {s: round(statistics.median(r[s] for r in stage_runs), 4) for s in STAGES}
+
+    totals = []
+    peak = 0
+    reset_memory_report()
+    for _ in range(repeat):
+        tracemalloc.start()
+        reset_traced_peak()
+        t0 = time.perf_counter()
+        leaf_results, severity, _ = segment_analyze_plant(
+            encoded, workspace=AnalysisWorkspace(in_memory=True), profile=config
+        )
+        totals.append(time.perf_counter() - t0)
+        peak = max(peak, traced_peak())
+        tracemalloc.stop()
+
+    report = memory_report()
+    return {
+        "size": truth["size"],
+        "expected_leaves": truth["leaves"],
+        "expected_severity": truth["severity"],
+        "leaves": len(leaf_results),
+        "severity": severity,
+        "total": round(statistics.median(totals), 4),
+        "stages": stages,
+        "peak_mb": round(peak / 1024 / 1024, 2),
+        # Traced peak plus the estimated native GrabCut graph
+        "est_peak_mb": max([round(peak / 1024 / 1024, 2)] + list(report["pipeline_peaks_mb"].values())),
+        "stage_peaks_mb": report["stage_peaks_mb"],
+    }
+
+
+# =====================================================
+# CHECKS
+# =====================================================
+def check_result(name, result, baseline):
+    """List of failure messages for one scenario (empty when it passes)."""
+    failures = []
+
+    if abs(result["leaves"] - result["expected_leaves"]) > TOLERANCES["leaf_count"]:
+        failures.append(f"leaf count {result['leaves']} != expected {result['expected_leaves']}")
+
+    severity_error = abs(result["severity"] - result["expected_severity"])
+    if severity_error > TOLERANCES["severity"]:
+        failures.append(
+            f"severity {result['severity']}% off ground truth {result['expected_severity']}% "
+            f"by {severity_error:.2f} pts"
+        )
+
+    base = baseline.get(name) if baseline else None
+    if base:
+        if result["total"] > base["total"] * (1 + TOLERANCES["time"]):
+            failures.append(f"total time {result['total']:.3f}s vs baseline {base['total']:.3f}s")
+        if result["peak_mb"] > base["peak_mb"] * (1 + TOLERANCES["memory"]):
+            failures.append(f"peak memory {result['peak_mb']} MB vs baseline {base['peak_mb']} MB")
+
+    return failures
+
+
+def print_result(name, result, baseline, failures):
+    base = (baseline or {}).get(name)
+    status = "❌ FAIL" if failures else "✅ PASS"
+    print(f"\n{status}  {name}  ({result['size'][0]}x{result['size'][1]})")
+    print(f"   Leaves   : {result['leaves']} (expected {result['expected_leaves']})")
+    print(f"   Severity : {result['severity']}% (expected {result['expected_severity']}%)")
+    vs = f"  [baseline {base['total']:.3f}s]" if base else ""
+    print(f"   Total    : {result['total']:.3f}s{vs}")
+    vs = f"  [baseline {base['peak_mb']} MB]" if base else ""
+    print(f"   Peak mem : {result['peak_mb']} MB{vs}  (est. {result['est_peak_mb']} MB incl. GrabCut native)")
+    print("   Stages   : " + "  ".join(f"{s}={result['stages'][s]:.3f}s" for s in STAGES))
+    print("   Stage mem: " + "  ".join(f"{s}={mb}MB" for s, mb in result["stage_peaks_mb"].items()))
+    for f in failures:
+        print(f"   ⚠️  {f}")
+
+
+def parse_overrides(pairs, config):
+    overrides = {}
+    for pair in pairs:
+        key, _, value = pair.partition("=")
+        if key not in config:
+            raise SystemExit(f"❌ Unknown config key: {key}")
+        overrides[key] = json.loads(value.lower()) if value.lower() in ("true", "false") else json.loads(value)
+    return overrides
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the segment2 pipeline on synthetic plants")
+    parser.add_argument("--scenario", action="append", choices=sorted(SCENARIOS),
+                        help="Scenario to run (repeatable, default: all)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per scenario (median is reported)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--profile", default="balanced", choices=sorted(OPTIMIZATION_PROFILES),
+                        help="segment2 optimization profile to benchmark")
+    parser.add_argument("--baseline", help="Baseline file (default: benchmarks/baselines/segment2[_<profile>].json)")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="Store this run as the new baseline instead of comparing")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="Override a profile config entry for this run")
+    parser.add_argument("--json", help="Also write raw results to this file")
+    args = parser.parse_args(argv)
+
+    # A copy: "balanced" is segment2.OPTIMIZATION_CONFIG itself, and --set
+    # must not leak into other runs in the same process
+    config = dict(OPTIMIZATION_PROFILES[args.profile])
+    config.update(parse_overrides(args.set, config))
+    args.baseline = args.baseline or baseline_path(args.profile)
+    segment2.logger.setLevel("WARNING")
+
+    baseline = None
+    if not args.update_baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)["scenarios"]
+
+    names = args.scenario or list(SCENARIOS)
+    print(f"🚀 segment2 benchmark | profile: {args.profile} | config: {config}")
+    if baseline is None and not args.update_baseline:
+        print(f"⚠️  No baseline at {args.baseline} — only accuracy is checked")
+
+    results, failed = {}, False
+    for name in names:
+        result = run_scenario(name, profile=args.profile, repeat=args.repeat, seed=args.seed, config=config)
+        failures = check_result(name, result, baseline)
+        print_result(name, result, baseline, failures)
+        results[name] = result
+        failed = failed or bool(failures)
+
+    max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"\n📊 Process max RSS: {max_rss_mb:.1f} MB")
+
+    # Estimated peaks include GrabCut's graph but not allocator slack or
+    # smaller OpenCV temporaries; confirm under load before raising workers.
+    worst_peak = max(r["est_peak_mb"] for r in results.values())
+    print(f"🧠 Worst est. peak {worst_peak} MB per analysis → safe concurrency at "
+          f"{MEMORY_BUDGET_MB} MB: {safe_concurrency(worst_peak)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.update_baseline:
+        stored = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                stored = json.load(f)["scenarios"]
+        stored.update(results)
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump({"profile": args.profile, "config": config, "scenarios": stored}, f, indent=2)
+        print(f"💾 Baseline written: {args.baseline}")
+        return 0
+
+    print("\n❌ Regressions detected" if failed else "\n✅ All scenarios within tolerance")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,216 @@
+"""
+AgriPal - plant image check validation
+Runs the original full-resolution is_plant_image (kept verbatim below as
+legacy_is_plant_image) and the plant_check cascade over a labelled image
+set. Reports accuracy, decision agreement, per-criterion timings and how
+often each early exit fired.
+
+Expected layout (any image format OpenCV reads):
+    <dataset>/plant/...       photos that must pass
+    <dataset>/not_plant/...   photos that must be rejected
+
+Usage (from the repo root):
+    python benchmarks/validate_plant_check.py /data/plant_check_set
+    python benchmarks/validate_plant_check.py /data/plant_check_set --thumbnail 0   # full resolution
+    python benchmarks/validate_plant_check.py /data/plant_check_set --thumbnail 480 --thumbnail 640
+
+Exit status is 1 when the cascade disagrees with the original decision
+on any image, so it can gate a threshold or thumbnail-size change.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+from collections import Counter, defaultdict
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from plant_check import CRITERIA, PLANT_CHECK_CONFIG, check_plant_image  # noqa: E402
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+# =====================================================
+# ORIGINAL IMPLEMENTATION (app2.is_plant_image before the cascade)
+# =====================================================
+def legacy_is_plant_image(image_path):
+    try:
+        img = cv2.imread(image_path)
+        if img is None:
+            return False
+
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        rgb = cv2.cvtColor(img, cv2.COLOR_BGR2RGB)
+
+        green_ranges = [
+            ([35, 50, 50], [85, 255, 255]),
+            ([25, 30, 30], [75, 255, 200]),
+            ([15, 40, 40], [35, 255, 255])
+        ]
+
+        total_green_pixels = 0
+        for lower, upper in green_ranges:
+            mask = cv2.inRange(hsv, np.array(lower), np.array(upper))
+            total_green_pixels += cv2.countNonZero(mask)
+
+        total_pixels = img.shape[0] * img.shape[1]
+        green_ratio = total_green_pixels / total_pixels
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        texture_variance = np.var(gray)
+
+        edges = cv2.Canny(gray, 50, 150)
+        edge_pixels = cv2.countNonZero(edges)
+        edge_ratio = edge_pixels / total_pixels
+
+        color_std = np.std(rgb, axis=(0, 1))
+        color_mean = np.mean(color_std)
+
+        brightness = np.mean(gray)
+        contrast = np.std(gray)
+
+        contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        organic_shapes = 0
+        for contour in contours:
+            area = cv2.contourArea(contour)
+            if area > 100:
+                perimeter = cv2.arcLength(contour, True)
+                if perimeter > 0:
+                    circularity = 4 * np.pi * area / (perimeter * perimeter)
+                    if 0.1 < circularity < 0.8:
+                        organic_shapes += 1
+
+        lines = cv2.HoughLinesP(edges, 1, np.pi / 180, threshold=50, minLineLength=50, maxLineGap=10)
+        straight_lines = len(lines) if lines is not None else 0
+
+        horizontal_kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (25, 1))
+        horizontal_lines = cv2.morphologyEx(edges, cv2.MORPH_OPEN, horizontal_kernel)
+        text_like_pixels = cv2.countNonZero(horizontal_lines)
+        text_ratio = text_like_pixels / total_pixels
+
+        height, width = img.shape[:2]
+
+        is_reasonable_size = height > 100 and width > 100
+        has_significant_green = green_ratio > 0.12
+        has_organic_texture = texture_variance > 500
+        has_natural_edges = 0.02 < edge_ratio < 0.25
+        has_natural_colors = color_mean > 15
+        reasonable_brightness = 30 < brightness < 220
+        good_contrast = contrast > 20
+        has_organic_shapes = organic_shapes > 0
+        not_too_geometric = straight_lines < 10
+        not_text_heavy = text_ratio < 0.05
+
+        score = 0
+        if has_significant_green:
+            score += 3
+        if has_organic_texture:
+            score += 2
+        if has_natural_edges:
+            score += 2
+        if has_natural_colors:
+            score += 1
+        if reasonable_brightness:
+            score += 1
+        if good_contrast:
+            score += 1
+        if has_organic_shapes:
+            score += 2
+        if not_too_geometric:
+            score += 1
+        if not_text_heavy:
+            score += 1
+
+        return score >= 7 and has_significant_green and is_reasonable_size
+
+    except Exception:
+        return False
+
+
+# =====================================================
+# VALIDATION
+# =====================================================
+def load_dataset(dataset_dir):
+    """[(path, is_plant_label)] from <dataset>/plant and <dataset>/not_plant."""
+    samples = []
+    for folder, label in (("plant", True), ("not_plant", False)):
+        root = os.path.join(dataset_dir, folder)
+        if not os.path.isdir(root):
+            raise SystemExit(f"❌ Missing {root}")
+        for dirpath, _, filenames in os.walk(root):
+            for f in sorted(filenames):
+                if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS:
+                    samples.append((os.path.join(dirpath, f), label))
+    return samples
+
+
+def validate(samples, thumbnail_size):
+    config = dict(PLANT_CHECK_CONFIG, thumbnail_size=thumbnail_size or None)
+    legacy_ms, cascade_ms = [], []
+    criterion_ms = defaultdict(list)
+    exits = Counter()
+    disagreements = []
+    legacy_correct = cascade_correct = 0
+
+    for path, label in samples:
+        t0 = time.perf_counter()
+        legacy = legacy_is_plant_image(path)
+        legacy_ms.append((time.perf_counter() - t0) * 1000)
+
+        t0 = time.perf_counter()
+        result = check_plant_image(path, config)
+        cascade_ms.append((time.perf_counter() - t0) * 1000)
+
+        for name, ms in result["timings"].items():
+            criterion_ms[name].append(ms)
+        exits[result["exit"]] += 1
+        legacy_correct += legacy == label
+        cascade_correct += result["is_plant"] == label
+        if result["is_plant"] != legacy:
+            disagreements.append((path, legacy, result))
+
+    n = len(samples)
+    label = f"{thumbnail_size}px thumbnail" if thumbnail_size else "full resolution"
+    print(f"\n🌿 Cascade on {label}: {n} images")
+    print(f"   Accuracy  : original {legacy_correct / n * 100:.1f}% | cascade {cascade_correct / n * 100:.1f}%")
+    print(f"   Agreement : {n - len(disagreements)}/{n}")
+    print(f"   Time      : original {statistics.mean(legacy_ms):.1f}ms | cascade "
+          f"{statistics.mean(cascade_ms):.1f}ms per image "
+          f"({statistics.mean(legacy_ms) / max(statistics.mean(cascade_ms), 1e-6):.1f}x)")
+    print("   Criteria  : " + "  ".join(
+        f"{name}={statistics.mean(criterion_ms[name]):.2f}ms×{len(criterion_ms[name])}"
+        for name in ["decode"] + [c[0] for c in CRITERIA] if criterion_ms[name]
+    ))
+    print("   Exits     : " + ", ".join(f"{k}={v}" for k, v in exits.most_common()))
+    for path, legacy, result in disagreements:
+        print(f"   ⚠️  {path}: original={'PLANT' if legacy else 'NOT PLANT'}, cascade="
+              f"{'PLANT' if result['is_plant'] else 'NOT PLANT'} ({result['exit']}, score {result['score']}, "
+              f"{result['metrics']})")
+    return not disagreements
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Validate the plant image check cascade")
+    parser.add_argument("dataset", help="Directory with plant/ and not_plant/ sub-folders")
+    parser.add_argument("--thumbnail", type=int, action="append",
+                        help="Thumbnail size to validate (0 = full resolution; repeatable). "
+                             f"Default: {PLANT_CHECK_CONFIG['thumbnail_size']}")
+    args = parser.parse_args(argv)
+
+    samples = load_dataset(args.dataset)
+    if not samples:
+        raise SystemExit("❌ No images found")
+
+    sizes = args.thumbnail or [PLANT_CHECK_CONFIG["thumbnail_size"]]
+    ok = all([validate(samples, size) for size in sizes])
+    print("\n✅ Decisions unchanged" if ok else "\n❌ Decisions changed")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,386 @@
+"""
+AgriPal - Disease classifier
+CPU-only inference for the 38-class leaf disease model, replacing the
+TensorFlow/Keras path that did not fit the 512 MB Render tier.
+
+Backends (loaded lazily on first use; with "auto" the first one whose
+model file exists wins):
+- onnx  : int8-quantized ONNX model through onnxruntime (optional dependency)
+- numpy : int8 weights in an .npz, pure NumPy forward pass
+- features : colour / lesion / texture descriptors + k-NN reference index
+  (feature_classifier.py, registered on import)
+
+Both keep the old Keras input contract (RGB, 128x128, float32 in [0, 1],
+see app2.preprocess_image) and classify every leaf of a photo in one
+batched forward pass. With no model available get_classifier() returns
+None and /predict keeps its review-required placeholder.
+
+Getting an int8 model from the old Keras .h5:
+    python -m tf2onnx.convert --keras plant_disease_model.h5 --output model.onnx
+    python disease_classifier.py quantize model.onnx models/disease_classifier.int8.onnx
+"""
+
+import logging
+import os
+import threading
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+CLASS_NAMES = [
+    "Apple_Apple_scab", "Apple_Black_rot", "Apple_Cedar_apple_rust", "Apple_healthy",
+    "Blueberry_healthy", "Cherry_(including_sour)Powdery_mildew", "Cherry(including_sour)_healthy",
+    "Corn_(maize)Cercospora_leaf_spot_Gray_leaf_spot", "Corn(maize)_Common_rust",
+    "Corn_(maize)Northern_Leaf_Blight", "Corn(maize)_healthy", "Grape_Black_rot",
+    "Grape_Esca_(Black_Measles)", "Grape_Leaf_blight_(Isariopsis_Leaf_Spot)", "Grape_healthy",
+    "Orange_Haunglongbing_(Citrus_greening)", "Peach_Bacterial_spot", "Peach_healthy",
+    "Pepper_bell_Bacterial_spot", "Pepper_bell_healthy", "Potato_Early_blight",
+    "Potato_Late_blight", "Potato_healthy", "Raspberry_healthy", "Soybean_healthy",
+    "Squash_Powdery_mildew", "Strawberry_Leaf_scorch", "Strawberry_healthy",
+    "Tomato_Bacterial_spot", "Tomato_Early_blight", "Tomato_Late_blight", "Tomato_Leaf_Mold",
+    "Tomato_Septoria_leaf_spot", "Tomato_Spider_mites_Two-spotted_spider_mite", "Tomato_Target_Spot",
+    "Tomato_Tomato_Yellow_Leaf_Curl_Virus", "Tomato_Tomato_mosaic_virus", "Tomato_healthy"
+]
+
+# =====================================================
+# CLASSIFIER SETTINGS
+# =====================================================
+CLASSIFIER_CONFIG = {
+    # "auto" tries BACKEND_ORDER; "none" disables classification
+    "backend": os.environ.get("AGRIPAL_CLASSIFIER", "auto"),
+
+    "model_dir": os.environ.get("AGRIPAL_MODEL_DIR", "models"),
+    "onnx_model": "disease_classifier.int8.onnx",
+    "numpy_model": "disease_classifier.npz",
+
+    # Old Keras contract: 128x128 RGB scaled to [0, 1]
+    "input_size": 128,
+
+    # Leaves per forward pass. The input is only 192 KB per leaf, but conv
+    # activations grow with the batch (~+60 MB RSS at 32 for a small CNN)
+    "max_batch": 8,
+
+    # onnxruntime intra-op threads (gunicorn already runs 4 request threads)
+    "threads": 1,
+
+    # Suggestions returned per leaf
+    "top_k": 3,
+}
+
+BACKEND_ORDER = ["onnx", "numpy"]
+
+
+# =====================================================
+# PREPROCESSING
+# =====================================================
+def preprocess_batch(images, size=128):
+    """
+    BGR uint8 crops → float32 NHWC batch (RGB, size×size, [0, 1]).
+    Resizes straight into one preallocated uint8 buffer, then converts the
+    whole batch at once.
+    """
+    batch = np.empty((len(images), size, size, 3), np.uint8)
+    for i, image in enumerate(images):
+        # Same interpolation as PIL's default resize in preprocess_image
+        cv2.resize(image, (size, size), dst=batch[i], interpolation=cv2.INTER_CUBIC)
+        cv2.cvtColor(batch[i], cv2.COLOR_BGR2RGB, dst=batch[i])
+    return np.multiply(batch, np.float32(1 / 255), dtype=np.float32)
+
+
+def leaf_crops(segmented, leaf_results):
+    """Views of each leaf's bbox in the segmented working image."""
+    return [segmented[y:y + h, x:x + w] for x, y, w, h in (leaf["bbox"] for leaf in leaf_results)]
+
+
+def _softmax(logits):
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    np.exp(shifted, out=shifted)
+    shifted /= shifted.sum(axis=1, keepdims=True)
+    return shifted
+
+
+def _as_probabilities(outputs):
+    """Model outputs → probabilities (Keras models usually end in softmax already)."""
+    outputs = np.asarray(outputs, np.float32)
+    rows_sum_to_one = np.allclose(outputs.sum(axis=1), 1.0, atol=1e-3) and outputs.min() >= 0
+    return outputs if rows_sum_to_one else _softmax(outputs)
+
+
+# =====================================================
+# BACKENDS
+# =====================================================
+class OnnxBackend:
+    """int8-quantized ONNX model on onnxruntime's CPU provider."""
+
+    name = "onnx"
+
+    def __init__(self, path, threads=1):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        # The arena keeps the largest batch's buffers forever; small, bursty
+        # batches are cheaper to allocate on demand within the memory budget
+        options.enable_cpu_mem_arena = False
+
+        self.path = path
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+        # Keras exports are NHWC; PyTorch-style exports are NCHW
+        self.channels_first = len(model_input.shape) == 4 and model_input.shape[1] == 3
+        # Fixed batch dimension → feed leaves one at a time
+        self.fixed_batch = model_input.shape[0] if isinstance(model_input.shape[0], int) else None
+
+    def predict(self, batch):
+        if self.channels_first:
+            batch = np.ascontiguousarray(batch.transpose(0, 3, 1, 2))
+        if self.fixed_batch == 1 and len(batch) > 1:
+            return np.concatenate([self.predict_raw(batch[i:i + 1]) for i in range(len(batch))])
+        return self.predict_raw(batch)
+
+    def predict_raw(self, batch):
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+class NumpyBackend:
+    """
+    Dense network stored as an .npz of int8 weights with per-output-channel
+    float32 scales: w{i}_q (in, out) int8, w{i}_scale (out,), b{i} (out,),
+    optional `pool` (average-pool factor applied to the 128×128 input first),
+    `mean` / `std` (input normalisation) and `class_names`.
+    ReLU between layers, probabilities out.
+    """
+
+    name = "numpy"
+
+    def __init__(self, path):
+        self.path = path
+        with np.load(path, allow_pickle=False) as data:
+            self.pool = int(data["pool"]) if "pool" in data else 1
+            self.mean = data["mean"].astype(np.float32) if "mean" in data else None
+            self.std = data["std"].astype(np.float32) if "std" in data else None
+            self.class_names = [str(c) for c in data["class_names"]] if "class_names" in data else None
+            self.layers = []
+            i = 0
+            while f"w{i}_q" in data:
+                self.layers.append((
+                    data[f"w{i}_q"].astype(np.int8),
+                    data[f"w{i}_scale"].astype(np.float32),
+                    data[f"b{i}"].astype(np.float32),
+                ))
+                i += 1
+        if not self.layers:
+            raise ValueError(f"No layers in {path}")
+
+    def predict(self, batch):
+        n, h, w, c = batch.shape
+        if self.pool > 1:
+            p = self.pool
+            batch = batch.reshape(n, h // p, p, w // p, p, c).mean(axis=(2, 4), dtype=np.float32)
+        x = batch.reshape(n, -1)
+        if self.mean is not None:
+            x = (x - self.mean) / self.std
+
+        for i, (w_q, scale, bias) in enumerate(self.layers):
+            # Dequantize one layer at a time: only one float32 copy alive
+            x = x @ w_q.astype(np.float32)
+            x *= scale
+            x += bias
+            if i < len(self.layers) - 1:
+                np.maximum(x, 0, out=x)
+        return x
+
+
+def _load_onnx(config):
+    path = os.path.join(config["model_dir"], config["onnx_model"])
+    if not os.path.exists(path):
+        return None
+    try:
+        return OnnxBackend(path, threads=config["threads"])
+    except ImportError:
+        logger.warning(f"⚠️  {path} found but onnxruntime is not installed")
+        return None
+
+
+def _load_numpy(config):
+    path = os.path.join(config["model_dir"], config["numpy_model"])
+    return NumpyBackend(path) if os.path.exists(path) else None
+
+
+# name → loader(config) returning a backend, or None when its model is absent
+BACKENDS = {
+    "onnx": _load_onnx,
+    "numpy": _load_numpy,
+}
+
+
+def register_backend(name, loader, preferred=False):
+    """Add a backend loader; `preferred` puts it first in the auto order."""
+    BACKENDS[name] = loader
+    if name not in BACKEND_ORDER:
+        BACKEND_ORDER.insert(0 if preferred else len(BACKEND_ORDER), name)
+
+
+# =====================================================
+# CLASSIFIER
+# =====================================================
+class DiseaseClassifier:
+    """Batched leaf classification on top of one backend."""
+
+    def __init__(self, backend, class_names=None, config=None):
+        self.backend = backend
+        self.config = config or CLASSIFIER_CONFIG
+        self.class_names = class_names or getattr(backend, "class_names", None) or CLASS_NAMES
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    def predict_proba(self, images):
+        """(N, classes) probabilities for BGR leaf crops, max_batch leaves per pass."""
+        step = self.config["max_batch"]
+        probs = [
+            _as_probabilities(self.backend.predict(
+                preprocess_batch(images[i:i + step], self.config["input_size"])
+            ))
+            for i in range(0, len(images), step)
+        ]
+        return np.concatenate(probs) if probs else np.zeros((0, len(self.class_names)), np.float32)
+
+    def classify(self, images):
+        """
+        One result per crop: {'predicted_class', 'confidence' (0–100),
+        'top_predictions': [(class, confidence), ...]}.
+        """
+        if not len(images):
+            return []
+
+        probs = self.predict_proba(images)
+        if probs.shape[1] != len(self.class_names):
+            raise ValueError(f"Model has {probs.shape[1]} outputs for {len(self.class_names)} classes")
+
+        top_k = self.config["top_k"]
+        order = np.argsort(-probs, axis=1)[:, :top_k]
+        results = []
+        for row, top in zip(probs, order):
+            results.append({
+                "predicted_class": self.class_names[top[0]],
+                "confidence": round(float(row[top[0]]) * 100, 2),
+                "top_predictions": [
+                    (self.class_names[k], round(float(row[k]) * 100, 2)) for k in top if row[k] > 0
+                ],
+            })
+        return results
+
+
+_classifier_lock = threading.Lock()
+_classifier = None
+_classifier_loaded = False
+_classifier_status = {"backend": None, "loaded": False}
+
+
+def get_classifier(config=None):
+    """
+    The process-wide DiseaseClassifier, loaded on first call (None when no
+    backend has a model). Later calls return the cached result.
+    """
+    global _classifier, _classifier_loaded, _classifier_status
+
+    if _classifier_loaded:
+        return _classifier
+
+    with _classifier_lock:
+        if _classifier_loaded:
+            return _classifier
+
+        config = config or CLASSIFIER_CONFIG
+        requested = config["backend"].lower()
+        names = BACKEND_ORDER if requested == "auto" else ([] if requested == "none" else [requested])
+
+        t0 = time.time()
+        for name in names:
+            loader = BACKENDS.get(name)
+            if loader is None:
+                logger.warning(f"⚠️  Unknown classifier backend '{name}'")
+                continue
+            try:
+                backend = loader(config)
+            except Exception as e:
+                logger.error(f"❌ Classifier backend '{name}' failed to load: {e}")
+                continue
+            if backend is not None:
+                _classifier = DiseaseClassifier(backend, config=config)
+                break
+
+        _classifier_loaded = True
+        if _classifier:
+            _classifier_status = {
+                "backend": _classifier.name,
+                "model": getattr(_classifier.backend, "path", None),
+                "loaded": True,
+                "load_time": round(time.time() - t0, 3),
+            }
+            logger.info(f"🧠 Disease classifier ready: {_classifier.name} "
+                        f"({_classifier_status['model']}, {_classifier_status['load_time']}s)")
+        else:
+            _classifier_status = {"backend": None, "loaded": False}
+            logger.warning("⚠️  No disease classifier model found — predictions stay in review mode")
+        return _classifier
+
+
+def reset_classifier():
+    """Forget the loaded classifier so the next get_classifier() reloads."""
+    global _classifier, _classifier_loaded
+    with _classifier_lock:
+        _classifier = None
+        _classifier_loaded = False
+
+
+def classifier_status():
+    """Backend / model / load state for /health (does not trigger loading)."""
+    return dict(_classifier_status, attempted=_classifier_loaded)
+
+
+# =====================================================
+# CLI
+# =====================================================
+def quantize_onnx(src, dst):
+    """Dynamic int8 quantization of an fp32 ONNX model (weights → int8)."""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    os.makedirs(os.path.dirname(os.path.abspath(dst)), exist_ok=True)
+    quantize_dynamic(src, dst, weight_type=QuantType.QInt8)
+    logger.info(f"✅ Quantized {src} ({os.path.getsize(src) / 1e6:.1f} MB) → "
+                f"{dst} ({os.path.getsize(dst) / 1e6:.1f} MB)")
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="AgriPal disease classifier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    q = sub.add_parser("quantize", help="int8-quantize an ONNX model")
+    q.add_argument("src")
+    q.add_argument("dst")
+    c = sub.add_parser("classify", help="Classify whole images with the configured backend")
+    c.add_argument("images", nargs="+")
+    args = parser.parse_args()
+
+    if args.command == "quantize":
+        quantize_onnx(args.src, args.dst)
+    else:
+        classifier = get_classifier()
+        if classifier is None:
+            raise SystemExit("❌ No classifier model available")
+        paths = [p for p in args.images if cv2.haveImageReader(p)]
+        crops = [cv2.imread(p) for p in paths]
+        for path, result in zip(paths, classifier.classify(crops)):
+            print(f"{path}: {result['predicted_class']} ({result['confidence']}%)")
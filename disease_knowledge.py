@@ -0,0 +1,330 @@
+"""
+AgriPal - Disease knowledge index
+Treatment records from disease_treatments.json, prepared once per file
+version instead of on every get_disease_info() call:
+
+- every entry is normalized up front (frequency / safety / usage and
+  other required pesticide fields filled in, YouTube search and channel
+  URLs built) and frozen: lookups hand out the shared, read-only entry
+  with no copying
+- exact keys, normalized spellings ("Tomato___Early_blight",
+  "tomato early blight") and display names resolve through one dict
+- anything else goes through a token index (Jaccard overlap, memoized),
+  which also maps classifier labels such as
+  "Corn_(maize)Northern_Leaf_Blight" onto the "Corn_Northern_Leaf_Blight"
+  record; a fuzzy match stays within the crop named first
+- the file's mtime is checked every few seconds and a changed file is
+  rebuilt and swapped in; a broken file keeps the previous index
+"""
+
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+from hashlib import sha256
+from urllib.parse import quote_plus
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# KNOWLEDGE SETTINGS
+# =====================================================
+KNOWLEDGE_CONFIG = {
+    "path": "disease_treatments.json",
+
+    # Seconds between mtime checks for hot reload
+    "reload_check_s": 2.0,
+
+    # Minimum token overlap (Jaccard) for a fuzzy match
+    "min_fuzzy_score": 0.5,
+
+    # Memoized fuzzy lookups per index version
+    "fuzzy_cache_size": 1024,
+}
+
+REQUIRED_TREATMENT_FIELDS = {
+    "dosage_per_hectare": 0.0,
+    "unit": "L",
+    "usage": "Apply as directed",
+    "frequency": "As needed",
+    "safety": "Follow product label instructions",
+}
+
+FALLBACK_USAGE = ("Apply as directed on product label. Ensure thorough coverage of all affected plant "
+                  "surfaces. Repeat applications as needed based on disease pressure.")
+FALLBACK_FREQUENCY = "Apply according to product label recommendations and disease pressure."
+FALLBACK_SAFETY = {
+    "chemical": "Wear protective equipment. Follow all label precautions. Keep away from water sources.",
+    "organic": "Safe for beneficial insects when used as directed. Apply during cooler parts of day.",
+}
+
+
+# =====================================================
+# FROZEN VIEWS
+# =====================================================
+class FrozenDict(dict):
+    """
+    Read-only dict. Still a dict for jsonify / Jinja / isinstance checks;
+    every mutating method raises TypeError. thaw() gives a mutable copy.
+    """
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Disease knowledge entries are read-only; use thaw() for a mutable copy")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((k, freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    return value
+
+
+def thaw(value):
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(v) for v in value]
+    return value
+
+
+# =====================================================
+# NAMES
+# =====================================================
+def name_tokens(name):
+    """Lower-case word tokens; "sourPowdery" and "Leaf_Spot)" split as words."""
+    name = re.sub(r"(?<=[a-z])(?=[A-Z])", " ", name or "")
+    return re.findall(r"[a-z0-9]+", name.lower())
+
+
+def normalize_name(name):
+    return " ".join(name_tokens(name))
+
+
+def _youtube_search(query):
+    return f"https://www.youtube.com/results?search_query={quote_plus(query)}"
+
+
+# =====================================================
+# ENTRY PREPARATION (once per entry per file version)
+# =====================================================
+def prepare_entry(key, info):
+    """
+    Normalized copy of a raw record: the pesticide fields get the same
+    fallbacks get_disease_info() used to add per call, plus search URLs.
+    Returns (entry, number of fallbacks applied).
+    """
+    info = json.loads(json.dumps(info))  # private copy of the raw record
+    fallbacks = 0
+    for treatment_type, treatment in (info.get("pesticide") or {}).items():
+        if not isinstance(treatment, dict) or treatment_type not in ("chemical", "organic"):
+            continue
+
+        if "application_frequency" in treatment and "frequency" not in treatment:
+            treatment["frequency"] = treatment["application_frequency"]
+        elif not treatment.get("frequency"):
+            treatment["frequency"] = FALLBACK_FREQUENCY
+            fallbacks += 1
+
+        if "precautions" in treatment and "safety" not in treatment:
+            treatment["safety"] = treatment["precautions"]
+        elif not treatment.get("safety"):
+            treatment["safety"] = FALLBACK_SAFETY[treatment_type]
+            fallbacks += 1
+
+        if len((treatment.get("usage") or "").strip()) < 10:
+            treatment["usage"] = FALLBACK_USAGE
+            fallbacks += 1
+
+        defaults = dict(REQUIRED_TREATMENT_FIELDS, name=f"{treatment_type.title()} Treatment")
+        for field, default in defaults.items():
+            if not treatment.get(field):
+                treatment[field] = default
+                fallbacks += 1
+
+        videos = treatment.get("video_sources")
+        if isinstance(videos, dict):
+            if "search_terms" in videos:
+                videos["search_urls"] = [
+                    {"term": term, "url": _youtube_search(term)} for term in videos["search_terms"]
+                ]
+            if "reliable_channels" in videos:
+                videos["channel_urls"] = [
+                    {"name": channel, "url": _youtube_search(f"{channel} {key.replace('_', ' ')}")}
+                    for channel in videos["reliable_channels"]
+                ]
+    return info, fallbacks
+
+
+# =====================================================
+# INDEX (one immutable snapshot per file version)
+# =====================================================
+class KnowledgeIndex:
+    """Frozen entries + alias map + token index for one version of the data."""
+
+    def __init__(self, records, version):
+        self.version = version
+        self.fallbacks = 0
+        entries = {}
+        for key, info in records.items():
+            entry, fallbacks = prepare_entry(key, info)
+            entries[key] = freeze(entry)
+            self.fallbacks += fallbacks
+        self.entries = FrozenDict(entries)
+
+        # Alias → key: normalized keys, then display names and any
+        # "aliases" listed in the record (first record wins on a clash)
+        self.aliases = {}
+        alias_tokens = []
+        names = [(key, key) for key in entries]
+        names += [(key, name) for key, entry in entries.items()
+                  for name in [entry.get("name", "")] + list(entry.get("aliases", ()))]
+        for key, name in names:
+            normalized = normalize_name(name)
+            if normalized:
+                self.aliases.setdefault(normalized, key)
+                alias_tokens.append((key, frozenset(normalized.split())))
+
+        self._alias_tokens = alias_tokens
+        # Crop of each record (first word of its key): a fuzzy match never
+        # crosses crops, so "Grape_Black_rot" can't land on "Apple_Black_rot"
+        self._crops = {key: name_tokens(key)[0] for key in entries if name_tokens(key)}
+        self._token_index = defaultdict(list)
+        for i, (_, tokens) in enumerate(alias_tokens):
+            for token in tokens:
+                self._token_index[token].append(i)
+
+        self._fuzzy_cache = {}
+        self._fuzzy_lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def resolve(self, name):
+        """Record key for `name` (exact, alias or fuzzy), or None."""
+        if not name:
+            return None
+        if name in self.entries:
+            return name
+        key = self.aliases.get(normalize_name(name))
+        if key is not None:
+            return key
+
+        with self._fuzzy_lock:
+            if name in self._fuzzy_cache:
+                return self._fuzzy_cache[name]
+        key = self._fuzzy(name)
+        with self._fuzzy_lock:
+            if len(self._fuzzy_cache) >= KNOWLEDGE_CONFIG["fuzzy_cache_size"]:
+                self._fuzzy_cache.clear()
+            self._fuzzy_cache[name] = key
+        return key
+
+    def _fuzzy(self, name):
+        tokens = name_tokens(name)
+        query = frozenset(tokens)
+        crop = tokens[0] if tokens and tokens[0] in self._crops.values() else None
+        overlaps = defaultdict(int)
+        for token in query:
+            for i in self._token_index.get(token, ()):
+                overlaps[i] += 1
+
+        best = {}
+        for i, overlap in overlaps.items():
+            key, alias = self._alias_tokens[i]
+            if crop is not None and self._crops.get(key) != crop:
+                continue
+            score = overlap / (len(query) + len(alias) - overlap)
+            best[key] = max(best.get(key, 0.0), score)
+        if not best:
+            return None
+
+        ranked = sorted(best.items(), key=lambda kv: kv[1], reverse=True)
+        key, score = ranked[0]
+        if score < KNOWLEDGE_CONFIG["min_fuzzy_score"]:
+            return None
+        if len(ranked) > 1 and ranked[1][1] == score:
+            logger.warning(f"⚠️ Ambiguous disease name '{name}': {ranked[0][0]} / {ranked[1][0]}")
+            return None
+        logger.info(f"🔎 Fuzzy disease match: '{name}' → {key} ({score:.2f})")
+        return key
+
+    def get(self, name):
+        key = self.resolve(name)
+        return self.entries[key] if key is not None else None
+
+
+# =====================================================
+# HOT-RELOADING HOLDER
+# =====================================================
+class DiseaseKnowledge:
+    """The current KnowledgeIndex for a JSON file, rebuilt when the file changes."""
+
+    def __init__(self, path=None):
+        self.path = path or KNOWLEDGE_CONFIG["path"]
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._checked = 0.0
+        self._index = KnowledgeIndex({}, version="empty")
+        self.reload()
+
+    def _file_stamp(self):
+        try:
+            st = os.stat(self.path)
+            return st.st_mtime_ns, st.st_size
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        """Rebuild from the file; keeps the current index if the file is broken."""
+        with self._lock:
+            stamp = self._file_stamp()
+            self._checked = time.monotonic()
+            if stamp is None:
+                logger.error(f"Disease treatments file not found at: {os.path.abspath(self.path)}")
+                self._stamp = None
+                return False
+            try:
+                with open(self.path, "rb") as f:
+                    raw = f.read()
+                records = json.loads(raw)
+                t0 = time.perf_counter()
+                index = KnowledgeIndex(records, version=sha256(raw).hexdigest()[:12])
+            except (ValueError, AttributeError, TypeError) as e:
+                logger.error(f"Error loading disease treatments (keeping {len(self._index)} loaded): {e}")
+                self._stamp = stamp  # don't retry the same broken file every check
+                return False
+
+            self._index, self._stamp = index, stamp
+        logger.info(
+            f"📚 Disease knowledge v{index.version}: {len(index)} diseases, {len(index.aliases)} aliases, "
+            f"{index.fallbacks} field fallbacks, built in {(time.perf_counter() - t0) * 1000:.1f}ms"
+        )
+        return True
+
+    @property
+    def index(self):
+        if time.monotonic() - self._checked >= KNOWLEDGE_CONFIG["reload_check_s"]:
+            self._checked = time.monotonic()
+            if self._file_stamp() != self._stamp:
+                self.reload()
+        return self._index
+
+    def get(self, name):
+        return self.index.get(name)
+
+    @property
+    def version(self):
+        return self.index.version
+
+    def __len__(self):
+        return len(self.index)
@@ -0,0 +1,212 @@
+"""
+AgriPal - Dosage arithmetic
+One area-conversion table and one infection → multiplier table for every
+dosage path (single disease, single deficiency, bulk plans), plus the
+vectorized bulk planner behind /api/calculate-dosage/bulk.
+
+Bulk plans are for FPOs (farmer producer organisations) planning hundreds
+of plots at once:
+each plot names a disease or a deficiency; product records are looked up
+once per distinct name, every plot is computed in one pass of NumPy array
+arithmetic, and the quantities are summed per product into a procurement
+list.
+
+Disease plots are infection-aware, as on the result page:
+    rate/ha × area ha × infection % × severity multiplier
+Deficiency plots are the whole area at the fertilizer rate:
+    rate/ha × area ha
+"""
+
+import logging
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# SHARED TABLES
+# =====================================================
+# Hectares per unit of area (the forms send both "square_feet" and "square_foot")
+AREA_TO_HECTARE = {
+    "hectare": 1.0,
+    "acre": 0.404686,
+    "square_meter": 0.0001,
+    "square_feet": 0.0000092903,
+    "square_foot": 0.0000092903,
+}
+
+# Infection % band lower edges and the dosage multiplier for each band:
+# <25 → 0.85, 25-50 → 1.00, 50-75 → 1.10, ≥75 → 1.25
+SEVERITY_BAND_EDGES = np.array([25.0, 50.0, 75.0])
+SEVERITY_MULTIPLIERS = np.array([0.85, 1.00, 1.10, 1.25])
+
+DOSAGE_CONFIG = {
+    # Largest number of plots accepted in one bulk request
+    "max_plots": 5000,
+
+    # Infection % used when a disease plot doesn't give one
+    "default_infection_percent": 50.0,
+}
+
+
+def to_hectares(area, area_unit):
+    """Area in hectares; unknown units count as hectares (legacy behaviour)."""
+    return area * AREA_TO_HECTARE.get(area_unit, 1.0)
+
+
+def severity_multiplier(infection_pct):
+    """Dosage multiplier for an infection % (scalar or array)."""
+    multipliers = SEVERITY_MULTIPLIERS[np.searchsorted(SEVERITY_BAND_EDGES, infection_pct, side="right")]
+    return float(multipliers) if np.ndim(multipliers) == 0 else multipliers
+
+
+def _rate(treatment):
+    """(dosage_per_hectare as float, unit, name) of a product record."""
+    treatment = treatment or {}
+    try:
+        rate = float(treatment.get("dosage_per_hectare", 0) or 0)
+    except (TypeError, ValueError):
+        rate = 0.0
+    return rate, treatment.get("unit", ""), treatment.get("name", "N/A")
+
+
+def _number(value, default=None):
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return default
+    return value if np.isfinite(value) else default
+
+
+# =====================================================
+# BULK PLANNER
+# =====================================================
+def plan_bulk_dosage(plots, disease_lookup, deficiency_lookup):
+    """
+    Per-plot quantities and per-product totals for a list of plots.
+
+    plots: [{"id", "area", "area_unit", "disease_name" | "deficiency_key",
+             "infection_percent", "plant_severity"}]
+    disease_lookup(name) → pesticide dict ({"chemical", "organic"}) or None
+    deficiency_lookup(key) → fertilizer dict ({"chemical", "organic"}) or None
+
+    Plots that can't be computed (bad area / unit, unknown disease) come
+    back with an "error" and are left out of the totals.
+    """
+    # ── resolve products once per distinct disease / deficiency ────────────
+    products = {}
+
+    def product_for(kind, name):
+        if (kind, name) not in products:
+            lookup = disease_lookup if kind == "disease" else deficiency_lookup
+            products[(kind, name)] = lookup(name) if name else None
+        return products[(kind, name)]
+
+    rows, errors = [], {}
+    for i, plot in enumerate(plots):
+        plot = plot if isinstance(plot, dict) else {}
+        kind, name = ("disease", plot.get("disease_name")) if plot.get("disease_name") else \
+                     ("deficiency", plot.get("deficiency_key"))
+        area = _number(plot.get("area"))
+        unit = plot.get("area_unit", "hectare")
+        if not isinstance(plots[i], dict):
+            errors[i] = "Plot must be an object"
+        elif area is None or area <= 0:
+            errors[i] = "Area must be a positive number"
+        elif unit not in AREA_TO_HECTARE:
+            errors[i] = f"Unknown area unit '{unit}'"
+        elif not name:
+            errors[i] = "Plot needs a disease_name or deficiency_key"
+        elif not product_for(kind, name):
+            errors[i] = f"No treatment information for {kind} '{name}'"
+        rows.append((kind, name, area or 0.0, unit))
+
+    n = len(rows)
+    valid = np.array([i not in errors for i in range(n)], dtype=bool)
+
+    # ── columns ────────────────────────────────────────────────────────────
+    area = np.array([r[2] for r in rows], dtype=np.float64)
+    to_ha = np.array([AREA_TO_HECTARE.get(r[3], 0.0) for r in rows], dtype=np.float64)
+    is_disease = np.array([r[0] == "disease" for r in rows], dtype=bool)
+
+    default_pct = DOSAGE_CONFIG["default_infection_percent"]
+    infection = np.array([_number(p.get("infection_percent"), default_pct) if isinstance(p, dict) else default_pct
+                          for p in plots], dtype=np.float64)
+    ai_severity = np.array([_number(p.get("plant_severity"), 0.0) if isinstance(p, dict) else 0.0
+                            for p in plots], dtype=np.float64)
+    effective_pct = np.clip(np.maximum(np.clip(infection, 1.0, 100.0), np.clip(ai_severity, 0.0, 100.0)), 1.0, 100.0)
+
+    rates = {}
+    for treatment_type in ("chemical", "organic"):
+        info = [_rate((product_for(kind, name) or {}).get(treatment_type)) if i not in errors else (0.0, "", "N/A")
+                for i, (kind, name, _, _) in enumerate(rows)]
+        rates[treatment_type] = info
+
+    # ── one pass of array arithmetic for every plot ────────────────────────
+    total_ha = np.where(valid, area * to_ha, 0.0)
+    treated_fraction = np.where(is_disease, effective_pct / 100.0, 1.0)
+    multiplier = np.where(is_disease, severity_multiplier(effective_pct), 1.0)
+    effective_ha = total_ha * treated_fraction
+
+    quantities = {}
+    for treatment_type, info in rates.items():
+        rate = np.array([r[0] for r in info], dtype=np.float64)
+        quantities[treatment_type] = rate * effective_ha * multiplier
+
+    # ── procurement totals per product (name + unit) ───────────────────────
+    totals = {}
+    for treatment_type, info in rates.items():
+        keys = [(r[2], r[1]) if valid[i] and r[0] > 0 else None for i, r in enumerate(info)]
+        product_keys = sorted({k for k in keys if k is not None})
+        index = {k: j for j, k in enumerate(product_keys)}
+        mask = np.array([k is not None for k in keys], dtype=bool)
+        slots = np.array([index[k] for k in keys if k is not None], dtype=np.int64)
+        sums = np.bincount(slots, weights=quantities[treatment_type][mask], minlength=len(product_keys))
+        counts = np.bincount(slots, minlength=len(product_keys))
+        totals[treatment_type] = [
+            {"name": name, "unit": unit, "quantity": round(float(q), 3), "plots": int(c)}
+            for (name, unit), q, c in zip(product_keys, sums, counts)
+        ]
+
+    # ── per-plot results ───────────────────────────────────────────────────
+    results = []
+    for i, (kind, name, _, unit) in enumerate(rows):
+        plot = plots[i] if isinstance(plots[i], dict) else {}
+        result = {"index": i, "id": plot.get("id", i), "type": kind, "name": name}
+        if i in errors:
+            result["error"] = errors[i]
+            results.append(result)
+            continue
+        result.update({
+            "area": float(area[i]),
+            "area_unit": unit,
+            "total_area_hectares": round(float(total_ha[i]), 4),
+            "effective_area_hectares": round(float(effective_ha[i]), 4),
+        })
+        if is_disease[i]:
+            result["effective_infection_pct"] = round(float(effective_pct[i]), 1)
+            result["severity_multiplier"] = float(multiplier[i])
+        for treatment_type, info in rates.items():
+            rate, unit_name, product = info[i]
+            result[f"{treatment_type}_dosage"] = {
+                "name": product,
+                "unit": unit_name,
+                "amount": round(float(quantities[treatment_type][i]), 3) if rate > 0 else None,
+            }
+        results.append(result)
+
+    logger.info(
+        f"🧮 Bulk dosage plan: {n} plots ({int(valid.sum())} ok, {len(errors)} rejected), "
+        f"{round(float(total_ha.sum()), 2)} ha, {len(products)} distinct products looked up"
+    )
+    return {
+        "plots": results,
+        "totals": totals,
+        "summary": {
+            "plots": n,
+            "computed": int(valid.sum()),
+            "rejected": len(errors),
+            "total_area_hectares": round(float(total_ha.sum()), 4),
+            "treated_area_hectares": round(float(effective_ha.sum()), 4),
+        },
+    }
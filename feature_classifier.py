@@ -0,0 +1,331 @@
+"""
+AgriPal - Feature-based disease classifier
+Model-free fallback backend for disease_classifier: every leaf crop is
+reduced to a compact descriptor (HSV histograms, lesion statistics in the
+style of segment2.calculate_leaf_severity_fast, texture statistics) and
+matched against a small float32 reference index with a vectorized
+k-nearest-neighbour search. A few milliseconds per leaf, no download.
+
+Build the index from labelled photos (one folder per class, folder names
+matching class_names; PlantVillage "Apple___Apple_scab" style works too):
+    python feature_classifier.py build /data/plantvillage --per-class 200
+
+The index lands in models/disease_features.npz and is picked up by
+disease_classifier's "auto" mode after any neural model.
+"""
+
+import logging
+import os
+import re
+import time
+
+import cv2
+import numpy as np
+
+from disease_classifier import CLASS_NAMES, CLASSIFIER_CONFIG, preprocess_batch, register_backend
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# FEATURE SETTINGS
+# =====================================================
+FEATURE_CONFIG = {
+    "index": "disease_features.npz",
+
+    # Histogram bins over leaf pixels
+    "hue_bins": 16,
+    "sat_bins": 4,
+    "val_bins": 4,
+
+    # Neighbours voting for each leaf (distance weighted)
+    "k": 5,
+
+    # Reference images kept per class when building
+    "per_class": 200,
+}
+
+# Same lesion / leaf thresholds as segment2.calculate_leaf_severity_fast
+LESION_LOWER = np.array([0, 40, 20], np.uint8)
+LESION_UPPER = np.array([25, 255, 255], np.uint8)
+LEAF_GRAY_THRESHOLD = 10
+
+INDEX_VERSION = 1
+
+
+# =====================================================
+# DESCRIPTORS
+# =====================================================
+def descriptor_size(config=None):
+    config = config or FEATURE_CONFIG
+    return config["hue_bins"] + config["sat_bins"] + config["val_bins"] + 6 + 4
+
+
+def _masked_hist(channel, mask, bins, upper, leaf_pixels):
+    hist = cv2.calcHist([channel], [0], mask, [bins], [0, upper]).ravel()
+    return hist / leaf_pixels
+
+
+def leaf_descriptor(rgb, config=None):
+    """
+    float32 descriptor of one RGB uint8 leaf crop (background black, as in
+    segment2's segmented image):
+    - HSV histograms of leaf pixels (hue, saturation, value)
+    - lesion stats: lesion fraction, lesion count / 100 px², mean and
+      largest lesion size, chlorotic (yellow) and necrotic (dark) fractions
+    - texture: grey std, mean / std gradient magnitude, Laplacian energy
+    """
+    config = config or FEATURE_CONFIG
+    out = np.zeros(descriptor_size(config), np.float32)
+
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    _, leaf_mask = cv2.threshold(gray, LEAF_GRAY_THRESHOLD, 255, cv2.THRESH_BINARY)
+    leaf_pixels = cv2.countNonZero(leaf_mask)
+    if leaf_pixels == 0:
+        return out
+
+    hsv = cv2.cvtColor(rgb, cv2.COLOR_RGB2HSV)
+    h, s, v = cv2.split(hsv)
+    i = 0
+    for channel, bins, upper in ((h, config["hue_bins"], 180), (s, config["sat_bins"], 256),
+                                 (v, config["val_bins"], 256)):
+        out[i:i + bins] = _masked_hist(channel, leaf_mask, bins, upper, leaf_pixels)
+        i += bins
+
+    # Lesion statistics
+    lesions = cv2.inRange(hsv, LESION_LOWER, LESION_UPPER)
+    cv2.bitwise_and(lesions, leaf_mask, dst=lesions)
+    n, _, stats, _ = cv2.connectedComponentsWithStats(lesions, connectivity=8)
+    areas = stats[1:, cv2.CC_STAT_AREA] / leaf_pixels
+    chlorotic = cv2.inRange(hsv, (25, 60, 80), (35, 255, 255))
+    necrotic = cv2.inRange(hsv, (0, 0, 0), (180, 255, 60))
+    out[i:i + 6] = (
+        cv2.countNonZero(lesions) / leaf_pixels,
+        (n - 1) * 100 / leaf_pixels,
+        areas.mean() if len(areas) else 0.0,
+        areas.max() if len(areas) else 0.0,
+        cv2.countNonZero(cv2.bitwise_and(chlorotic, leaf_mask, dst=chlorotic)) / leaf_pixels,
+        cv2.countNonZero(cv2.bitwise_and(necrotic, leaf_mask, dst=necrotic)) / leaf_pixels,
+    )
+    i += 6
+
+    # Texture statistics over leaf pixels
+    gray_f = gray.astype(np.float32) / 255
+    gx = cv2.Sobel(gray_f, cv2.CV_32F, 1, 0, ksize=3)
+    gy = cv2.Sobel(gray_f, cv2.CV_32F, 0, 1, ksize=3)
+    magnitude = cv2.magnitude(gx, gy)
+    laplacian = cv2.Laplacian(gray_f, cv2.CV_32F)
+    inner = cv2.erode(leaf_mask, None, iterations=2)  # leaf edge is not texture
+    if not cv2.countNonZero(inner):
+        inner = leaf_mask
+    _, gray_std = cv2.meanStdDev(gray_f, mask=leaf_mask)
+    mag_mean, mag_std = cv2.meanStdDev(magnitude, mask=inner)
+    _, lap_std = cv2.meanStdDev(laplacian, mask=inner)
+    out[i:i + 4] = (gray_std[0, 0], mag_mean[0, 0], mag_std[0, 0], lap_std[0, 0])
+    return out
+
+
+def describe_batch(batch, config=None):
+    """(N, D) descriptors for a float32 NHWC RGB [0, 1] batch (preprocess_batch output)."""
+    images = np.multiply(batch, 255, dtype=np.float32).round().astype(np.uint8)
+    return np.stack([leaf_descriptor(image, config) for image in images]) if len(images) else \
+        np.zeros((0, descriptor_size(config)), np.float32)
+
+
+# =====================================================
+# REFERENCE INDEX
+# =====================================================
+class FeatureIndex:
+    """
+    Standardised reference descriptors with integer labels into
+    `class_names`, searched with a vectorized k-NN.
+    """
+
+    def __init__(self, vectors, labels, class_names, mean, std, k=5):
+        self.mean = mean.astype(np.float32)
+        self.std = std.astype(np.float32)
+        self.vectors = np.ascontiguousarray(vectors, np.float32)
+        self.labels = labels.astype(np.int16)
+        self.class_names = list(class_names)
+        self.k = int(k)
+        self._sq_norms = np.einsum("ij,ij->i", self.vectors, self.vectors)
+
+    @classmethod
+    def build(cls, descriptors, labels, class_names, k=5):
+        descriptors = np.asarray(descriptors, np.float32)
+        mean = descriptors.mean(axis=0)
+        std = descriptors.std(axis=0)
+        std[std < 1e-6] = 1.0
+        return cls((descriptors - mean) / std, np.asarray(labels), class_names, mean, std, k)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            if int(data["version"]) != INDEX_VERSION:
+                raise ValueError(f"{path}: index version {int(data['version'])}, expected {INDEX_VERSION}")
+            return cls(data["vectors"], data["labels"], [str(c) for c in data["class_names"]],
+                       data["mean"], data["std"], int(data["k"]))
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        np.savez(
+            path, version=np.int32(INDEX_VERSION), vectors=self.vectors, labels=self.labels,
+            class_names=np.array(self.class_names), mean=self.mean, std=self.std, k=np.int32(self.k),
+        )
+
+    def __len__(self):
+        return len(self.vectors)
+
+    def _neighbours(self, queries, self_offset=None):
+        """
+        (distances, indices) of the k nearest references, shape (N, k).
+        `self_offset`: queries are references self_offset.. and must not
+        match themselves (leave-one-out).
+        """
+        # ||q - r||² = ||q||² - 2 q·r + ||r||², one matrix product for the batch
+        d2 = queries @ self.vectors.T
+        d2 *= -2
+        d2 += self._sq_norms
+        d2 += np.einsum("ij,ij->i", queries, queries)[:, None]
+        np.maximum(d2, 0, out=d2)
+        k = min(self.k, len(self.vectors))
+        if self_offset is not None:
+            rows = np.arange(len(queries))
+            d2[rows, rows + self_offset] = np.inf
+            k = min(k, len(self.vectors) - 1)
+
+        idx = np.argpartition(d2, k - 1, axis=1)[:, :k]
+        return np.sqrt(np.take_along_axis(d2, idx, axis=1)), idx
+
+    def _vote(self, distances, idx):
+        weights = 1.0 / (distances + 1e-3)
+        probs = np.zeros((len(idx), len(self.class_names)), np.float32)
+        rows = np.repeat(np.arange(len(idx)), idx.shape[1])
+        np.add.at(probs, (rows, self.labels[idx].ravel()), weights.ravel())
+        probs /= probs.sum(axis=1, keepdims=True)
+        return probs
+
+    def predict(self, descriptors):
+        """(N, classes) distance-weighted k-NN class probabilities."""
+        queries = (np.asarray(descriptors, np.float32) - self.mean) / self.std
+        return self._vote(*self._neighbours(queries))
+
+    def leave_one_out_accuracy(self, chunk=512):
+        """Accuracy of classifying every reference by its neighbours."""
+        if len(self.vectors) < 2:
+            return 0.0
+        correct = 0
+        for start in range(0, len(self.vectors), chunk):
+            queries = self.vectors[start:start + chunk]
+            predicted = self._vote(*self._neighbours(queries, self_offset=start)).argmax(axis=1)
+            correct += int((predicted == self.labels[start:start + chunk]).sum())
+        return correct / len(self.vectors)
+
+
+class FeatureBackend:
+    """disease_classifier backend: descriptors + FeatureIndex k-NN."""
+
+    name = "features"
+
+    def __init__(self, path):
+        self.path = path
+        self.index = FeatureIndex.load(path)
+        self.class_names = self.index.class_names
+
+    def predict(self, batch):
+        return self.index.predict(describe_batch(batch))
+
+
+def _load_features(config):
+    path = os.path.join(config["model_dir"], FEATURE_CONFIG["index"])
+    return FeatureBackend(path) if os.path.exists(path) else None
+
+
+# Last in "auto": a neural model wins whenever one is installed
+register_backend("features", _load_features)
+
+
+# =====================================================
+# INDEX BUILDING
+# =====================================================
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def _class_key(name):
+    return re.sub(r"[^a-z0-9]", "", name.lower())
+
+
+def match_class_folders(dataset_dir, class_names=CLASS_NAMES):
+    """{class index: folder path} for dataset sub-folders named after a class."""
+    keys = {_class_key(name): i for i, name in enumerate(class_names)}
+    matched = {}
+    for entry in sorted(os.listdir(dataset_dir)):
+        path = os.path.join(dataset_dir, entry)
+        if not os.path.isdir(path):
+            continue
+        label = keys.get(_class_key(entry))
+        if label is None:
+            logger.warning(f"⚠️  Skipping folder '{entry}': not one of class_names")
+            continue
+        matched[label] = path
+    return matched
+
+
+def _reference_crop(path, segment):
+    """Training photo → leaf crop with a black background, like /predict's crops."""
+    image = cv2.imread(path, cv2.IMREAD_REDUCED_COLOR_2)
+    if image is None:
+        return None
+    if segment:
+        from segment2 import fast_grabcut_segmentation, resize_for_speed
+
+        image, _ = resize_for_speed(image, max_size=256)
+        image, _ = fast_grabcut_segmentation(image, iterations=2)
+    return image
+
+
+def build_index(dataset_dir, per_class=None, segment=True, k=None, seed=0):
+    """Describe up to `per_class` photos per class folder and return a FeatureIndex."""
+    per_class = per_class or FEATURE_CONFIG["per_class"]
+    size = CLASSIFIER_CONFIG["input_size"]
+    rng = np.random.default_rng(seed)
+
+    descriptors, labels = [], []
+    for label, folder in match_class_folders(dataset_dir).items():
+        files = sorted(f for f in os.listdir(folder) if os.path.splitext(f)[1].lower() in IMAGE_EXTENSIONS)
+        if len(files) > per_class:
+            files = list(rng.choice(files, per_class, replace=False))
+
+        t0 = time.time()
+        crops = [c for c in (_reference_crop(os.path.join(folder, f), segment) for f in files) if c is not None]
+        for start in range(0, len(crops), 64):
+            descriptors.append(describe_batch(preprocess_batch(crops[start:start + 64], size)))
+        labels += [label] * len(crops)
+        logger.info(f"   {CLASS_NAMES[label]}: {len(crops)} references ({time.time() - t0:.1f}s)")
+
+    if not labels:
+        raise ValueError(f"No labelled images found under {dataset_dir}")
+    return FeatureIndex.build(np.concatenate(descriptors), labels, CLASS_NAMES, k or FEATURE_CONFIG["k"])
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="AgriPal feature-based disease classifier")
+    sub = parser.add_subparsers(dest="command", required=True)
+    b = sub.add_parser("build", help="Build the reference index from class folders")
+    b.add_argument("dataset_dir")
+    b.add_argument("--out", default=os.path.join(CLASSIFIER_CONFIG["model_dir"], FEATURE_CONFIG["index"]))
+    b.add_argument("--per-class", type=int, default=FEATURE_CONFIG["per_class"])
+    b.add_argument("-k", type=int, default=FEATURE_CONFIG["k"])
+    b.add_argument("--no-segment", action="store_true",
+                   help="Photos are already background-free (skip GrabCut)")
+    args = parser.parse_args()
+
+    t0 = time.time()
+    index = build_index(args.dataset_dir, args.per_class, segment=not args.no_segment, k=args.k)
+    index.save(args.out)
+    logger.info(f"✅ {len(index)} references, {index.vectors.shape[1]} dims → {args.out} "
+                f"({os.path.getsize(args.out) / 1e6:.2f} MB, {time.time() - t0:.1f}s)")
+    logger.info(f"📊 Leave-one-out accuracy: {index.leave_one_out_accuracy() * 100:.1f}%")
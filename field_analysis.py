@@ -0,0 +1,473 @@
+"""
+AgriPal - Tiled field analysis
+Leaf severity for drone / field-scale mosaics (100+ MP) without loading
+the whole image: the mosaic is read tile by tile (row-wise reads from
+.npy or uncompressed TIFF), each tile is segmented and scored at full detail in a
+bounded worker pool, and the results are stitched into a field-level
+severity grid.
+
+Peak memory is ~ max_workers × tile footprint, independent of the
+mosaic size, so it fits the 512 MB instance. JPEG, PNG and compressed
+TIFF can't be read a window at a time; they are decoded whole only up to
+TILE_CONFIG["max_decode_megapixels"] and refused above that (convert
+them with --convert first).
+"""
+
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+import numpy as np
+from PIL import TiffImagePlugin
+
+from memory_budget import image_dimensions
+from segment2 import AnalysisWorkspace, _severity_level
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# TILING SETTINGS
+# =====================================================
+TILE_CONFIG = {
+    # Core tile edge in source pixels (results are reported per core tile)
+    "tile_size": 1024,
+
+    # Extra context read around each tile so morphology near the edges is
+    # correct; overlap pixels are never counted twice
+    "overlap": 64,
+
+    # Downscale factor applied to each tile before analysis (1.0 = full detail)
+    "analysis_scale": 1.0,
+
+    # Tiles analysed concurrently (bounds peak memory)
+    "max_workers": 2,
+
+    # Tiles with less vegetation than this fraction get no severity
+    "min_vegetation_fraction": 0.02,
+
+    # Largest mosaic in a format without window reads (JPEG, PNG,
+    # compressed TIFF) that may be decoded whole: ~3 bytes per pixel
+    "max_decode_megapixels": 24,
+}
+
+# Same HSV ranges as segment2 (green fallback + disease mask)
+VEGETATION_HSV = ((25, 30, 30), (95, 255, 255))
+DISEASE_HSV = ((0, 40, 20), (25, 255, 255))
+
+
+# =====================================================
+# TILE SOURCES
+# =====================================================
+class TileSource:
+    """
+    Random-access reader over an in-memory HxW[xC] uint8 array.
+    `rgb` marks channel order that must be swapped to BGR.
+    """
+
+    def __init__(self, pixels, rgb=False, mode="memory", path=None):
+        self.pixels = pixels
+        self.rgb = rgb
+        self.mode = mode
+        self.path = path
+        self.height, self.width = pixels.shape[:2]
+        self.channels = pixels.shape[2] if pixels.ndim == 3 else 1
+
+    def _window(self, x, y, w, h):
+        return self.pixels[y:y + h, x:x + w]
+
+    def read(self, x, y, w, h):
+        """Copy of the (x, y, w, h) window as a contiguous BGR array."""
+        window = self._window(x, y, w, h)
+        if window.ndim == 2:
+            return cv2.cvtColor(np.ascontiguousarray(window), cv2.COLOR_GRAY2BGR)
+        window = np.ascontiguousarray(window[:, :, :3])
+        if self.rgb:
+            cv2.cvtColor(window, cv2.COLOR_RGB2BGR, dst=window)
+        return window
+
+
+class StripFileSource(TileSource):
+    """
+    Reader over raw interleaved pixels stored row-major in a file at
+    `offset`. A tile is assembled from one short read per image row, so
+    only the tile's own bytes are ever resident (unlike a memory map,
+    whose touched pages count against the process until reclaimed).
+    """
+
+    def __init__(self, path, offset, height, width, channels, rgb=False):
+        self.path = path
+        self.offset = offset
+        self.height, self.width, self.channels = height, width, channels
+        self.rgb = rgb
+        self.mode = "strips"
+        self._lock = threading.Lock()
+        self._file = open(path, "rb")
+
+    def _window(self, x, y, w, h):
+        c = self.channels
+        row_stride = self.width * c
+        window = np.empty((h, w, c) if c > 1 else (h, w), np.uint8)
+        flat = window.reshape(h, w * c)
+        with self._lock:
+            for i in range(h):
+                self._file.seek(self.offset + (y + i) * row_stride + x * c)
+                self._file.readinto(memoryview(flat[i]))
+        return window
+
+    def close(self):
+        self._file.close()
+
+
+def _open_npy(path):
+    header = np.load(path, mmap_mode="r")
+    if header.dtype != np.uint8 or header.ndim not in (2, 3) or not header.flags.c_contiguous:
+        raise ValueError(f"❌ Expected a C-ordered HxW[xC] uint8 array in {path}, got {header.dtype} {header.shape}")
+    h, w = header.shape[:2]
+    c = header.shape[2] if header.ndim == 3 else 1
+    offset = header.offset
+    del header
+    # Arrays saved from OpenCV are BGR; that is the convention here too
+    return StripFileSource(path, offset, h, w, c, rgb=False)
+
+
+def _open_uncompressed_tiff(path):
+    """
+    Row-wise reader over a baseline uncompressed, chunky, 8-bit TIFF whose
+    strips are stored contiguously. Returns None for any other layout.
+
+    The TIFF plugin is used directly (not Image.open) so only the header
+    is parsed and the decompression-bomb guard doesn't reject mosaics.
+    """
+    with open(path, "rb") as f:
+        try:
+            tif = TiffImagePlugin.TiffImageFile(f)
+        except Exception:
+            return None
+
+        tags = tif.tag_v2
+        width, height = tif.size
+        samples = int(tags.get(277, 1))
+        bits = tags.get(258, (8,))
+        bits = bits if isinstance(bits, tuple) else (bits,)
+        offsets = tags.get(273)
+        counts = tags.get(279)
+
+        if (tags.get(259, 1) != 1                     # compression: none
+                or tags.get(284, 1) != 1              # planar: chunky
+                or 322 in tags                        # tiled layout
+                or any(b != 8 for b in bits)
+                or samples not in (1, 3, 4)
+                or tif.mode not in ("L", "RGB", "RGBA")
+                or not offsets or not counts):
+            return None
+
+        offsets = tuple(offsets) if isinstance(offsets, tuple) else (offsets,)
+        counts = tuple(counts) if isinstance(counts, tuple) else (counts,)
+        for off, count, next_off in zip(offsets, counts, offsets[1:]):
+            if off + count != next_off:
+                return None
+
+    return StripFileSource(path, offsets[0], height, width, samples, rgb=True)
+
+
+def open_tile_source(source, max_decode_megapixels=None):
+    """
+    TileSource for a mosaic path or an in-memory BGR array.
+
+    .npy and uncompressed TIFF are read row-wise per tile. Anything else (JPEG,
+    PNG, compressed TIFF) has to be decoded whole, so it is only accepted
+    up to `max_decode_megapixels` (default TILE_CONFIG); larger mosaics
+    raise ValueError — convert them first with
+    `python field_analysis.py --convert in.jpg out.npy`.
+    """
+    if max_decode_megapixels is None:
+        max_decode_megapixels = TILE_CONFIG["max_decode_megapixels"]
+    if isinstance(source, np.ndarray):
+        return TileSource(source, rgb=False, mode="memory")
+
+    ext = os.path.splitext(source)[1].lower()
+    if ext == ".npy":
+        return _open_npy(source)
+
+    if ext in (".tif", ".tiff"):
+        tile_source = _open_uncompressed_tiff(source)
+        if tile_source is not None:
+            return tile_source
+
+    # Header only; None also for mosaics past PIL's decompression-bomb limit
+    size = image_dimensions(source)
+    megapixels = size[0] * size[1] / 1e6 if size else None
+    if megapixels is None or megapixels > max_decode_megapixels:
+        found = f"{size[0]}x{size[1]}, {megapixels:.0f} MP" if size else "size unknown"
+        raise ValueError(
+            f"❌ {os.path.basename(source)} ({found}) can't be read tile-wise and is over the "
+            f"{max_decode_megapixels} MP full-decode limit. Convert it first: "
+            f"python field_analysis.py --convert {os.path.basename(source)} mosaic.npy "
+            "(or save it as uncompressed TIFF)"
+        )
+
+    logger.info(f"📸 {os.path.basename(source)} can't be read tile-wise; decoding whole ({megapixels:.1f} MP)")
+    image = cv2.imread(source, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"❌ Cannot read image: {source}")
+    return TileSource(image, rgb=False, mode="decoded", path=source)
+
+
+def convert_to_npy(src, dst):
+    """One-off conversion of a mosaic to a tile-readable .npy (BGR)."""
+    image = cv2.imread(src, cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"❌ Cannot read image: {src}")
+    np.save(dst, image)
+    return dst
+
+
+# =====================================================
+# PER-TILE ANALYSIS
+# =====================================================
+def iter_tiles(width, height, tile_size):
+    """(row, col, x, y, w, h) for every core tile, row-major."""
+    for row, y in enumerate(range(0, height, tile_size)):
+        for col, x in enumerate(range(0, width, tile_size)):
+            yield row, col, x, y, min(tile_size, width - x), min(tile_size, height - y)
+
+
+def vegetation_mask(tile_bgr, hsv=None):
+    """
+    Plant mask for a tile: HSV green range, closed, with enclosed holes
+    filled so lesions inside a leaf count as leaf. GrabCut is not used
+    because a tile has no "object in the middle" to initialise it with.
+    """
+    hsv = cv2.cvtColor(tile_bgr, cv2.COLOR_BGR2HSV) if hsv is None else hsv
+    mask = cv2.inRange(hsv, *VEGETATION_HSV)
+
+    # Open first: field backgrounds (soil, stubble) are speckled with
+    # greenish pixels that a close would otherwise merge into "leaf"
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel, iterations=1)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
+
+    contours, hierarchy = cv2.findContours(mask, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    if hierarchy is not None:
+        holes = [c for c, h in zip(contours, hierarchy[0]) if h[3] >= 0]
+        cv2.drawContours(mask, holes, -1, 255, cv2.FILLED)
+    return mask
+
+
+def analyze_tile(tile_source, tile, config):
+    """Vegetation / diseased pixel counts for one core tile."""
+    row, col, x, y, w, h = tile
+    overlap = config["overlap"]
+
+    # Read core + context, analyse, then count only the core
+    x0, y0 = max(0, x - overlap), max(0, y - overlap)
+    x1 = min(tile_source.width, x + w + overlap)
+    y1 = min(tile_source.height, y + h + overlap)
+    padded = tile_source.read(x0, y0, x1 - x0, y1 - y0)
+
+    scale = config["analysis_scale"]
+    if scale != 1.0:
+        padded = cv2.resize(padded, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    hsv = cv2.cvtColor(padded, cv2.COLOR_BGR2HSV)
+    veg = vegetation_mask(padded, hsv)
+    diseased = cv2.bitwise_and(cv2.inRange(hsv, *DISEASE_HSV), veg)
+
+    cx0, cy0 = int((x - x0) * scale), int((y - y0) * scale)
+    cx1, cy1 = cx0 + int(round(w * scale)), cy0 + int(round(h * scale))
+    veg_px = cv2.countNonZero(veg[cy0:cy1, cx0:cx1])
+    diseased_px = cv2.countNonZero(diseased[cy0:cy1, cx0:cx1])
+    core_px = max(1, (cx1 - cx0) * (cy1 - cy0))
+
+    # Counts are reported in source pixels regardless of analysis_scale
+    to_source = 1.0 / (scale * scale)
+    coverage = veg_px / core_px
+    if coverage >= config["min_vegetation_fraction"] and veg_px:
+        severity = round(diseased_px / veg_px * 100, 2)
+        level = _severity_level(severity)
+    else:
+        severity, level = None, None
+
+    return {
+        "row": row,
+        "col": col,
+        "bbox": (x, y, w, h),
+        "vegetation_pixels": int(veg_px * to_source),
+        "diseased_pixels": int(diseased_px * to_source),
+        "vegetation_coverage": round(coverage * 100, 2),
+        "severity_percent": severity,
+        "severity_level": level,
+    }
+
+
+def _run_tiles(tile_source, tiles, config):
+    """
+    Analyse tiles with at most `max_workers` tiles in flight at a time,
+    so pending work never holds more than that many tile buffers.
+    """
+    results = []
+    max_workers = config["max_workers"]
+    tiles = iter(tiles)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for tile in tiles:
+            pending.add(executor.submit(analyze_tile, tile_source, tile, config))
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                results.extend(f.result() for f in done)
+        results.extend(f.result() for f in pending)
+
+    results.sort(key=lambda r: (r["row"], r["col"]))
+    return results
+
+
+# =====================================================
+# STITCHING
+# =====================================================
+def build_severity_grid(tile_results, rows, cols):
+    """rows × cols float32 grid of tile severities (NaN = no vegetation)."""
+    grid = np.full((rows, cols), np.nan, np.float32)
+    for r in tile_results:
+        if r["severity_percent"] is not None:
+            grid[r["row"], r["col"]] = r["severity_percent"]
+    return grid
+
+
+def render_severity_grid(grid, cell_px=24):
+    """Colour-coded grid image (green → red), grey where there is no vegetation."""
+    rows, cols = grid.shape
+    scaled = np.clip(np.nan_to_num(grid, nan=0.0) * (255 / 50.0), 0, 255).astype(np.uint8)
+    colored = cv2.applyColorMap(255 - scaled, cv2.COLORMAP_RAINBOW)
+    colored[np.isnan(grid)] = (128, 128, 128)
+    return cv2.resize(colored, (cols * cell_px, rows * cell_px), interpolation=cv2.INTER_NEAREST)
+
+
+# =====================================================
+# MAIN TILED PIPELINE
+# =====================================================
+def analyze_field(source, workspace=None, config=None):
+    """
+    🛰️ Tiled severity analysis for a field mosaic.
+
+    `source` is a mosaic path (.npy / uncompressed TIFF are read tile-wise;
+    other formats are decoded whole up to max_decode_megapixels, refused
+    above it) or a BGR array. Returns a dict with
+    per-tile results, the severity grid (list of lists, None = no
+    vegetation) and the vegetation-weighted field severity.
+    """
+    config = dict(TILE_CONFIG, **(config or {}))
+    start_time = time.time()
+
+    logger.info("=" * 80)
+    logger.info("🛰️  TILED FIELD ANALYSIS")
+    logger.info("=" * 80)
+
+    tile_source = open_tile_source(source, config["max_decode_megapixels"])
+    width, height = tile_source.width, tile_source.height
+    tile_size = config["tile_size"]
+    rows = -(-height // tile_size)
+    cols = -(-width // tile_size)
+
+    logger.info(f"📸 Mosaic: {width}x{height} ({width * height / 1e6:.1f} MP, {tile_source.mode})")
+    logger.info(f"🧩 Tiles : {rows}x{cols} of {tile_size}px (+{config['overlap']}px context), "
+                f"{config['max_workers']} workers")
+
+    try:
+        tile_results = _run_tiles(tile_source, iter_tiles(width, height, tile_size), config)
+    finally:
+        if isinstance(tile_source, StripFileSource):
+            tile_source.close()
+
+    veg_total = sum(r["vegetation_pixels"] for r in tile_results)
+    diseased_total = sum(r["diseased_pixels"] for r in tile_results)
+    field_severity = round(diseased_total / veg_total * 100, 2) if veg_total else 0.0
+    field_level = _severity_level(field_severity)
+
+    grid = build_severity_grid(tile_results, rows, cols)
+    elapsed = time.time() - start_time
+
+    if workspace is not None:
+        workspace.save_image(workspace.segmented_dir, "severity_grid.png", render_severity_grid(grid))
+        lines = [
+            "=" * 80,
+            "FIELD SEVERITY ANALYSIS (TILED)",
+            "=" * 80,
+            "",
+            f"Job ID           : {workspace.job_id}",
+            f"Mosaic           : {tile_source.path or '<in-memory>'}",
+            f"Size             : {width}x{height}",
+            f"Tiles            : {rows}x{cols} @ {tile_size}px",
+            f"Total Time       : {elapsed:.2f}s",
+            "",
+            "SEVERITY GRID (%):",
+            "-" * 80,
+        ]
+        for row in grid:
+            lines.append(" ".join("   --" if np.isnan(v) else f"{v:5.1f}" for v in row))
+        lines += [
+            "",
+            "=" * 80,
+            f"FIELD SEVERITY   : {field_severity}% ({field_level})",
+            "=" * 80,
+        ]
+        workspace.save_text(workspace.report_dir, "field_report.txt", "\n".join(lines) + "\n")
+
+    logger.info(f"🌾 Field severity: {field_severity}% ({field_level}) | "
+                f"vegetation {veg_total / (width * height) * 100:.1f}% | {elapsed:.2f}s")
+
+    return {
+        "width": width,
+        "height": height,
+        "tile_size": tile_size,
+        "rows": rows,
+        "cols": cols,
+        "tiles": tile_results,
+        "severity_grid": [[None if np.isnan(v) else float(v) for v in row] for row in grid],
+        "field_severity": field_severity,
+        "field_severity_level": field_level,
+        "vegetation_pixels": veg_total,
+        "diseased_pixels": diseased_total,
+        "processing_time": round(elapsed, 2),
+    }
+
+
+# =====================================================
+# CLI
+# =====================================================
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Tiled leaf-severity analysis for field mosaics")
+    parser.add_argument("mosaic", help="Mosaic path (.npy / uncompressed .tif are read tile-wise)")
+    parser.add_argument("--tile-size", type=int, default=TILE_CONFIG["tile_size"])
+    parser.add_argument("--overlap", type=int, default=TILE_CONFIG["overlap"])
+    parser.add_argument("--scale", type=float, default=TILE_CONFIG["analysis_scale"])
+    parser.add_argument("--workers", type=int, default=TILE_CONFIG["max_workers"])
+    parser.add_argument("--max-decode-mp", type=float, default=TILE_CONFIG["max_decode_megapixels"],
+                        help="Largest JPEG / PNG / compressed TIFF mosaic decoded whole (MP)")
+    parser.add_argument("--convert", metavar="OUT_NPY",
+                        help="Only convert the mosaic to a tile-readable .npy and exit")
+    args = parser.parse_args()
+
+    if args.convert:
+        print(f"💾 Wrote {convert_to_npy(args.mosaic, args.convert)}")
+        sys.exit(0)
+
+    workspace = AnalysisWorkspace()
+    result = analyze_field(args.mosaic, workspace=workspace, config={
+        "tile_size": args.tile_size,
+        "overlap": args.overlap,
+        "analysis_scale": args.scale,
+        "max_workers": args.workers,
+        "max_decode_megapixels": args.max_decode_mp,
+    })
+    print(f"\n🌾 Field severity : {result['field_severity']}% ({result['field_severity_level']})")
+    print(f"🧩 Grid           : {result['rows']}x{result['cols']} tiles")
+    print(f"📄 Report         : {workspace.report_dir}")
@@ -0,0 +1,167 @@
+"""
+AgriPal - Image derivatives
+Resized WebP / JPEG variants of uploads, leaf crops and heatmaps, so
+result pages don't ship multi-megabyte originals to phones on 2G / 3G.
+
+- a variant is rendered on first request (JPEGs decoded straight at
+  reduced size) and cached on disk under cache/derivatives
+- widths snap to a few fixed steps and never upscale, so arbitrary
+  ?w= values can't flood the cache
+- the cache key covers the source file's identity (path, size, mtime)
+  and the variant parameters; it doubles as a strong ETag, and since a
+  changed source gets a new key the responses can be cached for a year
+- "auto" picks WebP when the browser accepts it (responses Vary: Accept)
+
+Templates use the variant_url() helper registered by app2.
+"""
+
+import logging
+import os
+import tempfile
+import threading
+from hashlib import sha256
+
+import cv2
+
+from memory_budget import decode_image
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# DERIVATIVE SETTINGS
+# =====================================================
+DERIVATIVE_CONFIG = {
+    "cache_dir": os.environ.get("AGRIPAL_DERIVATIVE_DIR", os.path.join("cache", "derivatives")),
+    "max_cache_mb": int(os.environ.get("AGRIPAL_DERIVATIVE_CACHE_MB", 256)),
+
+    # Widths variants snap up to (longest side, px)
+    "widths": [160, 320, 640, 1280],
+    "default_width": 640,
+
+    "webp_quality": 75,
+    "jpeg_quality": 80,
+
+    # Cache-Control max-age for variants (content-keyed, so effectively immutable)
+    "max_age": 365 * 24 * 3600,
+}
+
+# Directories under ./static that variants may be made from
+ALLOWED_SOURCE_ROOTS = ("uploads/", "jobs/", "individual_leaves/", "expert_uploads/")
+
+FORMATS = {
+    "webp": ("image/webp", ".webp"),
+    "jpeg": ("image/jpeg", ".jpg"),
+}
+
+_evict_lock = threading.Lock()
+
+
+def snap_width(width):
+    """Smallest configured width >= `width` (the largest one beyond it)."""
+    widths = DERIVATIVE_CONFIG["widths"]
+    for w in widths:
+        if width <= w:
+            return w
+    return widths[-1]
+
+
+def negotiate_format(requested, accept_header):
+    """"webp" / "jpeg"; "auto" (or anything unknown) follows the Accept header."""
+    if requested in FORMATS:
+        return requested
+    return "webp" if "image/webp" in (accept_header or "") else "jpeg"
+
+
+def resolve_static_source(rel_path, static_root="static"):
+    """
+    Absolute path of a file under one of the allowed static directories,
+    or None for anything else (traversal, other folders, missing files).
+    """
+    rel_path = rel_path.replace("\\", "/").lstrip("/")
+    if not rel_path.startswith(ALLOWED_SOURCE_ROOTS):
+        return None
+    root = os.path.realpath(static_root)
+    path = os.path.realpath(os.path.join(root, rel_path))
+    if not path.startswith(root + os.sep) or not os.path.isfile(path):
+        return None
+    return path
+
+
+def _cache_key(source_path, width, fmt):
+    st = os.stat(source_path)
+    quality = DERIVATIVE_CONFIG[f"{fmt}_quality"]
+    identity = f"{source_path}|{st.st_size}|{st.st_mtime_ns}|{width}|{fmt}|{quality}"
+    return sha256(identity.encode()).hexdigest()[:32]
+
+
+def _render(source_path, width, fmt):
+    img = decode_image(source_path, max_size=width)
+    if img is None:
+        raise ValueError(f"Cannot decode {source_path}")
+    h, w = img.shape[:2]
+    if max(h, w) > width:
+        s = width / max(h, w)
+        img = cv2.resize(img, (max(1, int(w * s)), max(1, int(h * s))), interpolation=cv2.INTER_AREA)
+    if fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, DERIVATIVE_CONFIG["webp_quality"]]
+    else:
+        params = [cv2.IMWRITE_JPEG_QUALITY, DERIVATIVE_CONFIG["jpeg_quality"], cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    ok, buf = cv2.imencode(FORMATS[fmt][1], img, params)
+    if not ok:
+        raise ValueError(f"Cannot encode {source_path} as {fmt}")
+    return buf.tobytes()
+
+
+def get_derivative(source_path, width, fmt):
+    """
+    (cached file path, etag, mimetype) of the `fmt` variant of
+    `source_path` at `width` (snapped), rendering it if needed.
+    """
+    width = snap_width(width)
+    key = _cache_key(source_path, width, fmt)
+    cache_dir = DERIVATIVE_CONFIG["cache_dir"]
+    path = os.path.join(cache_dir, key[:2], key + FORMATS[fmt][1])
+
+    if os.path.exists(path):
+        os.utime(path)
+    else:
+        data = _render(source_path, width, fmt)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        logger.info(f"🖼️  Derivative {os.path.basename(source_path)} @ {width}px {fmt}: {len(data) / 1024:.0f} KB")
+        evict_derivatives()
+
+    return path, key, FORMATS[fmt][0]
+
+
+def evict_derivatives():
+    """Remove least-recently-used variants until under the size budget."""
+    cache_dir = DERIVATIVE_CONFIG["cache_dir"]
+    budget = DERIVATIVE_CONFIG["max_cache_mb"] * 1024 * 1024
+    with _evict_lock:
+        entries = []
+        total = 0
+        for dirpath, _, filenames in os.walk(cache_dir):
+            for name in filenames:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+                total += st.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= budget:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
@@ -0,0 +1,228 @@
+"""
+AgriPal - Image quality gate
+Rejects photos the OpenCV pipelines cannot analyse meaningfully (too
+small, badly under- / over-exposed, almost no leaf in frame, blurred)
+before a GrabCut + watershed run is spent on them.
+
+All checks run on a ~512 px thumbnail (JPEGs are decoded straight at
+reduced size): the checks themselves take ~2 ms, the rest is the
+reduced decode, against seconds for a GrabCut run. Sharpness is the
+variance of the Laplacian over the leaf pixels only, so a sharp leaf in
+front of a deliberately blurred background still passes.
+
+Rejections map to get_detailed_error_message() error types in app2.
+quality_gate_stats() reports how often the gate fired and how much
+pipeline time that saved, estimated from the measured pipeline runs.
+"""
+
+import logging
+import os
+import threading
+import time
+from collections import Counter
+
+import cv2
+import numpy as np
+
+from memory_budget import decode_image, image_dimensions
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# GATE SETTINGS
+# =====================================================
+QUALITY_CONFIG = {
+    # AGRIPAL_QUALITY_GATE=0 turns the gate off (metrics are still logged)
+    "enabled": os.environ.get("AGRIPAL_QUALITY_GATE", "1") != "0",
+
+    # Longest side the checks run at
+    "thumbnail_size": 512,
+
+    # Shortest side of the original photo
+    "min_side": 224,
+
+    # Mean brightness (0-255) and share of crushed / blown-out pixels
+    "min_brightness": 35,
+    "max_brightness": 225,
+    "max_clipped_ratio": 0.5,
+
+    # Share of the frame covered by leaf-coloured pixels
+    "min_leaf_coverage": 0.05,
+
+    # Laplacian variance over the leaf pixels on the thumbnail; a 9 px
+    # Gaussian blur takes an in-focus 1600x1200 leaf photo from ~35 to ~7
+    "min_sharpness": 15.0,
+}
+
+# Leaf-coloured pixels: yellow-brown lesions through to dark green
+LEAF_HSV_RANGE = ((10, 40, 35), (95, 255, 255))
+
+# Pixel values counted as crushed shadows / blown highlights
+CLIPPED_DARK = 10
+CLIPPED_BRIGHT = 245
+
+# Issue types, in the order they are checked (cheapest and most
+# fundamental first); each is a get_detailed_error_message() error_type
+ISSUE_TYPES = ["unreadable", "too_small", "underexposed", "overexposed", "low_leaf_coverage", "blurry"]
+
+
+# =====================================================
+# CHECKS
+# =====================================================
+def _load_thumbnail(source, thumbnail_size):
+    """(thumbnail, (width, height) of the original) or (None, size)."""
+    size = image_dimensions(source)
+    img = decode_image(source, max_size=thumbnail_size)
+    if img is None:
+        return None, size
+    h, w = img.shape[:2]
+    if max(h, w) > thumbnail_size:
+        s = thumbnail_size / max(h, w)
+        img = cv2.resize(img, (max(1, int(w * s)), max(1, int(h * s))), interpolation=cv2.INTER_AREA)
+    return img, size or (w, h)
+
+
+def assess_image_quality(source, config=None):
+    """
+    Score a photo (path or encoded bytes). Returns
+    {"ok", "issues" [{"type", "message"}], "metrics", "ms"}.
+    `ok` is False only when the gate is enabled and an issue was found.
+    """
+    config = config or QUALITY_CONFIG
+    t0 = time.perf_counter()
+    img, size = _load_thumbnail(source, config["thumbnail_size"])
+    issues = []
+    metrics = {}
+
+    def issue(kind, message):
+        issues.append({"type": kind, "message": message})
+
+    if img is None:
+        issue("unreadable", "The image could not be decoded.")
+    else:
+        metrics["width"], metrics["height"] = size
+        if min(size) < config["min_side"]:
+            issue("too_small", f"Photo is {size[0]}x{size[1]}; at least {config['min_side']} px per side is needed.")
+
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        hist = cv2.calcHist([gray], [0], None, [256], [0, 256]).ravel() / gray.size
+        brightness = float(np.dot(hist, np.arange(256)))
+        dark = float(hist[:CLIPPED_DARK + 1].sum())
+        bright = float(hist[CLIPPED_BRIGHT:].sum())
+        metrics.update(brightness=round(brightness, 1), dark_ratio=round(dark, 3), bright_ratio=round(bright, 3))
+        if brightness < config["min_brightness"] or dark > config["max_clipped_ratio"]:
+            issue("underexposed", f"Photo is too dark (mean brightness {brightness:.0f}/255).")
+        elif brightness > config["max_brightness"] or bright > config["max_clipped_ratio"]:
+            issue("overexposed", f"Photo is washed out (mean brightness {brightness:.0f}/255).")
+
+        hsv = cv2.cvtColor(img, cv2.COLOR_BGR2HSV)
+        leaf_mask = cv2.inRange(hsv, LEAF_HSV_RANGE[0], LEAF_HSV_RANGE[1])
+        coverage = cv2.countNonZero(leaf_mask) / leaf_mask.size
+        metrics["leaf_coverage"] = round(coverage, 3)
+        if coverage < config["min_leaf_coverage"]:
+            issue("low_leaf_coverage", f"Leaves cover only {coverage * 100:.1f}% of the photo.")
+        else:
+            # Only judged where there is leaf to judge
+            laplacian = cv2.Laplacian(gray, cv2.CV_32F)
+            _, std = cv2.meanStdDev(laplacian, mask=leaf_mask)
+            sharpness = float(std[0, 0] ** 2)
+            metrics["sharpness"] = round(sharpness, 1)
+            if sharpness < config["min_sharpness"]:
+                issue("blurry", f"Photo is out of focus (sharpness {sharpness:.0f}, minimum {config['min_sharpness']:.0f}).")
+
+    ms = (time.perf_counter() - t0) * 1000
+    return {
+        "ok": not (issues and config["enabled"]),
+        "issues": issues,
+        "metrics": metrics,
+        "ms": round(ms, 2),
+    }
+
+
+# =====================================================
+# SAVED-COMPUTE ACCOUNTING
+# =====================================================
+class QualityGateStats:
+    """
+    Gate counters plus the mean duration of each pipeline when it does
+    run, so every rejection can be credited with the time it saved.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {"checked": 0, "passed": 0, "rejected": 0}
+        self._reasons = Counter()
+        self._gate_ms = 0.0
+        self._pipeline_runs = Counter()
+        self._pipeline_seconds = Counter()
+        self._skipped = Counter()
+        self._saved_seconds = 0.0
+
+    def _mean_seconds(self, pipeline):
+        runs = self._pipeline_runs[pipeline]
+        return self._pipeline_seconds[pipeline] / runs if runs else None
+
+    def record_check(self, pipeline, result):
+        with self._lock:
+            self._counters["checked"] += 1
+            self._gate_ms += result["ms"]
+            if result["ok"]:
+                self._counters["passed"] += 1
+                return
+            self._counters["rejected"] += 1
+            self._reasons[result["issues"][0]["type"]] += 1
+            self._skipped[pipeline] += 1
+            self._saved_seconds += self._mean_seconds(pipeline) or 0.0
+
+    def record_pipeline(self, pipeline, seconds):
+        with self._lock:
+            self._pipeline_runs[pipeline] += 1
+            self._pipeline_seconds[pipeline] += seconds
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            counters.update({
+                "enabled": QUALITY_CONFIG["enabled"],
+                "rejected_by_reason": dict(self._reasons),
+                "gate_ms_total": round(self._gate_ms, 1),
+                "gate_ms_mean": round(self._gate_ms / counters["checked"], 2) if counters["checked"] else 0.0,
+                "pipelines": {
+                    name: {
+                        "runs": self._pipeline_runs[name],
+                        "mean_seconds": round(self._mean_seconds(name) or 0.0, 3),
+                        "skipped": self._skipped[name],
+                    }
+                    for name in set(self._pipeline_runs) | set(self._skipped)
+                },
+                "saved_seconds_estimate": round(self._saved_seconds, 2),
+            })
+        counters["net_saved_seconds_estimate"] = round(
+            counters["saved_seconds_estimate"] - counters["gate_ms_total"] / 1000, 2
+        )
+        return counters
+
+
+gate_stats = QualityGateStats()
+
+
+def quality_gate(source, pipeline):
+    """assess_image_quality() + accounting against `pipeline` ("disease", "nutrition", ...)."""
+    result = assess_image_quality(source)
+    gate_stats.record_check(pipeline, result)
+    if result["issues"]:
+        kinds = ", ".join(i["type"] for i in result["issues"])
+        action = "rejected" if not result["ok"] else "passed (gate disabled)"
+        logger.info(f"🔍 Quality gate {action} for {pipeline}: {kinds} | {result['metrics']} | {result['ms']:.1f}ms")
+    else:
+        logger.info(f"🔍 Quality gate passed for {pipeline} in {result['ms']:.1f}ms | {result['metrics']}")
+    return result
+
+
+def record_pipeline_time(pipeline, seconds):
+    """Feed the measured duration of a pipeline run into the savings estimate."""
+    gate_stats.record_pipeline(pipeline, seconds)
+
+
+def quality_gate_stats():
+    return gate_stats.stats()
@@ -0,0 +1,435 @@
+"""
+AgriPal - Analysis job queue
+Image analysis runs off the request thread: submit() stores a job in a
+local SQLite broker table and returns its id at once, a pool of worker
+threads claims jobs atomically and runs them, and clients poll (or
+long-poll) for the result. Works without Redis; any process pointing at
+the same database file can submit or work jobs.
+
+Run extra workers outside the web process with:
+    python job_queue.py --workers 2
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# QUEUE SETTINGS
+# =====================================================
+JOB_QUEUE_CONFIG = {
+    # SQLite broker file (shared by every process using the queue)
+    "db_path": os.environ.get("AGRIPAL_QUEUE_DB", "job_queue.db"),
+
+    # Worker threads started inside the web process
+    "workers": int(os.environ.get("AGRIPAL_JOB_WORKERS", 2)),
+
+    # Seconds an idle worker sleeps before re-checking (cross-process submits)
+    "poll_interval": 1.0,
+
+    # A running job older than this is assumed lost (worker crashed) and re-queued
+    "job_timeout": 600,
+    "max_attempts": 2,
+
+    # Finished jobs are deleted after this many seconds
+    "retention": 24 * 3600,
+}
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id          TEXT PRIMARY KEY,
+    kind        TEXT NOT NULL,
+    payload     TEXT NOT NULL,
+    status      TEXT NOT NULL,
+    result      TEXT,
+    error       TEXT,
+    user_id     INTEGER,
+    attempts    INTEGER NOT NULL DEFAULT 0,
+    worker      TEXT,
+    created_at  REAL NOT NULL,
+    started_at  REAL,
+    finished_at REAL
+);
+CREATE INDEX IF NOT EXISTS idx_analysis_jobs_status ON analysis_jobs (status, created_at);
+"""
+
+_handlers = {}
+_schema_lock = threading.Lock()
+_schema_ready = set()
+_workers_lock = threading.Lock()
+_workers_started = False
+_work_available = threading.Event()
+_job_finished = threading.Condition()
+
+
+# =====================================================
+# BROKER (SQLITE)
+# =====================================================
+def _connect():
+    """Open the broker; the schema is created on first use in each process."""
+    db_path = JOB_QUEUE_CONFIG["db_path"]
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    if db_path not in _schema_ready:
+        with _schema_lock:
+            if db_path not in _schema_ready:
+                conn.executescript(_SCHEMA)
+                _schema_ready.add(db_path)
+    return conn
+
+
+def init_queue():
+    _connect().close()
+
+
+def _row_to_job(row):
+    if row is None:
+        return None
+    job = dict(row)
+    job["payload"] = json.loads(job["payload"])
+    job["result"] = json.loads(job["result"]) if job["result"] else None
+    return job
+
+
+def submit(kind, payload, user_id=None):
+    """Queue a job and return its id immediately."""
+    if kind not in _handlers:
+        raise ValueError(f"Unknown job kind: {kind}")
+
+    job_id = uuid.uuid4().hex
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO analysis_jobs (id, kind, payload, status, user_id, created_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(payload), STATUS_QUEUED, user_id, time.time())
+        )
+    finally:
+        conn.close()
+
+    _work_available.set()
+    logger.info(f"📥 Job queued: {job_id} ({kind})")
+    return job_id
+
+
+def claim_next(worker_name):
+    """
+    Atomically move the oldest queued job to running and return it.
+    BEGIN IMMEDIATE takes SQLite's write lock up front, so two workers
+    (threads or processes) can never claim the same row.
+    """
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            "SELECT * FROM analysis_jobs WHERE status = ? ORDER BY created_at LIMIT 1",
+            (STATUS_QUEUED,)
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+
+        started = time.time()
+        conn.execute(
+            "UPDATE analysis_jobs SET status = ?, started_at = ?, worker = ?, attempts = attempts + 1 "
+            "WHERE id = ?",
+            (STATUS_RUNNING, started, worker_name, row["id"])
+        )
+        conn.execute("COMMIT")
+        job = _row_to_job(row)
+        job.update(status=STATUS_RUNNING, started_at=started, worker=worker_name)
+        return job
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def _json_default(value):
+    """numpy scalars / arrays in analysis results → plain JSON types."""
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def _finish(job_id, status, result=None, error=None):
+    encoded = json.dumps(result, default=_json_default) if result is not None else None
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE analysis_jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+            (status, encoded, error, time.time(), job_id)
+        )
+    finally:
+        conn.close()
+
+    with _job_finished:
+        _job_finished.notify_all()
+
+
+def get_job(job_id):
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM analysis_jobs WHERE id = ?", (job_id,)).fetchone()
+        job = _row_to_job(row)
+        if job and job["status"] == STATUS_QUEUED:
+            job["queue_position"] = conn.execute(
+                "SELECT COUNT(*) FROM analysis_jobs WHERE status = ? AND created_at <= ?",
+                (STATUS_QUEUED, job["created_at"])
+            ).fetchone()[0]
+        return job
+    finally:
+        conn.close()
+
+
+def wait_for_job(job_id, timeout=25.0):
+    """
+    Long-poll: return the job once it is done/failed or `timeout` expires.
+    Same-process completions wake the waiter immediately; jobs finished by
+    another process are picked up by the periodic re-check.
+    """
+    deadline = time.time() + timeout
+    while True:
+        job = get_job(job_id)
+        if job is None or job["status"] in (STATUS_DONE, STATUS_FAILED):
+            return job
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            return job
+        with _job_finished:
+            _job_finished.wait(min(remaining, JOB_QUEUE_CONFIG["poll_interval"]))
+
+
+def requeue_stale_jobs():
+    """Re-queue (or fail) running jobs whose worker has gone away."""
+    cutoff = time.time() - JOB_QUEUE_CONFIG["job_timeout"]
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE analysis_jobs SET status = ?, error = 'Timed out', finished_at = ? "
+            "WHERE status = ? AND started_at < ? AND attempts >= ?",
+            (STATUS_FAILED, time.time(), STATUS_RUNNING, cutoff, JOB_QUEUE_CONFIG["max_attempts"])
+        )
+        requeued = conn.execute(
+            "UPDATE analysis_jobs SET status = ?, worker = NULL WHERE status = ? AND started_at < ?",
+            (STATUS_QUEUED, STATUS_RUNNING, cutoff)
+        ).rowcount
+        conn.execute(
+            "DELETE FROM analysis_jobs WHERE finished_at < ?",
+            (time.time() - JOB_QUEUE_CONFIG["retention"],)
+        )
+    finally:
+        conn.close()
+
+    if requeued:
+        logger.warning(f"⚠️  Re-queued {requeued} stale job(s)")
+        _work_available.set()
+    return requeued
+
+
+def job_image_references():
+    """Upload-store names of every job still in the broker (kept until retention purges the job)."""
+    conn = _connect()
+    try:
+        payloads = [row[0] for row in conn.execute("SELECT payload FROM analysis_jobs")]
+    finally:
+        conn.close()
+    names = (json.loads(payload).get("image_filename") for payload in payloads)
+    return [name for name in names if name]
+
+
+# =====================================================
+# METRICS
+# =====================================================
+def queue_metrics(window=3600):
+    """Queue depth, running jobs and wait/run times over the last `window` seconds."""
+    now = time.time()
+    conn = _connect()
+    try:
+        counts = dict(conn.execute(
+            "SELECT status, COUNT(*) FROM analysis_jobs GROUP BY status"
+        ).fetchall())
+        oldest = conn.execute(
+            "SELECT MIN(created_at) FROM analysis_jobs WHERE status = ?", (STATUS_QUEUED,)
+        ).fetchone()[0]
+        timings = conn.execute(
+            "SELECT started_at - created_at, finished_at - started_at FROM analysis_jobs "
+            "WHERE started_at IS NOT NULL AND finished_at IS NOT NULL AND finished_at >= ?",
+            (now - window,)
+        ).fetchall()
+    finally:
+        conn.close()
+
+    waits = sorted(t[0] for t in timings)
+    runs = sorted(t[1] for t in timings)
+
+    def _p95(values):
+        return round(values[min(len(values) - 1, int(len(values) * 0.95))], 3) if values else 0.0
+
+    return {
+        "queue_depth": counts.get(STATUS_QUEUED, 0),
+        "running": counts.get(STATUS_RUNNING, 0),
+        "done": counts.get(STATUS_DONE, 0),
+        "failed": counts.get(STATUS_FAILED, 0),
+        "oldest_queued_age_s": round(now - oldest, 3) if oldest else 0.0,
+        "window_s": window,
+        "completed_in_window": len(timings),
+        "wait_time_avg_s": round(sum(waits) / len(waits), 3) if waits else 0.0,
+        "wait_time_p95_s": _p95(waits),
+        "run_time_avg_s": round(sum(runs) / len(runs), 3) if runs else 0.0,
+        "run_time_p95_s": _p95(runs),
+        "workers": JOB_QUEUE_CONFIG["workers"] if _workers_started else 0,
+    }
+
+
+# =====================================================
+# WORKERS
+# =====================================================
+def register_handler(kind, func):
+    """`func(payload) -> JSON-serialisable result` runs for jobs of `kind`."""
+    _handlers[kind] = func
+
+
+def run_job(job):
+    handler = _handlers.get(job["kind"])
+    t0 = time.time()
+    try:
+        if handler is None:
+            raise ValueError(f"No handler for job kind '{job['kind']}'")
+        result = handler(job["payload"])
+        _finish(job["id"], STATUS_DONE, result=result)
+        logger.info(f"✅ Job {job['id']} ({job['kind']}) done in {time.time() - t0:.2f}s")
+    except Exception as e:
+        logger.error(f"❌ Job {job['id']} ({job['kind']}) failed: {e}")
+        _finish(job["id"], STATUS_FAILED, error=str(e))
+
+
+def _worker_loop(name):
+    last_sweep = 0.0
+    while True:
+        try:
+            if time.time() - last_sweep > 60:
+                requeue_stale_jobs()
+                last_sweep = time.time()
+
+            job = claim_next(name)
+            if job is None:
+                _work_available.wait(JOB_QUEUE_CONFIG["poll_interval"])
+                _work_available.clear()
+                continue
+            run_job(job)
+        except Exception as e:
+            logger.error(f"❌ Job worker {name} error: {e}")
+            time.sleep(JOB_QUEUE_CONFIG["poll_interval"])
+
+
+def start_workers(count=None):
+    """Start the worker threads (once per process)."""
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        _workers_started = True
+
+    init_queue()
+    count = JOB_QUEUE_CONFIG["workers"] if count is None else count
+    JOB_QUEUE_CONFIG["workers"] = count
+    host = f"{socket.gethostname()}:{os.getpid()}"
+    for i in range(count):
+        threading.Thread(
+            target=_worker_loop, args=(f"{host}/{i}",),
+            name=f"job-worker-{i}", daemon=True
+        ).start()
+    logger.info(f"👷 Started {count} analysis job worker(s)")
+
+
+# =====================================================
+# DEFAULT HANDLERS
+# =====================================================
+def _strip_segmented_image(nutrition):
+    nutrition = dict(nutrition)
+    if nutrition.get("color_analysis"):
+        nutrition["color_analysis"] = {
+            k: v for k, v in nutrition["color_analysis"].items() if k != "segmented_image"
+        }
+    return nutrition
+
+
+def _job_workspace():
+    """Workspace whose leaf crops / heatmap outlive the job result they're linked from."""
+    from segment2 import AnalysisWorkspace
+
+    return AnalysisWorkspace(max_age=JOB_QUEUE_CONFIG["retention"] + JOB_QUEUE_CONFIG["job_timeout"])
+
+
+def _handle_combined(payload):
+    from plant_pipeline import analyze_plant_combined
+
+    workspace = _job_workspace()
+    combined = analyze_plant_combined(payload["image_path"], workspace=workspace, profile=payload.get("profile"))
+    combined["nutrition"] = _strip_segmented_image(combined["nutrition"])
+    combined["job_workspace"] = workspace.job_id
+    return combined
+
+
+def _handle_segment(payload):
+    from analysis_cache import cached_segment_analyze_plant
+
+    workspace = _job_workspace()
+    leaf_results, severity, level = cached_segment_analyze_plant(
+        payload["image_path"], workspace=workspace, profile=payload.get("profile")
+    )
+    return {
+        "disease": {
+            "leaf_results": leaf_results,
+            "plant_severity": severity,
+            "plant_severity_level": level,
+        },
+        "job_workspace": workspace.job_id,
+    }
+
+
+def _handle_nutrition(payload):
+    from analysis_cache import cached_analyze_nutrition_deficiency
+
+    return {"nutrition": _strip_segmented_image(cached_analyze_nutrition_deficiency(payload["image_path"]))}
+
+
+register_handler("combined", _handle_combined)
+register_handler("segment", _handle_segment)
+register_handler("nutrition", _handle_nutrition)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    parser = argparse.ArgumentParser(description="Run AgriPal analysis job workers")
+    parser.add_argument("--workers", type=int, default=JOB_QUEUE_CONFIG["workers"])
+    args = parser.parse_args()
+
+    start_workers(args.workers)
+    try:
+        while True:
+            time.sleep(60)
+            logger.info(f"📊 Queue: {queue_metrics()}")
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,333 @@
+"""
+AgriPal - Memory budget helpers
+Low-memory execution mode for the OpenCV pipelines (segment2,
+nutrition_analyzer) on the 512 MB tier:
+
+- reduced-resolution JPEG decoding, so the full-size photo is never
+  materialised when the pipeline only needs ~1000 px
+- GrabCut on a bounded working size: its graph lives in native memory
+  (~200 bytes per pixel, invisible to tracemalloc) and dominates the
+  footprint of an analysis
+- reusable per-thread scratch buffers for per-call temporaries
+- per-stage peak allocation accounting through tracemalloc, and the
+  concurrency level that fits the memory budget
+
+Enable with AGRIPAL_LOW_MEMORY=1; enable stage accounting with
+AGRIPAL_TRACK_MEMORY=1 (tracemalloc slows allocation-heavy code a little).
+"""
+
+import io
+import logging
+import os
+import threading
+import tracemalloc
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+LOW_MEMORY = os.environ.get("AGRIPAL_LOW_MEMORY", "0") == "1"
+TRACK_MEMORY = os.environ.get("AGRIPAL_TRACK_MEMORY", "0") == "1"
+MEMORY_BUDGET_MB = int(os.environ.get("AGRIPAL_MEMORY_BUDGET_MB", 512))
+
+# Headroom kept free of analysis work (allocator slack, request buffers)
+BUDGET_HEADROOM = 0.15
+
+# Measured RSS growth of cv2.grabCut per input pixel (GMMs + graph),
+# flat from 400 to 1200 px; tracemalloc never sees it.
+GRABCUT_BYTES_PER_PIXEL = 210
+
+# Longest side GrabCut works at in low-memory mode (~40 MB native)
+GRABCUT_LOW_MEMORY_MAX_SIZE = int(os.environ.get("AGRIPAL_GRABCUT_MAX_SIZE", 512))
+
+if TRACK_MEMORY and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+# =====================================================
+# REDUCED DECODING
+# =====================================================
+_REDUCED_FLAGS = [
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+]
+
+
+def _image_header(source):
+    """((width, height), format) from the file header, or (None, None)."""
+    try:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = io.BytesIO(source)
+        with Image.open(source) as img:
+            return img.size, img.format
+    except Exception:
+        return None, None
+
+
+def image_dimensions(source):
+    """(width, height) from the file header of a path / encoded bytes, or None."""
+    return _image_header(source)[0]
+
+
+def reduced_decode_flag(dimensions, max_size):
+    """
+    Largest IMREAD_REDUCED_* factor that still leaves the longest side at
+    or above `max_size` (JPEG decodes straight to the smaller size via DCT
+    scaling). IMREAD_COLOR when no reduction applies.
+    """
+    if not dimensions or not max_size:
+        return cv2.IMREAD_COLOR
+    longest = max(dimensions)
+    for factor, flag in _REDUCED_FLAGS:
+        if longest // factor >= max_size:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def _decode_flag(source, max_size):
+    if max_size:
+        size, fmt = _image_header(source)
+        if fmt == "JPEG":
+            return reduced_decode_flag(size, max_size)
+    return cv2.IMREAD_COLOR
+
+
+def decode_reduction(source, max_size=None):
+    """Power-of-two factor decode_image(source, max_size) reduces by (1 = full size)."""
+    flag = _decode_flag(source, max_size)
+    return next((factor for factor, f in _REDUCED_FLAGS if f == flag), 1)
+
+
+def decode_image(source, max_size=None):
+    """
+    Decode a path or encoded bytes to BGR. With `max_size` set, JPEGs may
+    come back power-of-two reduced (longest side still >= max_size), so a
+    12 MP photo never becomes a 36 MB array. Other formats are decoded in
+    full: OpenCV would decode them full-size internally anyway and then
+    downscale without area averaging.
+    Returns None if the data cannot be decoded.
+    """
+    flag = _decode_flag(source, max_size)
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return cv2.imdecode(np.frombuffer(source, np.uint8), flag)
+    return cv2.imread(source, flag)
+
+
+# =====================================================
+# BOUNDED GRABCUT
+# =====================================================
+def grabcut_size(shape, max_size=None):
+    """(height, width) GrabCut actually runs at for an image of `shape`."""
+    h, w = shape[:2]
+    if max_size and max(h, w) > max_size:
+        scale = max_size / max(h, w)
+        return max(1, int(h * scale)), max(1, int(w * scale))
+    return h, w
+
+
+def grabcut_native_bytes(shape, max_size=None):
+    """Estimated untraced native memory of grabcut_labels() on `shape`."""
+    h, w = grabcut_size(shape, max_size)
+    return h * w * GRABCUT_BYTES_PER_PIXEL
+
+
+def grabcut_foreground(image, margin, iterations, max_size=None):
+    """
+    cv2.grabCut initialised with the image rectangle inset by `margin`
+    (fraction of the short side); returns the 0/1 (probable) foreground
+    mask at the image's size. With `max_size` GrabCut runs on a
+    downscaled copy and the mask is upsampled with smooth edges,
+    bounding its native memory.
+    """
+    h, w = image.shape[:2]
+    work_h, work_w = grabcut_size(image.shape, max_size)
+    work = image
+    if (work_h, work_w) != (h, w):
+        work = cv2.resize(image, (work_w, work_h), interpolation=cv2.INTER_AREA)
+
+    mask = np.zeros((work_h, work_w), np.uint8)
+    bgdModel = np.zeros((1, 65), np.float64)
+    fgdModel = np.zeros((1, 65), np.float64)
+
+    inset = int(min(work_h, work_w) * margin)
+    rect = (inset, inset, work_w - 2 * inset, work_h - 2 * inset)
+    cv2.grabCut(work, mask, rect, bgdModel, fgdModel, iterations, cv2.GC_INIT_WITH_RECT)
+
+    # GC_FGD (1) / GC_PR_FGD (3) → 1, GC_BGD (0) / GC_PR_BGD (2) → 0, in place
+    np.bitwise_and(mask, 1, out=mask)
+
+    if work is not image:
+        np.multiply(mask, 255, out=mask)
+        mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_LINEAR)
+        cv2.threshold(mask, 127, 1, cv2.THRESH_BINARY, dst=mask)
+    return mask
+
+
+# =====================================================
+# PER-THREAD SCRATCH BUFFERS
+# =====================================================
+_scratch = threading.local()
+
+
+def scratch(name, shape, dtype=np.uint8):
+    """
+    Reusable buffer for per-call temporaries, one set per worker thread.
+    Contents are undefined; never return a scratch buffer to a caller
+    that keeps it beyond the current analysis.
+    """
+    buffers = getattr(_scratch, "buffers", None)
+    if buffers is None:
+        buffers = _scratch.buffers = {}
+
+    shape = tuple(shape)
+    buf = buffers.get(name)
+    if buf is None or buf.shape != shape or buf.dtype != dtype:
+        buf = buffers[name] = np.empty(shape, dtype)
+    return buf
+
+
+def release_scratch():
+    """Drop this thread's scratch buffers."""
+    _scratch.buffers = {}
+
+
+# =====================================================
+# STAGE PEAK ACCOUNTING
+# =====================================================
+_peaks_lock = threading.Lock()
+_stage_peaks = {}      # "pipeline.stage" → max peak bytes seen
+_pipeline_peaks = {}   # pipeline → max peak bytes over a whole run
+
+# Trackers reset tracemalloc's peak counter; the traced peak seen before
+# each reset is kept here so outer measurements stay correct.
+_high_water = threading.local()
+
+
+def _save_high_water():
+    _high_water.value = max(getattr(_high_water, "value", 0), tracemalloc.get_traced_memory()[1])
+
+
+def reset_traced_peak():
+    """tracemalloc.reset_peak() that also clears the trackers' high-water mark."""
+    tracemalloc.reset_peak()
+    _high_water.value = 0
+
+
+def traced_peak():
+    """Traced peak (bytes) since reset_traced_peak(), across tracker resets."""
+    return max(tracemalloc.get_traced_memory()[1], getattr(_high_water, "value", 0))
+
+
+def reset_memory_report():
+    """Forget the per-stage / per-pipeline peaks gathered so far."""
+    with _peaks_lock:
+        _stage_peaks.clear()
+        _pipeline_peaks.clear()
+
+
+class StageMemoryTracker:
+    """
+    Per-stage peak allocation of one pipeline run, measured with
+    tracemalloc (numpy / OpenCV output arrays are traced; OpenCV's
+    internal C++ temporaries are not, so stages add an estimate for the
+    big ones via `native_bytes`). A no-op when tracemalloc is off.
+
+    Stages must not nest; use traced_peak() rather than tracemalloc's own
+    peak around a tracked run. tracemalloc is process-wide, so numbers are
+    exact only when runs don't overlap (e.g. in the benchmark); under
+    concurrency they are an upper bound.
+    """
+
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.enabled = tracemalloc.is_tracing()
+        self.stages = {}
+        self.peak = 0
+        self._baseline = tracemalloc.get_traced_memory()[0] if self.enabled else 0
+
+    @contextmanager
+    def stage(self, name, native_bytes=0):
+        """`native_bytes`: estimated untraced memory of the stage (e.g. GrabCut)."""
+        if not self.enabled:
+            yield
+            return
+
+        _save_high_water()
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        try:
+            yield
+        finally:
+            _save_high_water()
+            peak = tracemalloc.get_traced_memory()[1] + native_bytes
+            self.stages[name] = max(self.stages.get(name, 0), peak - current)
+            self.peak = max(self.peak, peak - self._baseline)
+
+    def report(self):
+        """{"stages": {name: MB}, "peak_mb": MB} for this run (None if disabled)."""
+        if not self.enabled:
+            return None
+
+        with _peaks_lock:
+            for name, value in self.stages.items():
+                key = f"{self.pipeline}.{name}"
+                _stage_peaks[key] = max(_stage_peaks.get(key, 0), value)
+            _pipeline_peaks[self.pipeline] = max(_pipeline_peaks.get(self.pipeline, 0), self.peak)
+
+        return {
+            "stages": {name: round(value / 1024 / 1024, 2) for name, value in self.stages.items()},
+            "peak_mb": round(self.peak / 1024 / 1024, 2),
+        }
+
+    def log(self):
+        report = self.report()
+        if report:
+            stages = ", ".join(f"{k}={v}MB" for k, v in report["stages"].items())
+            logger.info(f"   🧠 Memory peak {report['peak_mb']} MB ({stages})")
+        return report
+
+
+def current_rss_mb():
+    """Resident set size of this process in MB (Linux /proc; 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError, AttributeError):
+        return 0.0
+
+
+def safe_concurrency(per_job_mb, budget_mb=None, base_mb=None):
+    """
+    How many analyses can run at once without exceeding the budget:
+    (budget - headroom - current RSS) / per-job peak, at least 1.
+    """
+    budget_mb = MEMORY_BUDGET_MB if budget_mb is None else budget_mb
+    base_mb = current_rss_mb() if base_mb is None else base_mb
+    if per_job_mb <= 0:
+        return None
+    available = budget_mb * (1 - BUDGET_HEADROOM) - base_mb
+    return max(1, int(available // per_job_mb))
+
+
+def memory_report():
+    """Worst per-stage / per-pipeline peaks seen so far + safe concurrency."""
+    with _peaks_lock:
+        stages = {k: round(v / 1024 / 1024, 2) for k, v in _stage_peaks.items()}
+        pipelines = {k: round(v / 1024 / 1024, 2) for k, v in sorted(_pipeline_peaks.items())}
+
+    worst = max(pipelines.values(), default=0.0)
+    rss = current_rss_mb()
+    return {
+        "tracking": tracemalloc.is_tracing(),
+        "low_memory": LOW_MEMORY,
+        "budget_mb": MEMORY_BUDGET_MB,
+        "rss_mb": round(rss, 1),
+        "stage_peaks_mb": stages,
+        "pipeline_peaks_mb": pipelines,
+        "safe_concurrency": safe_concurrency(worst, base_mb=rss) if worst else None,
+    }
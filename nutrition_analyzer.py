@@ -6,8 +6,17 @@ import json
 import os
 import time
 
+from memory_budget import (
+    LOW_MEMORY, GRABCUT_LOW_MEMORY_MAX_SIZE, StageMemoryTracker, decode_image,
+    grabcut_foreground, grabcut_native_bytes, scratch
+)
+from dosage import to_hectares
+
 logger = logging.getLogger(__name__)
 
+# Bump when a change alters analysis output (invalidates cached results)
+ANALYZER_VERSION = "2.0"
+
 # Load nutrition deficiency database
 def load_nutrition_deficiency_data():
     """Load nutrition deficiency information from JSON"""
@@ -26,52 +35,39 @@ def load_nutrition_deficiency_data():
         return {}
 
 
-def remove_background_balanced(image):
+# Working resolution for nutrition analysis (longest side, pixels)
+ANALYSIS_MAX_SIZE = 1000
+
+
+def remove_background_balanced(image, full_size=False):
     """
     BALANCED: Fast but accurate background removal
     - Resize for speed (but not too small)
     - 3 iterations (middle ground)
+
+    Returns the segmented image and mask at the working resolution
+    (ANALYSIS_MAX_SIZE). Pass full_size=True to upsample both back to
+    the original photo size.
     """
+    # Resize if too large (SPEED OPTIMIZATION)
+    h, w = image.shape[:2]
+    max_size = ANALYSIS_MAX_SIZE  # Slightly larger than fast version for better accuracy
+    if max(h, w) > max_size:
+        scale = max_size / max(h, w)
+        new_w, new_h = int(w * scale), int(h * scale)
+        img = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        logger.info(f"Resized: {w}x{h} → {new_w}x{new_h}")
+    else:
+        img = image  # grabCut only reads it; no copy needed
+
     try:
-        # Resize if too large (SPEED OPTIMIZATION)
-        h, w = image.shape[:2]
-        max_size = 1000  # Slightly larger than fast version for better accuracy
-        if max(h, w) > max_size:
-            scale = max_size / max(h, w)
-            new_w, new_h = int(w * scale), int(h * scale)
-            img = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_AREA)
-            logger.info(f"Resized: {w}x{h} → {new_w}x{new_h}")
-        else:
-            img = image.copy()
-        
-        h, w = img.shape[:2]
-        
-        # Create mask
-        mask = np.zeros(img.shape[:2], np.uint8)
-        bgdModel = np.zeros((1, 65), np.float64)
-        fgdModel = np.zeros((1, 65), np.float64)
-        
-        # Rectangle around leaf
-        margin = int(min(h, w) * 0.08)
-        rect = (margin, margin, w - 2*margin, h - 2*margin)
-        
-        # BALANCED: 3 iterations (not 2, not 5)
-        cv2.grabCut(img, mask, rect, bgdModel, fgdModel, 3, cv2.GC_INIT_WITH_RECT)
-        
-        # Binary mask
-        mask2 = np.where((mask == 2) | (mask == 0), 0, 1).astype('uint8')
+        # Rectangle around leaf (8% margin); BALANCED: 3 iterations (not 2, not 5)
+        mask2 = grabcut_foreground(img, 0.08, 3, max_size=GRABCUT_LOW_MEMORY_MAX_SIZE if LOW_MEMORY else None)
         
-        # Clean up mask
-        kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
-        mask2 = cv2.morphologyEx(mask2, cv2.MORPH_CLOSE, kernel, iterations=2)
-        mask2 = cv2.morphologyEx(mask2, cv2.MORPH_OPEN, kernel, iterations=1)
+        segmented, mask2 = _clean_mask_white_background(img, mask2)
         
-        # White background
-        white_bg = np.ones_like(img) * 255
-        segmented = np.where(mask2[:, :, None] == 1, img, white_bg)
-        
-        # Resize back if needed
-        if max(image.shape[:2]) > max_size:
+        # Resize back only when a full-size artifact is requested
+        if full_size and img.shape[:2] != image.shape[:2]:
             segmented = cv2.resize(segmented, (image.shape[1], image.shape[0]), 
                                   interpolation=cv2.INTER_LINEAR)
             mask2 = cv2.resize(mask2, (image.shape[1], image.shape[0]), 
@@ -82,39 +78,189 @@ def remove_background_balanced(image):
         
     except Exception as e:
         logger.error(f"❌ Error removing background: {e}")
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        if full_size:
+            img = image
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
         _, mask = cv2.threshold(gray, 10, 255, cv2.THRESH_BINARY)
-        return image, mask
+        return img, mask
+
+
+def _clean_mask_white_background(img, mask2):
+    """Morphological clean-up of a 0/1 leaf mask, then paint background white."""
+    kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    mask2 = cv2.morphologyEx(mask2, cv2.MORPH_CLOSE, kernel, iterations=2)
+    mask2 = cv2.morphologyEx(mask2, cv2.MORPH_OPEN, kernel, iterations=1)
+
+    # White background: one output buffer, leaf pixels copied over it
+    segmented = np.full_like(img, 255)
+    cv2.copyTo(img, mask2, segmented)
+    return segmented, mask2
+
+
+def segmentation_from_stage(stage):
+    """
+    Reuse a shared segment2.prepare_segmentation() result instead of
+    running a second GrabCut: same clean-up and white background as
+    remove_background_balanced, at the stage's working resolution.
+    """
+    # mask_fg is already a 0/1 uint8 mask and the clean-up never writes to it
+    return _clean_mask_white_background(stage['image'], stage['mask_fg'])
+
+
+# =====================================================
+# FUSED HSV PATTERN CLASSIFIER
+# =====================================================
+# Inclusive (lower, upper) HSV boxes, same semantics as cv2.inRange.
+# Each pattern becomes one bit of a per-pixel class code, so overlapping
+# symptoms (e.g. dark yellow-brown = necrosis + margin colour) are kept.
+PATTERN_HSV_RANGES = {
+    'yellowing': [((20, 40, 100), (40, 255, 255))],
+    'purpling': [((140, 30, 50), (180, 255, 255)),
+                 ((0, 30, 50), (10, 255, 255))],
+    'necrosis': [((10, 50, 20), (25, 255, 150))],
+    'bleaching': [((0, 0, 201), (180, 30, 255))],  # V > 200 and S <= 30
+    'margin_yellow_brown': [((15, 30, 50), (35, 255, 255))],
+}
+
+
+def build_pattern_lut(pattern_ranges=None):
+    """
+    Precompute the HSV → pattern-class lookup table.
+
+    Every range is an axis-aligned HSV box, so the 3-D table factorizes
+    exactly into three 256-entry per-channel LUTs (value → bitmask of the
+    boxes whose range contains it) plus one box-code → pattern-code LUT.
+    Classification is then four cv2.LUT calls and two bitwise_ands, all
+    on uint8. Adding a symptom range only means rebuilding these tables.
+    """
+    pattern_ranges = pattern_ranges or PATTERN_HSV_RANGES
+    names = list(pattern_ranges)
+    boxes = [(bit, lower, upper)
+             for bit, name in enumerate(names)
+             for lower, upper in pattern_ranges[name]]
+    if len(boxes) > 8:
+        raise ValueError(f"At most 8 HSV ranges are supported (got {len(boxes)})")
+
+    values = np.arange(256)
+    channel_luts = []
+    for ch in range(3):
+        lut = np.zeros(256, np.uint8)
+        for box_bit, (_, lower, upper) in enumerate(boxes):
+            inside = (values >= lower[ch]) & (values <= upper[ch])
+            lut[inside] |= np.uint8(1 << box_bit)
+        channel_luts.append(lut)
+
+    box_to_pattern = np.zeros(256, np.uint8)
+    for box_code in range(256):
+        for box_bit, (pattern_bit, _, _) in enumerate(boxes):
+            if box_code & (1 << box_bit):
+                box_to_pattern[box_code] |= np.uint8(1 << pattern_bit)
+
+    code_bits = (np.arange(256)[:, None] >> np.arange(len(names))) & 1
+
+    return {
+        'names': names,
+        'channel_luts': channel_luts,
+        'box_to_pattern': box_to_pattern,
+        'code_bits': code_bits,
+    }
+
+
+PATTERN_LUT = build_pattern_lut()
+
+
+def classify_leaf_pixels(hsv, leaf_mask, lut=None, low_memory=False):
+    """
+    One pass: HSV image → per-pixel pattern codes (uint8 label image),
+    then a single masked histogram gives the percentage of every pattern.
+
+    With `low_memory` the codes and channel temporaries are per-thread
+    scratch buffers (valid until the next analysis on this thread).
+    """
+    lut = lut or PATTERN_LUT
+    h_lut, s_lut, v_lut = lut['channel_luts']
+
+    if low_memory:
+        shape = hsv.shape[:2]
+        codes = scratch('pattern_codes', shape)
+        channel = scratch('hsv_channel', shape)
+        cv2.LUT(cv2.extractChannel(hsv, 0, dst=channel), h_lut, dst=codes)
+        for ch, ch_lut in ((1, s_lut), (2, v_lut)):
+            cv2.LUT(cv2.extractChannel(hsv, ch, dst=channel), ch_lut, dst=channel)
+            cv2.bitwise_and(codes, channel, dst=codes)
+    else:
+        codes = cv2.LUT(hsv[:, :, 0], h_lut)
+        cv2.bitwise_and(codes, cv2.LUT(hsv[:, :, 1], s_lut), dst=codes)
+        cv2.bitwise_and(codes, cv2.LUT(hsv[:, :, 2], v_lut), dst=codes)
+    cv2.LUT(codes, lut['box_to_pattern'], dst=codes)
+
+    code_counts = count_pattern_codes(codes, leaf_mask)
+    leaf_area = int(code_counts.sum())
+    pattern_counts = code_counts @ lut['code_bits']
+
+    percentages = {
+        name: float(pattern_counts[i] / leaf_area * 100) if leaf_area > 0 else 0.0
+        for i, name in enumerate(lut['names'])
+    }
+
+    return {
+        'codes': codes,
+        'leaf_area': leaf_area,
+        'percentages': percentages,
+        'bits': {name: 1 << i for i, name in enumerate(lut['names'])},
+    }
+
 
+def count_pattern_codes(codes, mask):
+    """Histogram of pattern codes under a mask (256 bins, int64)."""
+    mask = mask if mask.dtype == np.uint8 else mask.astype(np.uint8)
+    hist = cv2.calcHist([codes], [0], mask, [256], [0, 256])
+    return hist.ravel().astype(np.int64)
 
-def analyze_leaf_color_patterns(image):
-    """BALANCED: Analyze color patterns"""
+
+def analyze_leaf_color_patterns(image, full_size_artifacts=False, stage=None):
+    """
+    BALANCED: Analyze color patterns
+
+    All detectors run at the working resolution; the original photo is
+    only used again if full_size_artifacts=True, in which case the
+    returned segmented_image is upsampled to the original size.
+    With a shared `stage` (segment2.prepare_segmentation) GrabCut is skipped.
+    In low-memory mode the HSV image and detector temporaries are scratch buffers.
+    """
+    low_memory = LOW_MEMORY
     try:
-        # Background removal
-        segmented_image, leaf_mask = remove_background_balanced(image)
-        
-        # Convert to color spaces
-        hsv = cv2.cvtColor(segmented_image, cv2.COLOR_BGR2HSV)
-        rgb = cv2.cvtColor(segmented_image, cv2.COLOR_BGR2RGB)
-        
-        # Calculate stats
-        h, s, v = cv2.split(hsv)
-        
-        h_mean = cv2.mean(h, mask=leaf_mask)[0]
-        s_mean = cv2.mean(s, mask=leaf_mask)[0]
-        v_mean = cv2.mean(v, mask=leaf_mask)[0]
-        
-        # All pattern detections
+        # Background removal (working resolution)
+        if stage is not None:
+            segmented_image, leaf_mask = segmentation_from_stage(stage)
+            original_size = stage['original_size']
+        else:
+            segmented_image, leaf_mask = remove_background_balanced(image)
+            original_size = image.shape[:2]
+
+        hsv = cv2.cvtColor(segmented_image, cv2.COLOR_BGR2HSV,
+                           dst=scratch('hsv', segmented_image.shape) if low_memory else None)
+        h_mean, s_mean, v_mean, _ = cv2.mean(hsv, mask=leaf_mask)
+
+        # Every colour-range detector reads from one classification pass
+        pattern_stats = classify_leaf_pixels(hsv, leaf_mask, low_memory=low_memory)
+
         patterns = {
-            'yellowing': detect_yellowing(hsv, leaf_mask),
-            'purpling': detect_purpling(hsv, rgb, leaf_mask),
-            'interveinal_chlorosis': detect_interveinal_chlorosis_fast(segmented_image, leaf_mask),
-            'marginal_chlorosis': detect_marginal_chlorosis_fast(segmented_image, leaf_mask),
-            'pale_color': detect_pale_color(hsv, leaf_mask),
-            'necrosis': detect_necrosis(hsv, leaf_mask),
-            'bleaching': detect_bleaching(hsv, leaf_mask)
+            'yellowing': detect_yellowing(pattern_stats),
+            'purpling': detect_purpling(pattern_stats),
+            'interveinal_chlorosis': detect_interveinal_chlorosis_fast(
+                segmented_image, leaf_mask, hsv, low_memory=low_memory),
+            'marginal_chlorosis': detect_marginal_chlorosis_fast(
+                segmented_image, leaf_mask, pattern_stats, low_memory=low_memory),
+            'pale_color': detect_pale_color(s_mean),
+            'necrosis': detect_necrosis(pattern_stats),
+            'bleaching': detect_bleaching(pattern_stats)
         }
-        
+
+        if full_size_artifacts and segmented_image.shape[:2] != tuple(original_size):
+            segmented_image = cv2.resize(segmented_image, (original_size[1], original_size[0]),
+                                         interpolation=cv2.INTER_LINEAR)
+
         return {
             'color_stats': {
                 'hue_mean': h_mean,
@@ -126,25 +272,16 @@ def analyze_leaf_color_patterns(image):
             'patterns': patterns,
             'segmented_image': segmented_image
         }
-        
+
     except Exception as e:
         logger.error(f"Error analyzing leaf: {e}")
         return None
 
 
-def detect_yellowing(hsv, leaf_mask):
+def detect_yellowing(pattern_stats):
     """Detect yellow coloration"""
-    lower_yellow = np.array([20, 40, 100])
-    upper_yellow = np.array([40, 255, 255])
-    
-    yellow_mask = cv2.inRange(hsv, lower_yellow, upper_yellow)
-    yellow_mask = cv2.bitwise_and(yellow_mask, leaf_mask)
-    
-    leaf_area = cv2.countNonZero(leaf_mask)
-    yellow_area = cv2.countNonZero(yellow_mask)
-    
-    percentage = (yellow_area / leaf_area * 100) if leaf_area > 0 else 0
-    
+    percentage = pattern_stats['percentages']['yellowing']
+
     return {
         'detected': percentage > 10,
         'severity': 'high' if percentage > 40 else 'moderate' if percentage > 20 else 'mild',
@@ -152,23 +289,10 @@ def detect_yellowing(hsv, leaf_mask):
     }
 
 
-def detect_purpling(hsv, rgb, leaf_mask):
+def detect_purpling(pattern_stats):
     """Detect purple/red tinting"""
-    lower_purple1 = np.array([140, 30, 50])
-    upper_purple1 = np.array([180, 255, 255])
-    lower_purple2 = np.array([0, 30, 50])
-    upper_purple2 = np.array([10, 255, 255])
-    
-    purple_mask1 = cv2.inRange(hsv, lower_purple1, upper_purple1)
-    purple_mask2 = cv2.inRange(hsv, lower_purple2, upper_purple2)
-    purple_mask = cv2.bitwise_or(purple_mask1, purple_mask2)
-    purple_mask = cv2.bitwise_and(purple_mask, leaf_mask)
-    
-    leaf_area = cv2.countNonZero(leaf_mask)
-    purple_area = cv2.countNonZero(purple_mask)
-    
-    percentage = (purple_area / leaf_area * 100) if leaf_area > 0 else 0
-    
+    percentage = pattern_stats['percentages']['purpling']
+
     return {
         'detected': percentage > 5,
         'severity': 'high' if percentage > 20 else 'moderate' if percentage > 10 else 'mild',
@@ -176,21 +300,28 @@ def detect_purpling(hsv, rgb, leaf_mask):
     }
 
 
-def detect_interveinal_chlorosis_fast(image, leaf_mask):
+def detect_interveinal_chlorosis_fast(image, leaf_mask, hsv=None, low_memory=False):
     """FAST interveinal chlorosis detection"""
     try:
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # low_memory: the temporaries reuse per-thread scratch buffers
+        if low_memory:
+            gray, edges, veins = (scratch(name, image.shape[:2]) for name in ('gray', 'edges', 'veins'))
+        else:
+            gray = edges = veins = None
+
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY, dst=gray)
         
         # Simplified edge detection
-        edges = cv2.Canny(gray, 40, 120)
+        edges = cv2.Canny(gray, 40, 120, edges=edges)
         kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
-        veins = cv2.dilate(edges, kernel, iterations=1)
+        veins = cv2.dilate(edges, kernel, dst=veins, iterations=1)
         
-        inter_vein = cv2.bitwise_not(veins)
-        inter_vein = cv2.bitwise_and(inter_vein, leaf_mask)
+        inter_vein = cv2.bitwise_not(veins, dst=edges)
+        inter_vein = cv2.bitwise_and(inter_vein, leaf_mask, dst=inter_vein)
         
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        v = hsv[:, :, 2]
+        if hsv is None:
+            hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+        v = cv2.extractChannel(hsv, 2, dst=gray)
         
         inter_vein_brightness = cv2.mean(v, mask=inter_vein)[0]
         vein_brightness = cv2.mean(v, mask=veins)[0]
@@ -209,7 +340,12 @@ def detect_interveinal_chlorosis_fast(image, leaf_mask):
         return {'detected': False, 'severity': 'none', 'brightness_difference': 0}
 
 
-def detect_marginal_chlorosis_fast(image, leaf_mask):
+# Width (pixels) of the leaf-edge band checked for marginal chlorosis;
+# matches the old 12×12 elliptical erosion.
+MARGIN_BAND_WIDTH = 6
+
+
+def detect_marginal_chlorosis_fast(image, leaf_mask, pattern_stats, low_memory=False):
     """FAST marginal chlorosis detection"""
     try:
         contours, _ = cv2.findContours(leaf_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
@@ -217,22 +353,24 @@ def detect_marginal_chlorosis_fast(image, leaf_mask):
         if not contours:
             return {'detected': False, 'severity': 'none', 'percentage': 0}
         
-        margin_mask = np.zeros_like(leaf_mask)
-        for contour in contours:
-            cv2.drawContours(margin_mask, [contour], -1, 255, -1)
-            kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (12, 12))
-            inner = cv2.erode(margin_mask.copy(), kernel, iterations=1)
-            margin_mask = cv2.subtract(margin_mask, inner)
-        
-        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
-        lower_yellow_brown = np.array([15, 30, 50])
-        upper_yellow_brown = np.array([35, 255, 255])
-        
-        yellow_brown_mask = cv2.inRange(hsv, lower_yellow_brown, upper_yellow_brown)
-        margin_affected = cv2.bitwise_and(yellow_brown_mask, margin_mask)
+        # Margin band for all contours at once: every leaf pixel within
+        # MARGIN_BAND_WIDTH of the outline (cost independent of contour count)
+        shape = leaf_mask.shape[:2]
+        if low_memory:
+            filled = scratch('margin_filled', shape)
+            filled.fill(0)
+            dist = scratch('margin_dist', shape, np.float32)
+        else:
+            filled = np.zeros(shape, np.uint8)
+            dist = None
+        cv2.drawContours(filled, contours, -1, 255, -1)
+        dist = cv2.distanceTransform(filled, cv2.DIST_L2, 5, dst=dist)
+        margin_mask = cv2.inRange(dist, 1, MARGIN_BAND_WIDTH, dst=filled)
         
-        margin_area = cv2.countNonZero(margin_mask)
-        affected_area = cv2.countNonZero(margin_affected)
+        margin_counts = count_pattern_codes(pattern_stats['codes'], margin_mask)
+        margin_bit = pattern_stats['bits']['margin_yellow_brown']
+        margin_area = int(margin_counts.sum())
+        affected_area = int(margin_counts[(np.arange(256) & margin_bit) > 0].sum())
         
         percentage = (affected_area / margin_area * 100) if margin_area > 0 else 0
         
@@ -245,11 +383,8 @@ def detect_marginal_chlorosis_fast(image, leaf_mask):
         return {'detected': False, 'severity': 'none', 'percentage': 0}
 
 
-def detect_pale_color(hsv, leaf_mask):
+def detect_pale_color(mean_saturation):
     """Detect overall pale color"""
-    s = hsv[:, :, 1]
-    mean_saturation = cv2.mean(s, mask=leaf_mask)[0]
-    
     is_pale = mean_saturation < 80
     severity = 'high' if mean_saturation < 50 else 'moderate' if mean_saturation < 70 else 'mild'
     
@@ -260,18 +395,9 @@ def detect_pale_color(hsv, leaf_mask):
     }
 
 
-def detect_necrosis(hsv, leaf_mask):
+def detect_necrosis(pattern_stats):
     """Detect necrotic tissue"""
-    lower_brown = np.array([10, 50, 20])
-    upper_brown = np.array([25, 255, 150])
-    
-    brown_mask = cv2.inRange(hsv, lower_brown, upper_brown)
-    brown_mask = cv2.bitwise_and(brown_mask, leaf_mask)
-    
-    leaf_area = cv2.countNonZero(leaf_mask)
-    brown_area = cv2.countNonZero(brown_mask)
-    
-    percentage = (brown_area / leaf_area * 100) if leaf_area > 0 else 0
+    percentage = pattern_stats['percentages']['necrosis']
     
     return {
         'detected': percentage > 5,
@@ -280,21 +406,9 @@ def detect_necrosis(hsv, leaf_mask):
     }
 
 
-def detect_bleaching(hsv, leaf_mask):
+def detect_bleaching(pattern_stats):
     """Detect bleached areas"""
-    v = hsv[:, :, 2]
-    s = hsv[:, :, 1]
-    
-    high_v = cv2.threshold(v, 200, 255, cv2.THRESH_BINARY)[1]
-    low_s = cv2.threshold(s, 30, 255, cv2.THRESH_BINARY_INV)[1]
-    
-    bleached_mask = cv2.bitwise_and(high_v, low_s)
-    bleached_mask = cv2.bitwise_and(bleached_mask, leaf_mask)
-    
-    leaf_area = cv2.countNonZero(leaf_mask)
-    bleached_area = cv2.countNonZero(bleached_mask)
-    
-    percentage = (bleached_area / leaf_area * 100) if leaf_area > 0 else 0
+    percentage = pattern_stats['percentages']['bleaching']
     
     return {
         'detected': percentage > 3,
@@ -371,24 +485,43 @@ def diagnose_nutrient_deficiency(color_analysis):
     return diagnoses
 
 
-def analyze_nutrition_deficiency(image_path):
+def analyze_nutrition_deficiency(image_path, full_size_artifacts=False, stage=None, reduced_decode=None):
     """
     BALANCED: Fast (10-15s) AND Accurate
+    Pattern detection runs at working resolution (see ANALYSIS_MAX_SIZE).
+    Pass a shared segmentation `stage` to skip decoding and GrabCut.
+    In low-memory mode (AGRIPAL_LOW_MEMORY=1) or with reduced_decode=True the
+    photo is decoded at reduced resolution unless full-size artifacts are
+    requested. `image_path` may also be encoded bytes.
     """
     start_time = time.time()
+    tracker = StageMemoryTracker("nutrition")
+    label = image_path if isinstance(image_path, str) else "<in-memory upload>"
     
     logger.info("="*80)
     logger.info("⚖️ BALANCED NUTRITION ANALYSIS (Fast + Accurate)")
     logger.info("="*80)
     
     try:
-        image = cv2.imread(image_path)
-        if image is None:
-            raise ValueError(f"Could not load image: {image_path}")
-        
-        logger.info(f"📸 Analyzing: {image_path}")
-        
-        color_analysis = analyze_leaf_color_patterns(image)
+        if stage is not None:
+            image = None
+        else:
+            reduced = (LOW_MEMORY if reduced_decode is None else reduced_decode) and not full_size_artifacts
+            with tracker.stage("decode"):
+                image = decode_image(image_path, max_size=ANALYSIS_MAX_SIZE if reduced else None)
+            if image is None:
+                raise ValueError(f"Could not load image: {label}")
+        
+        logger.info(f"📸 Analyzing: {label}")
+        
+        # GrabCut's native graph (untraced) only when it isn't shared via `stage`
+        grabcut_bytes = 0 if image is None else grabcut_native_bytes(
+            image.shape, GRABCUT_LOW_MEMORY_MAX_SIZE if LOW_MEMORY else ANALYSIS_MAX_SIZE)
+        with tracker.stage("color_patterns", grabcut_bytes):
+            color_analysis = analyze_leaf_color_patterns(
+                image, full_size_artifacts=full_size_artifacts, stage=stage
+            )
+        image = None
         
         if not color_analysis:
             return {'success': False, 'error': 'Failed to analyze'}
@@ -422,13 +555,17 @@ def analyze_nutrition_deficiency(image_path):
         elapsed = time.time() - start_time
         logger.info(f"✅ Complete in {elapsed:.2f}s - Found {len(detailed_results)} deficiencies")
         
-        return {
+        result = {
             'success': True,
             'color_analysis': color_analysis,
             'diagnoses': detailed_results,
             'total_found': len(detailed_results),
             'processing_time': round(elapsed, 2)
         }
+        memory = tracker.log()
+        if memory:
+            result['memory'] = memory
+        return result
         
     except Exception as e:
         logger.error(f"❌ Error: {e}")
@@ -439,14 +576,7 @@ def analyze_nutrition_deficiency(image_path):
 
 def calculate_fertilizer_dosage(area, area_unit, fertilizer_info):
     """Calculate fertilizer dosage"""
-    conversion_factors = {
-        'square_meter': 0.0001,
-        'acre': 0.404686,
-        'hectare': 1.0,
-        'square_foot': 0.0000092903
-    }
-    
-    area_in_hectares = area * conversion_factors.get(area_unit, 1.0)
+    area_in_hectares = to_hectares(area, area_unit)
     
     chemical_dosage = {
         'amount': round(fertilizer_info['chemical']['dosage_per_hectare'] * area_in_hectares, 2),
@@ -0,0 +1,253 @@
+"""
+AgriPal - Plant image check
+Cost-ordered, early-exit cascade behind app2.is_plant_image.
+
+The criteria and thresholds are the original ones (green content,
+texture, edges, colour spread, brightness, contrast, organic shapes,
+straight lines, text-like strokes; plant = green + reasonable size +
+score >= 7 of 14), but:
+
+- they run on a thumbnail (JPEGs are decoded straight at reduced size),
+  with the pixel-size parameters (contour area, Hough line length, text
+  kernel) scaled to it
+- cheap criteria run first, and evaluation stops as soon as the score
+  reaches the threshold or can no longer reach it
+- every criterion that ran is timed
+
+With thumbnail_size=None the metrics are the original full-image ones
+(up to floating-point rounding) and the early exit cannot change the
+decision. benchmarks/validate_plant_check.py compares both against
+the original implementation on a labelled set.
+"""
+
+import logging
+import time
+
+import cv2
+import numpy as np
+
+from memory_budget import decode_image, image_dimensions
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# CHECK SETTINGS
+# =====================================================
+PLANT_CHECK_CONFIG = {
+    # Longest side the criteria are evaluated at (None = full resolution)
+    "thumbnail_size": 640,
+
+    # Plant = green content + reasonable size + score >= min_score
+    "min_score": 7,
+    "min_side": 100,
+}
+
+GREEN_RANGES = [
+    ((35, 50, 50), (85, 255, 255)),
+    ((25, 30, 30), (75, 255, 200)),
+    ((15, 40, 40), (35, 255, 255)),
+]
+
+
+class _Thumbnail:
+    """Image + lazily computed intermediates shared between criteria."""
+
+    def __init__(self, img, scale):
+        self.img = img
+        self.scale = scale  # thumbnail / original, for pixel-size parameters
+        self.total_pixels = img.shape[0] * img.shape[1]
+        self.metrics = {}
+        self._gray = None
+        self._edges = None
+
+    @property
+    def gray(self):
+        if self._gray is None:
+            self._gray = cv2.cvtColor(self.img, cv2.COLOR_BGR2GRAY)
+        return self._gray
+
+    @property
+    def edges(self):
+        if self._edges is None:
+            self._edges = cv2.Canny(self.gray, 50, 150)
+        return self._edges
+
+
+# =====================================================
+# CRITERIA (cheapest first)
+# =====================================================
+def _green_content(t):
+    hsv = cv2.cvtColor(t.img, cv2.COLOR_BGR2HSV)
+    # The ranges overlap; pixels are counted once per range, as before
+    green = sum(cv2.countNonZero(cv2.inRange(hsv, lower, upper)) for lower, upper in GREEN_RANGES)
+    t.metrics["green_ratio"] = green / t.total_pixels
+    return t.metrics["green_ratio"] > 0.12
+
+
+def _organic_texture(t):
+    t.metrics["texture_variance"] = float(np.var(t.gray))
+    return t.metrics["texture_variance"] > 500
+
+
+def _good_brightness(t):
+    t.metrics["brightness"] = float(np.mean(t.gray))
+    return 30 < t.metrics["brightness"] < 220
+
+
+def _good_contrast(t):
+    # np.std is sqrt(np.var): reuse the texture variance
+    variance = t.metrics.get("texture_variance")
+    t.metrics["contrast"] = float(np.sqrt(variance)) if variance is not None else float(np.std(t.gray))
+    return t.metrics["contrast"] > 20
+
+
+def _natural_colors(t):
+    # Mean of the per-channel std; meanStdDev is ~40x faster than np.std
+    # over axis (0, 1) and equal to it up to floating-point rounding
+    _, std = cv2.meanStdDev(t.img)
+    t.metrics["color_variation"] = float(std.mean())
+    return t.metrics["color_variation"] > 15
+
+
+def _natural_edges(t):
+    t.metrics["edge_ratio"] = cv2.countNonZero(t.edges) / t.total_pixels
+    return 0.02 < t.metrics["edge_ratio"] < 0.25
+
+
+def _not_text_heavy(t):
+    width = max(3, int(round(25 * t.scale)))
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (width, 1))
+    horizontal = cv2.morphologyEx(t.edges, cv2.MORPH_OPEN, kernel)
+    t.metrics["text_ratio"] = cv2.countNonZero(horizontal) / t.total_pixels
+    return t.metrics["text_ratio"] < 0.05
+
+
+def _not_geometric(t):
+    s = t.scale
+    lines = cv2.HoughLinesP(
+        t.edges, 1, np.pi / 180,
+        threshold=max(1, int(round(50 * s))), minLineLength=50 * s, maxLineGap=10 * s
+    )
+    t.metrics["straight_lines"] = len(lines) if lines is not None else 0
+    return t.metrics["straight_lines"] < 10
+
+
+def _organic_shapes(t):
+    min_area = 100 * t.scale * t.scale
+    contours, _ = cv2.findContours(t.edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    shapes = 0
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area > min_area:
+            perimeter = cv2.arcLength(contour, True)
+            if perimeter > 0 and 0.1 < 4 * np.pi * area / (perimeter * perimeter) < 0.8:
+                shapes += 1
+                break  # only "any organic shape" matters
+    t.metrics["organic_shapes"] = shapes
+    return shapes > 0
+
+
+# (name, points, test), in order of measured cost on a 640 px thumbnail.
+# green_content is also mandatory; natural_edges pays for the Canny pass
+# that the three edge-based criteria after it share.
+CRITERIA = [
+    ("green_content", 3, _green_content),
+    ("organic_texture", 2, _organic_texture),
+    ("good_brightness", 1, _good_brightness),
+    ("good_contrast", 1, _good_contrast),
+    ("natural_colors", 1, _natural_colors),
+    ("natural_edges", 2, _natural_edges),
+    ("not_text_heavy", 1, _not_text_heavy),
+    ("organic_shapes", 2, _organic_shapes),
+    ("not_geometric", 1, _not_geometric),
+]
+MAX_SCORE = sum(points for _, points, _ in CRITERIA)
+
+
+# =====================================================
+# CASCADE
+# =====================================================
+def _load_thumbnail(image_path, thumbnail_size):
+    """(thumbnail, scale, (width, height) of the original) or (None, ...)."""
+    size = image_dimensions(image_path)
+    img = decode_image(image_path, max_size=thumbnail_size)
+    if img is None:
+        return None, 1.0, size
+    h, w = img.shape[:2]
+    size = size or (w, h)
+
+    if thumbnail_size and max(h, w) > thumbnail_size:
+        s = thumbnail_size / max(h, w)
+        img = cv2.resize(img, (max(1, int(w * s)), max(1, int(h * s))), interpolation=cv2.INTER_AREA)
+    # Longest sides: EXIF rotation may swap the header's width / height
+    return img, max(img.shape[:2]) / max(size), size
+
+
+def check_plant_image(image_path, config=None):
+    """
+    Run the cascade on an image file. Returns
+    {"is_plant", "score", "criteria_met", "metrics", "timings" (ms per
+    criterion that ran, plus "decode"), "exit" (what decided), "skipped"}.
+    """
+    config = config or PLANT_CHECK_CONFIG
+    min_score = config["min_score"]
+    timings = {}
+
+    t0 = time.perf_counter()
+    img, scale, size = _load_thumbnail(image_path, config["thumbnail_size"])
+    timings["decode"] = (time.perf_counter() - t0) * 1000
+
+    result = {
+        "is_plant": False, "score": 0, "criteria_met": [], "metrics": {},
+        "timings": timings, "exit": None, "skipped": [],
+    }
+    if img is None:
+        result["exit"] = "unreadable"
+        return result
+
+    # Size comes from the original dimensions, not the thumbnail
+    if not (size[1] > config["min_side"] and size[0] > config["min_side"]):
+        result["exit"] = "size"
+        result["skipped"] = [name for name, _, _ in CRITERIA]
+        return result
+
+    thumb = _Thumbnail(img, scale)
+    result["metrics"] = thumb.metrics
+    remaining = MAX_SCORE
+    score = 0
+    for i, (name, points, test) in enumerate(CRITERIA):
+        t0 = time.perf_counter()
+        passed = test(thumb)
+        timings[name] = (time.perf_counter() - t0) * 1000
+        remaining -= points
+
+        if passed:
+            score += points
+            result["criteria_met"].append(name)
+        elif name == "green_content":
+            result["exit"] = "green_content"
+        if result["exit"] is None:
+            if score >= min_score:
+                result["exit"] = "score_reached"
+            elif score + remaining < min_score:
+                result["exit"] = "score_unreachable"
+        if result["exit"]:
+            result["skipped"] = [n for n, _, _ in CRITERIA[i + 1:]]
+            break
+
+    result["score"] = score
+    result["is_plant"] = result["exit"] == "score_reached"
+    return result
+
+
+def log_plant_check(image_path, result):
+    m = result["metrics"]
+    logger.info(f"Plant image analysis for {image_path}:")
+    for key, value in m.items():
+        logger.info(f"  - {key}: {value:.3f}" if isinstance(value, float) else f"  - {key}: {value}")
+    timings = ", ".join(f"{k}={v:.1f}ms" for k, v in result["timings"].items())
+    logger.info(f"  - Timings: {timings}")
+    if result["skipped"]:
+        logger.info(f"  - Skipped: {result['skipped']}")
+    logger.info(f"  - Score: {result['score']}/{MAX_SCORE} (criteria met: {result['criteria_met']})")
+    logger.info(f"  - Final decision: {'PLANT' if result['is_plant'] else 'NOT PLANT'} ({result['exit']})")
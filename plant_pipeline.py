@@ -0,0 +1,77 @@
+"""
+AgriPal - Combined plant analysis
+Decode once, segment once, then run both the leaf-severity pipeline
+(segment2) and the nutrient pattern detectors (nutrition_analyzer).
+"""
+
+import logging
+import time
+
+from segment2 import (
+    AnalysisWorkspace, image_megapixels, prepare_segmentation,
+    resolve_profile, segment_analyze_plant, stage_decode_factor
+)
+from nutrition_analyzer import analyze_nutrition_deficiency
+from analysis_cache import (
+    read_image_bytes, lookup_segment_result, store_segment_result,
+    lookup_nutrition_result, store_nutrition_result
+)
+
+logger = logging.getLogger(__name__)
+
+
+def analyze_plant_combined(image_source, workspace=None, profile=None):
+    """
+    Disease severity + nutrition deficiency from a single GrabCut run.
+
+    `image_source` may be a file path or the encoded image bytes. Each half
+    is served from the analysis cache when possible; GrabCut only runs if
+    at least one of them misses.
+    `profile` is a segment2 profile name or "auto", resolved once up front.
+    Returns a dict with the segment2 results under 'disease' and the
+    analyze_nutrition_deficiency result under 'nutrition'.
+    """
+    start_time = time.time()
+
+    logger.info("=" * 80)
+    logger.info("🔗 COMBINED DISEASE + NUTRITION ANALYSIS (shared segmentation)")
+    logger.info("=" * 80)
+
+    label = image_source if isinstance(image_source, str) else "<in-memory>"
+    workspace = workspace or AnalysisWorkspace()
+
+    # Results already cached for this exact photo + configuration?
+    image_bytes = read_image_bytes(image_source)
+    profile, config = resolve_profile(profile, image_megapixels(image_bytes))
+    decode_factor = stage_decode_factor(image_bytes, config)
+    segment_result = lookup_segment_result(image_bytes, workspace, profile, decode_factor)
+    nutrition = lookup_nutrition_result(image_bytes, profile, decode_factor=decode_factor)
+
+    if segment_result is None or nutrition is None:
+        t0 = time.time()
+        stage = prepare_segmentation(image_bytes, profile=profile)
+        logger.info(f"   ✅ Shared decode + segment: {time.time() - t0:.2f}s")
+
+        if segment_result is None:
+            segment_result = segment_analyze_plant(label, workspace=workspace, stage=stage)
+            store_segment_result(image_bytes, workspace, segment_result, profile, stage["decode_factor"])
+
+        if nutrition is None:
+            nutrition = analyze_nutrition_deficiency(label, stage=stage)
+            store_nutrition_result(image_bytes, nutrition, profile, decode_factor=stage["decode_factor"])
+
+    leaf_results, plant_severity, plant_level = segment_result
+
+    elapsed = time.time() - start_time
+    logger.info(f"✅ Combined analysis complete in {elapsed:.2f}s")
+
+    return {
+        'disease': {
+            'leaf_results': leaf_results,
+            'plant_severity': plant_severity,
+            'plant_severity_level': plant_level,
+        },
+        'profile': profile,
+        'nutrition': nutrition,
+        'processing_time': round(elapsed, 2),
+    }
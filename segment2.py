@@ -2,12 +2,23 @@ import cv2
 import numpy as np
 import os
 import shutil
+import sys
 import logging
+import threading
+import uuid
 from concurrent.futures import ThreadPoolExecutor
 import time
 
+from memory_budget import (
+    LOW_MEMORY, GRABCUT_LOW_MEMORY_MAX_SIZE, StageMemoryTracker, decode_image,
+    decode_reduction, grabcut_foreground, grabcut_native_bytes, image_dimensions, scratch
+)
+
 logger = logging.getLogger(__name__)
 
+# Bump when a change alters pipeline output (invalidates cached results)
+ANALYZER_VERSION = "2.1"
+
 # =====================================================
 # PERFORMANCE OPTIMIZATION SETTINGS
 # =====================================================
@@ -27,10 +38,268 @@ OPTIMIZATION_CONFIG = {
     # Parallel processing for leaves
     "parallel_processing": True,
 
-    # Skip heatmap generation (can be done separately if needed)
-    "skip_heatmap": False,
+    # Threads used for leaf extraction when parallel
+    "max_workers": 4,
+
+    # Skip eager heatmap generation; only the disease mask is stored and
+    # the overlay is rendered on demand (heatmap_for_job / /api/heatmap)
+    "skip_heatmap": True,
+
+    # Low-memory mode (AGRIPAL_LOW_MEMORY=1): decode JPEGs straight at
+    # reduced resolution, run GrabCut at GRABCUT_LOW_MEMORY_MAX_SIZE and
+    # keep per-call temporaries in scratch buffers
+    "low_memory": LOW_MEMORY,
+}
+
+# Named speed/accuracy trade-offs, selectable per request.
+# "balanced" is OPTIMIZATION_CONFIG itself; min_leaf_area scales with
+# the square of max_image_size so the same leaves survive the filter.
+OPTIMIZATION_PROFILES = {
+    "fast": dict(
+        OPTIMIZATION_CONFIG,
+        max_image_size=512,
+        grabcut_iterations=1,
+        morph_iterations=1,
+        min_leaf_area=400,
+        max_workers=2,
+    ),
+    "balanced": OPTIMIZATION_CONFIG,
+    "accurate": dict(
+        OPTIMIZATION_CONFIG,
+        max_image_size=1200,
+        grabcut_iterations=5,
+        min_leaf_area=2250,
+    ),
+}
+
+DEFAULT_PROFILE = os.environ.get("AGRIPAL_PROFILE", "balanced")
+ADAPTIVE_PROFILE = "auto"
+
+# Adaptive selection: load = (analyses in GrabCut + 1-min loadavg) per CPU
+ADAPTIVE_RULES = {
+    "fast_above_load": 1.0,         # overloaded → shed quality
+    "fast_above_megapixels": 12.0,  # very large photos → fast
+    "accurate_below_load": 0.25,    # idle server ...
+    "accurate_below_megapixels": 2.0,  # ... and a small photo → accurate
 }
 
+_active_lock = threading.Lock()
+_active_segmentations = 0
+
+
+def current_load():
+    """Concurrent segmentations plus system load average, per CPU."""
+    cpus = os.cpu_count() or 1
+    try:
+        loadavg = os.getloadavg()[0]
+    except (AttributeError, OSError):
+        loadavg = 0.0
+    with _active_lock:
+        active = _active_segmentations
+    return max(active, loadavg) / cpus
+
+
+def select_profile(megapixels=None, load=None):
+    """Pick a profile name from the input size and current server load."""
+    load = current_load() if load is None else load
+    megapixels = megapixels or 0.0
+
+    if load >= ADAPTIVE_RULES["fast_above_load"] or megapixels > ADAPTIVE_RULES["fast_above_megapixels"]:
+        return "fast"
+    if load < ADAPTIVE_RULES["accurate_below_load"] and megapixels <= ADAPTIVE_RULES["accurate_below_megapixels"]:
+        return "accurate"
+    return "balanced"
+
+
+def resolve_profile(profile=None, megapixels=None):
+    """
+    (profile_name, config) for a requested profile name.
+    None → DEFAULT_PROFILE; "auto" → select_profile(); unknown names fall
+    back to the default with a warning. A config dict (e.g. a benchmark's
+    modified copy of a profile) is used as-is under the name "custom".
+    """
+    if isinstance(profile, dict):
+        return "custom", profile
+    name = (profile or DEFAULT_PROFILE).lower()
+    if name == ADAPTIVE_PROFILE:
+        name = select_profile(megapixels)
+        logger.info(f"🎚️  Adaptive profile → {name} ({megapixels or 0:.1f} MP, load {current_load():.2f})")
+    elif name not in OPTIMIZATION_PROFILES:
+        logger.warning(f"⚠️  Unknown profile '{profile}', using {DEFAULT_PROFILE}")
+        name = DEFAULT_PROFILE
+    return name, OPTIMIZATION_PROFILES[name]
+
+
+def image_megapixels(source):
+    """Megapixels of a path / encoded bytes / array, reading only the header."""
+    if isinstance(source, np.ndarray):
+        return source.shape[0] * source.shape[1] / 1e6
+    size = image_dimensions(source)
+    return size[0] * size[1] / 1e6 if size else None
+
+
+# =====================================================
+# JOB-SCOPED WORKSPACES
+# =====================================================
+# Every analysis writes into its own directory (or into memory), so
+# concurrent uploads under waitress/gunicorn threads never share output.
+WORKSPACE_ROOT = os.path.join("static", "jobs")
+WORKSPACE_MAX_AGE = 3600       # seconds a finished workspace is kept on disk
+WORKSPACE_SWEEP_INTERVAL = 600  # seconds between background cleanup passes
+WORKSPACE_MAX_AGE_FILE = ".max_age"  # per-workspace override (e.g. queued jobs)
+
+_janitor_lock = threading.Lock()
+_janitor_started = False
+
+
+class AnalysisWorkspace:
+    """
+    Output location for a single analysis run.
+
+    Disk mode  → static/jobs/<job_id>/{segmented_output,individual_leaves,reports}
+    Memory mode → encoded image buffers collected in `artifacts`, nothing on disk
+
+    `max_age` keeps a disk workspace longer than WORKSPACE_MAX_AGE, for
+    results that link to it for longer (queued job results).
+    """
+
+    def __init__(self, job_id=None, in_memory=False, root=WORKSPACE_ROOT, max_age=None):
+        self.job_id = job_id or uuid.uuid4().hex
+        self.in_memory = in_memory
+        self.root = os.path.join(root, self.job_id)
+        self.segmented_dir = os.path.join(self.root, "segmented_output")
+        self.leaves_dir = os.path.join(self.root, "individual_leaves")
+        self.report_dir = os.path.join(self.root, "reports")
+        self.artifacts = {}
+
+        if not in_memory:
+            for d in [self.segmented_dir, self.leaves_dir, self.report_dir]:
+                os.makedirs(d, exist_ok=True)
+            if max_age is not None:
+                with open(os.path.join(self.root, WORKSPACE_MAX_AGE_FILE), "w") as f:
+                    f.write(str(int(max_age)))
+
+    def save_image(self, directory, filename, img, params=None):
+        """
+        Store an image artifact. Returns the file path in disk mode,
+        or the artifact key ("<dir>/<filename>") in memory mode.
+        """
+        params = params or []
+        if self.in_memory:
+            key = f"{os.path.basename(directory)}/{filename}"
+            ok, buf = cv2.imencode(os.path.splitext(filename)[1], img, params)
+            if not ok:
+                raise ValueError(f"Could not encode {key}")
+            self.artifacts[key] = buf.tobytes()
+            return key
+
+        path = os.path.join(directory, filename)
+        cv2.imwrite(path, img, params)
+        return path
+
+    def path_for(self, key):
+        """Location of an artifact key ("<dir>/<filename>") in this workspace."""
+        if self.in_memory:
+            return key
+        return os.path.join(self.root, *key.split("/"))
+
+    def export_artifacts(self):
+        """All artifacts as {"<dir>/<filename>": bytes}."""
+        if self.in_memory:
+            return dict(self.artifacts)
+
+        exported = {}
+        for dirpath, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                if filename == WORKSPACE_MAX_AGE_FILE:
+                    continue
+                path = os.path.join(dirpath, filename)
+                key = os.path.relpath(path, self.root).replace(os.sep, "/")
+                with open(path, "rb") as f:
+                    exported[key] = f.read()
+        return exported
+
+    def import_artifacts(self, exported):
+        """Restore artifacts produced by export_artifacts()."""
+        for key, data in exported.items():
+            if self.in_memory:
+                self.artifacts[key] = data
+                continue
+            path = self.path_for(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "wb") as f:
+                f.write(data)
+
+    def save_text(self, directory, filename, text):
+        """Store a text artifact (same return convention as save_image)."""
+        if self.in_memory:
+            key = f"{os.path.basename(directory)}/{filename}"
+            self.artifacts[key] = text.encode("utf-8")
+            return key
+
+        path = os.path.join(directory, filename)
+        with open(path, "w") as f:
+            f.write(text)
+        return path
+
+
+def _workspace_max_age(path, default):
+    try:
+        with open(os.path.join(path, WORKSPACE_MAX_AGE_FILE)) as f:
+            return max(default, int(f.read().strip()))
+    except (OSError, ValueError):
+        return default
+
+
+def cleanup_stale_workspaces(max_age=WORKSPACE_MAX_AGE, root=WORKSPACE_ROOT):
+    """
+    Delete workspace directories older than `max_age` seconds (or their
+    own longer max_age). Returns the number of workspaces removed.
+    """
+    if not os.path.isdir(root):
+        return 0
+
+    now = time.time()
+    removed = 0
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        try:
+            if os.path.isdir(path) and os.path.getmtime(path) < now - _workspace_max_age(path, max_age):
+                shutil.rmtree(path, ignore_errors=True)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"⚠️  Could not clean workspace {name}: {e}")
+
+    if removed:
+        logger.info(f"🧹 Removed {removed} stale analysis workspace(s)")
+    return removed
+
+
+def _janitor_loop(interval, max_age):
+    while True:
+        time.sleep(interval)
+        try:
+            cleanup_stale_workspaces(max_age=max_age)
+        except Exception as e:
+            logger.error(f"❌ Workspace cleanup failed: {e}")
+
+
+def start_workspace_janitor(interval=WORKSPACE_SWEEP_INTERVAL, max_age=WORKSPACE_MAX_AGE):
+    """
+    Start the background cleanup thread (once per process).
+    """
+    global _janitor_started
+    with _janitor_lock:
+        if _janitor_started:
+            return
+        _janitor_started = True
+
+    cleanup_stale_workspaces(max_age=max_age)
+    threading.Thread(
+        target=_janitor_loop, args=(interval, max_age),
+        name="workspace-janitor", daemon=True
+    ).start()
+
 
 # =====================================================
 # FAST IMAGE RESIZING
@@ -58,29 +327,21 @@ def resize_for_speed(image, max_size=800):
 # =====================================================
 # FAST BACKGROUND REMOVAL (OPTIMIZED GRABCUT)
 # =====================================================
-def fast_grabcut_segmentation(image, iterations=3):
+def fast_grabcut_segmentation(image, iterations=3, max_size=None):
     """
     Optimized GrabCut with fewer iterations.
     Falls back to HSV-based green masking if GrabCut fails.
+    `max_size` caps the resolution GrabCut itself runs at (low-memory mode).
     """
     try:
-        mask = np.zeros(image.shape[:2], np.uint8)
-        bgdModel = np.zeros((1, 65), np.float64)
-        fgdModel = np.zeros((1, 65), np.float64)
-
-        h, w = image.shape[:2]
-        margin = int(min(h, w) * 0.05)
-        rect = (margin, margin, w - 2 * margin, h - 2 * margin)
-
-        cv2.grabCut(image, mask, rect, bgdModel, fgdModel, iterations, cv2.GC_INIT_WITH_RECT)
-
-        mask_fg = np.where((mask == 2) | (mask == 0), 0, 1).astype("uint8")
-        segmented = image * mask_fg[:, :, None]
+        mask_fg = grabcut_foreground(image, 0.05, iterations, max_size=max_size)
 
         # Sanity check — if result is nearly empty, fall back
-        if cv2.countNonZero(cv2.cvtColor(segmented, cv2.COLOR_BGR2GRAY)) < 500:
+        if cv2.countNonZero(mask_fg) < 500:
             raise ValueError("GrabCut produced empty result, switching to fallback.")
 
+        segmented = cv2.bitwise_and(image, image, mask=mask_fg)
+
         return segmented, mask_fg
 
     except Exception as e:
@@ -102,33 +363,38 @@ def _hsv_green_fallback(image):
     kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
     mask_fg = cv2.morphologyEx(mask_fg, cv2.MORPH_CLOSE, kernel, iterations=2)
     mask_fg = cv2.morphologyEx(mask_fg, cv2.MORPH_OPEN, kernel, iterations=1)
-    mask_fg = (mask_fg // 255).astype("uint8")
+    np.bitwise_and(mask_fg, 1, out=mask_fg)  # 0/255 → 0/1
 
-    segmented = image * mask_fg[:, :, None]
+    segmented = cv2.bitwise_and(image, image, mask=mask_fg)
     return segmented, mask_fg
 
 
 # =====================================================
 # FAST WATERSHED (OPTIMIZED MORPHOLOGY)
 # =====================================================
-def fast_watershed_segmentation(segmented, morph_iter=2):
+def fast_watershed_segmentation(segmented, morph_iter=2, low_memory=False):
     """
     Optimized watershed with reduced morphological operations.
     Falls back to connected components if watershed fails.
+    With `low_memory` the grey/threshold temporaries live in scratch buffers.
     """
     try:
-        gray = cv2.cvtColor(segmented, cv2.COLOR_BGR2GRAY)
-        _, thresh = cv2.threshold(gray, 10, 255, cv2.THRESH_BINARY)
+        if low_memory:
+            gray = cv2.cvtColor(segmented, cv2.COLOR_BGR2GRAY, dst=scratch("gray", segmented.shape[:2]))
+            _, thresh = cv2.threshold(gray, 10, 255, cv2.THRESH_BINARY, dst=gray)
+        else:
+            gray = cv2.cvtColor(segmented, cv2.COLOR_BGR2GRAY)
+            _, thresh = cv2.threshold(gray, 10, 255, cv2.THRESH_BINARY)
 
         kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
         opening = cv2.morphologyEx(thresh, cv2.MORPH_OPEN, kernel, iterations=morph_iter)
         sure_bg = cv2.dilate(opening, kernel, iterations=morph_iter)
 
         dist = cv2.distanceTransform(opening, cv2.DIST_L2, 3)
-        _, sure_fg = cv2.threshold(dist, 0.3 * dist.max(), 255, 0)
-        sure_fg = np.uint8(sure_fg)
+        cv2.threshold(dist, 0.3 * dist.max(), 255, 0, dst=dist)
+        sure_fg = np.uint8(dist)
 
-        unknown = cv2.subtract(sure_bg, sure_fg)
+        unknown = cv2.subtract(sure_bg, sure_fg, dst=sure_bg)
 
         _, markers = cv2.connectedComponents(sure_fg)
         markers += 1
@@ -160,6 +426,16 @@ def _connected_components_fallback(segmented):
 # =====================================================
 # FAST LEAF SEVERITY CALCULATION
 # =====================================================
+def _severity_level(severity):
+    if severity < 5:
+        return "Healthy"
+    elif severity < 20:
+        return "Mild"
+    elif severity < 40:
+        return "Moderate"
+    return "Severe"
+
+
 def calculate_leaf_severity_fast(leaf_img):
     """
     Faster severity calculation with simplified HSV color detection.
@@ -191,15 +467,7 @@ def calculate_leaf_severity_fast(leaf_img):
             return 0.0, "Healthy", 0
 
         severity = (diseased_area / leaf_area) * 100
-
-        if severity < 5:
-            level = "Healthy"
-        elif severity < 20:
-            level = "Mild"
-        elif severity < 40:
-            level = "Moderate"
-        else:
-            level = "Severe"
+        level = _severity_level(severity)
 
         original_area = leaf_img.shape[0] * leaf_img.shape[1]
         return round(severity, 2), level, original_area
@@ -210,45 +478,108 @@ def calculate_leaf_severity_fast(leaf_img):
 
 
 # =====================================================
-# PROCESS SINGLE LEAF (FOR PARALLEL EXECUTION)
+# SINGLE-PASS REGION STATISTICS
 # =====================================================
-def process_single_leaf(args):
-    """
-    Process one leaf — used for parallel processing.
+# Rows per band for compute_region_stats in low-memory mode
+REGION_STATS_BAND_ROWS = 128
+
+
+def compute_region_stats(segmented, markers, band_rows=None):
     """
-    segmented, markers, mid, leaves_dir, leaf_id = args
+    Area, bounding box and severity pixel counts for every watershed
+    label in one vectorized pass (bincount / ufunc.at accumulation).
 
-    try:
-        gray = cv2.cvtColor(segmented, cv2.COLOR_BGR2GRAY)
+    Replaces the old per-marker full-frame `markers == mid` masks, so
+    extraction cost no longer grows with leaves × pixels.
 
-        mask_leaf = np.zeros(gray.shape, np.uint8)
-        mask_leaf[markers == mid] = 255
+    `band_rows` processes the frame in horizontal bands of that many rows
+    (same result), bounding the per-pixel temporaries in low-memory mode.
 
-        cnts, _ = cv2.findContours(mask_leaf, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        if not cnts:
-            return None
+    Returns a list of region dicts (label > 1 only, area > 0).
+    """
+    h, w = markers.shape[:2]
+    n_labels = int(markers.max()) + 1
+    if n_labels <= 2:
+        return []
+
+    area = np.zeros(n_labels, np.int64)
+    leaf_px = np.zeros(n_labels, np.int64)
+    diseased_px = np.zeros(n_labels, np.int64)
+    x0 = np.full(n_labels, w, np.int64)
+    y0 = np.full(n_labels, h, np.int64)
+    x1 = np.full(n_labels, -1, np.int64)
+    y1 = np.full(n_labels, -1, np.int64)
+
+    band_rows = band_rows or h
+    for top in range(0, h, band_rows):
+        band = segmented[top:top + band_rows]
+        labels = markers[top:top + band_rows].ravel()
+
+        # Severity masks computed once per band
+        hsv = cv2.cvtColor(band, cv2.COLOR_BGR2HSV)
+        diseased = cv2.inRange(hsv, (0, 40, 20), (25, 255, 255)).ravel()
+        gray = cv2.cvtColor(band, cv2.COLOR_BGR2GRAY).ravel()
+
+        idx = np.flatnonzero(labels > 1)
+        if not idx.size:
+            continue
+        lab = labels[idx]
+        ys, xs = np.divmod(idx, w)
+        ys += top
+
+        area += np.bincount(lab, minlength=n_labels)
+        np.minimum.at(x0, lab, xs)
+        np.minimum.at(y0, lab, ys)
+        np.maximum.at(x1, lab, xs)
+        np.maximum.at(y1, lab, ys)
+
+        is_leaf = gray[idx] > 10
+        leaf_px += np.bincount(lab[is_leaf], minlength=n_labels)
+        diseased_px += np.bincount(lab[is_leaf & (diseased[idx] > 0)], minlength=n_labels)
+
+    regions = []
+    for label in np.flatnonzero(area):
+        regions.append({
+            "label": int(label),
+            "area": int(area[label]),
+            "bbox": (int(x0[label]), int(y0[label]),
+                     int(x1[label] - x0[label] + 1), int(y1[label] - y0[label] + 1)),
+            "leaf_pixels": int(leaf_px[label]),
+            "diseased_pixels": int(diseased_px[label]),
+        })
+    return regions
 
-        cnt = max(cnts, key=cv2.contourArea)
-        area = cv2.contourArea(cnt)
 
-        if area < OPTIMIZATION_CONFIG["min_leaf_area"]:
-            return None
+# =====================================================
+# PROCESS SINGLE LEAF (FOR PARALLEL EXECUTION)
+# =====================================================
+def process_single_leaf(args):
+    """
+    Process one leaf — used for parallel processing.
+    Works only on the leaf's cropped ROI; stats come from compute_region_stats.
+    """
+    segmented, region, workspace, leaf_id = args
 
-        x, y, w, h = cv2.boundingRect(cnt)
+    try:
+        x, y, w, h = region["bbox"]
         leaf = segmented[y:y + h, x:x + w]
 
         leaf_filename = f"leaf_{leaf_id}.jpg"
-        leaf_path = os.path.join(leaves_dir, leaf_filename)
-        cv2.imwrite(leaf_path, leaf, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        leaf_path = workspace.save_image(
+            workspace.leaves_dir, leaf_filename, leaf, [cv2.IMWRITE_JPEG_QUALITY, 85]
+        )
 
-        severity, level, leaf_area = calculate_leaf_severity_fast(leaf)
+        if region["leaf_pixels"] > 0:
+            severity = round(region["diseased_pixels"] / region["leaf_pixels"] * 100, 2)
+        else:
+            severity = 0.0
 
         return {
             "leaf": leaf_path,
             "leaf_number": leaf_id,
             "severity_percent": severity,
-            "severity_level": level,
-            "leaf_area": leaf_area,
+            "severity_level": _severity_level(severity),
+            "leaf_area": w * h,
             "bbox": (x, y, w, h)
         }
 
@@ -258,36 +589,60 @@ def process_single_leaf(args):
 
 
 # =====================================================
-# OPTIMIZED DISEASE HEATMAP (OPTIONAL)
+# DISEASE MASK + ON-DEMAND HEATMAP
 # =====================================================
-def generate_disease_heatmap_fast(segmented_img, output_path):
+DISEASE_MASK_FILENAME = "disease_mask.png"
+SEGMENTED_FILENAME = "segmented_leaf.png"
+HEATMAP_MAX_SIZE = 2048
+
+
+def compute_disease_mask(segmented_img):
+    """Binary (0/255) mask of brown/yellow lesion pixels."""
+    hsv = cv2.cvtColor(segmented_img, cv2.COLOR_BGR2HSV)
+    mask1 = cv2.inRange(hsv, (10, 40, 40), (25, 255, 255))
+    mask2 = cv2.inRange(hsv, (0, 40, 20), (10, 255, 200))
+    return cv2.bitwise_or(mask1, mask2, dst=mask1)
+
+
+def render_heatmap_overlay(segmented_img, disease_mask, max_size=600):
     """
-    Faster heatmap generation — skip if not needed via config.
+    Blurred JET heatmap of `disease_mask` blended over the segmented image,
+    rendered with its longest side at most `max_size`.
     """
-    try:
-        h, w = segmented_img.shape[:2]
-        if max(h, w) > 600:
-            scale = 600 / max(h, w)
-            small = cv2.resize(segmented_img, (int(w * scale), int(h * scale)))
-        else:
-            small = segmented_img.copy()
+    h, w = segmented_img.shape[:2]
+    if max(h, w) > max_size:
+        scale = max_size / max(h, w)
+        size = (max(1, int(w * scale)), max(1, int(h * scale)))
+        small = cv2.resize(segmented_img, size, interpolation=cv2.INTER_AREA)
+        mask = cv2.resize(disease_mask, size, interpolation=cv2.INTER_AREA)
+    else:
+        small, mask = segmented_img, disease_mask
 
-        hsv = cv2.cvtColor(small, cv2.COLOR_BGR2HSV)
+    # Same blur footprint as the old fixed 15px kernel at 600px
+    k = max(3, int(round(15 * max(small.shape[:2]) / 600)) | 1)
+    heatmap = cv2.GaussianBlur(mask, (k, k), 0)
+    heatmap = cv2.normalize(heatmap, None, 0, 255, cv2.NORM_MINMAX)
+    heatmap_color = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
 
-        mask1 = cv2.inRange(hsv, (10, 40, 40), (25, 255, 255))
-        mask2 = cv2.inRange(hsv, (0, 40, 20), (10, 255, 200))
-        disease_mask = cv2.bitwise_or(mask1, mask2)
+    return cv2.addWeighted(small, 0.6, heatmap_color, 0.4, 0)
 
-        heatmap = cv2.GaussianBlur(disease_mask, (15, 15), 0)
-        heatmap = cv2.normalize(heatmap, None, 0, 255, cv2.NORM_MINMAX)
-        heatmap_color = cv2.applyColorMap(heatmap, cv2.COLORMAP_JET)
 
-        overlay = cv2.addWeighted(small, 0.6, heatmap_color, 0.4, 0)
+def generate_disease_heatmap_fast(segmented_img, output_path, workspace=None):
+    """
+    Render the full-size heatmap eagerly (only when skip_heatmap is off).
+    With a workspace, `output_path` is the filename inside its segmented dir.
+    """
+    try:
+        h, w = segmented_img.shape[:2]
+        overlay = render_heatmap_overlay(segmented_img, compute_disease_mask(segmented_img))
 
         if max(h, w) > 600:
             overlay = cv2.resize(overlay, (w, h))
 
-        cv2.imwrite(output_path, overlay, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        if workspace is not None:
+            workspace.save_image(workspace.segmented_dir, output_path, overlay)
+        else:
+            cv2.imwrite(output_path, overlay, [cv2.IMWRITE_JPEG_QUALITY, 85])
         return True
 
     except Exception as e:
@@ -295,6 +650,45 @@ def generate_disease_heatmap_fast(segmented_img, output_path):
         return False
 
 
+def heatmap_for_job(job_id, max_size=600, root=WORKSPACE_ROOT):
+    """
+    Path of the heatmap overlay for a finished disk workspace, rendering it
+    from the stored segmented image + disease mask on first request and
+    caching it per size. Returns None if the job or its mask is missing.
+    """
+    job_root = os.path.join(root, job_id)
+    segmented_dir = os.path.join(job_root, "segmented_output")
+    mask_path = os.path.join(segmented_dir, DISEASE_MASK_FILENAME)
+    if not os.path.exists(mask_path):
+        return None
+
+    disease_mask = cv2.imread(mask_path, cv2.IMREAD_GRAYSCALE)
+    if disease_mask is None:
+        return None
+
+    # Snap to 64px steps (never above the stored size) so arbitrary
+    # sizes can't flood the job directory with near-identical renders
+    max_size = max(64, min(-(-int(max_size) // 64) * 64, HEATMAP_MAX_SIZE))
+    max_size = min(max_size, max(disease_mask.shape[:2]))
+    out_path = os.path.join(segmented_dir, f"heatmap_{max_size}.jpg")
+    if os.path.exists(out_path):
+        return out_path
+
+    segmented = cv2.imread(os.path.join(segmented_dir, SEGMENTED_FILENAME))
+    if segmented is None:
+        return None
+
+    t0 = time.time()
+    overlay = render_heatmap_overlay(segmented, disease_mask, max_size=max_size)
+
+    # Write-then-rename so concurrent requests never serve a partial file
+    tmp_path = f"{out_path}.{uuid.uuid4().hex}.tmp.jpg"
+    cv2.imwrite(tmp_path, overlay, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    os.replace(tmp_path, out_path)
+    logger.info(f"🔥 Heatmap rendered for job {job_id} @ {max_size}px: {time.time() - t0:.2f}s")
+    return out_path
+
+
 # =====================================================
 # CALCULATE PLANT SEVERITY (VECTORIZED)
 # =====================================================
@@ -312,33 +706,154 @@ def calculate_plant_severity_fast(leaf_results):
         return 0.0, "Healthy"
 
     plant_severity = float(np.average(severities, weights=areas))
+    level = _severity_level(plant_severity)
+
+    return round(plant_severity, 2), level
+
+
+# =====================================================
+# SHARED DECODE + SEGMENT STAGE
+# =====================================================
+def load_image(source, max_size=None):
+    """
+    Decode an image from a file path, raw encoded bytes, or pass through
+    an already-decoded BGR array.
+
+    With `max_size` the decoder may return a power-of-two reduced image
+    (longest side still >= max_size) instead of the full-size photo.
+    """
+    if isinstance(source, np.ndarray):
+        return source
+
+    image = decode_image(source, max_size=max_size)
+    if image is None:
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            raise ValueError("❌ Cannot decode image bytes")
+        raise ValueError(f"❌ Cannot read image: {source}")
+    return image
+
 
-    if plant_severity < 5:
-        level = "Healthy"
-    elif plant_severity < 20:
-        level = "Mild"
-    elif plant_severity < 40:
-        level = "Moderate"
+def stage_decode_factor(image, config, reduced_decode=None):
+    """
+    Power-of-two factor prepare_segmentation() decodes `image` at under a
+    resolved profile `config` (1 = full size). Part of the analysis cache
+    keys, so results from a reduced and a full decode never mix.
+    """
+    if isinstance(image, np.ndarray):
+        return 1
+    reduced = config["low_memory"] if reduced_decode is None else reduced_decode
+    return decode_reduction(image, config["max_image_size"]) if reduced else 1
+
+
+def prepare_segmentation(image, profile=None, reduced_decode=None):
+    """
+    Resize + GrabCut once. The returned stage dict can be fed to both
+    segment_analyze_plant(stage=...) and the nutrition analyzer, so a
+    photo that needs both analyses is only decoded and segmented once.
+
+    `image` is a decoded BGR array, a path or encoded bytes; in low-memory
+    mode (or with `reduced_decode=True`, e.g. for in-memory uploads) the
+    latter two are decoded straight at reduced resolution.
+
+    `profile` is an OPTIMIZATION_PROFILES name or "auto"; the resolved
+    name and config travel with the stage, along with the per-stage
+    memory peaks under "memory" when tracking is on.
+    """
+    global _active_segmentations
+
+    if isinstance(image, np.ndarray):
+        original_size = image.shape[:2]
     else:
-        level = "Severe"
+        size = image_dimensions(image)
+        original_size = (size[1], size[0]) if size else None
 
-    return round(plant_severity, 2), level
+    megapixels = original_size[0] * original_size[1] / 1e6 if original_size else None
+    profile_name, config = resolve_profile(profile, megapixels)
+    logger.info(f"🎚️  Profile: {profile_name}")
+    decode_factor = stage_decode_factor(image, config, reduced_decode)
+
+    tracker = StageMemoryTracker("prepare")
+    with _active_lock:
+        _active_segmentations += 1
+    try:
+        # STEP 0: DECODE (reduced resolution in low-memory mode)
+        with tracker.stage("decode"):
+            reduced = config["low_memory"] if reduced_decode is None else reduced_decode
+            image = load_image(image, max_size=config["max_image_size"] if reduced else None)
+        original_size = tuple(original_size or image.shape[:2])
+        # The header ignores EXIF orientation but the decode applies it: match
+        # the decoded orientation and compare longest sides (as plant_check does)
+        if (image.shape[0] > image.shape[1]) != (original_size[0] > original_size[1]):
+            original_size = original_size[::-1]
+        decode_scale = max(image.shape[:2]) / max(original_size)
+        logger.info(f"📸 Original image: {original_size[1]}x{original_size[0]}"
+                    + (f" (decoded at {image.shape[1]}x{image.shape[0]})"
+                       if decode_scale != 1.0 else ""))
+
+        # STEP 1: RESIZE FOR SPEED
+        t0 = time.time()
+        with tracker.stage("resize"):
+            image_resized, scale_factor = resize_for_speed(
+                image, max_size=config["max_image_size"]
+            )
+        image = None  # drop the decoded photo before GrabCut
+        logger.info(f"   ⏱️  Resize: {time.time() - t0:.2f}s")
+
+        # STEP 2: BACKGROUND REMOVAL (GRABCUT + FALLBACK)
+        t0 = time.time()
+        grabcut_max_size = GRABCUT_LOW_MEMORY_MAX_SIZE if config["low_memory"] else None
+        with tracker.stage("grabcut", grabcut_native_bytes(image_resized.shape, grabcut_max_size)):
+            segmented, mask_fg = fast_grabcut_segmentation(
+                image_resized,
+                iterations=config["grabcut_iterations"],
+                max_size=grabcut_max_size
+            )
+        logger.info(f"   ✅ Segmentation: {time.time() - t0:.2f}s")
+    finally:
+        with _active_lock:
+            _active_segmentations -= 1
+
+    # Scale relative to the original photo, not the reduced decode
+    scale_factor *= decode_scale
+
+    return {
+        "image": image_resized,
+        "segmented": segmented,
+        "mask_fg": mask_fg,
+        "scale": scale_factor,
+        "original_size": original_size,
+        "decode_factor": decode_factor,
+        "profile": profile_name,
+        "config": config,
+        "memory": tracker.log(),
+    }
 
 
 # =====================================================
 # MAIN OPTIMIZED PIPELINE
 # =====================================================
-def segment_analyze_plant(image_path):
+def segment_analyze_plant(image_path, workspace=None, stage=None, profile=None):
     """
     🚀 OPTIMIZED PIPELINE — ML-FREE, OpenCV only.
 
+    `image_path` may also be encoded bytes or a decoded BGR array. Pass a
+    `stage` from prepare_segmentation() to reuse an existing GrabCut run.
+
+    `profile` selects an OPTIMIZATION_PROFILES entry ("fast", "balanced",
+    "accurate") or "auto" for load/size based selection; a supplied stage
+    keeps the profile it was segmented with. Each leaf result records it.
+
+    All outputs go to `workspace` (a fresh AnalysisWorkspace if omitted),
+    so concurrent requests never touch each other's files. Pass
+    AnalysisWorkspace(in_memory=True) to get encoded buffers instead of files.
+
     Key optimizations:
     1. Resize large images        → ~25x speedup for 4K images
     2. Fewer GrabCut iterations   → ~40% faster
     3. Reduced morphology ops     → ~30% faster
     4. Parallel leaf processing   → 2–4x faster on multi-core
     5. Simplified HSV analysis    → ~20% faster
-    6. Optional heatmap           → skip if not needed
+    6. On-demand heatmap          → only the disease mask is stored
 
     Fallbacks (no crash guarantee):
     - GrabCut failure → HSV green-mask segmentation
@@ -355,66 +870,61 @@ def segment_analyze_plant(image_path):
     logger.info("=" * 80)
 
     # --------------------------------------------------
-    # SETUP OUTPUT DIRECTORIES
+    # SETUP JOB WORKSPACE (isolated per analysis)
     # --------------------------------------------------
-    segmented_dir = os.path.join("static", "segmented_output")
-    leaves_dir = os.path.join("static", "individual_leaves")
-    report_dir = os.path.join("static", "reports")
+    if workspace is None:
+        workspace = AnalysisWorkspace()
+    if not workspace.in_memory:
+        start_workspace_janitor()
+    logger.info(f"🗂️  Workspace: {workspace.job_id}{' (in-memory)' if workspace.in_memory else ''}")
 
-    for d in [segmented_dir, leaves_dir, report_dir]:
-        if os.path.exists(d):
-            shutil.rmtree(d)
-        os.makedirs(d)
-
-    # --------------------------------------------------
-    # LOAD IMAGE
     # --------------------------------------------------
-    image = cv2.imread(image_path)
-    if image is None:
-        raise ValueError(f"❌ Cannot read image: {image_path}")
-
-    original_size = image.shape[:2]
-    logger.info(f"📸 Original image: {image.shape[1]}x{image.shape[0]}")
-
+    # LOAD + SEGMENT (skipped when a shared stage is supplied)
     # --------------------------------------------------
-    # STEP 1: RESIZE FOR SPEED
-    # --------------------------------------------------
-    t0 = time.time()
-    image_resized, scale_factor = resize_for_speed(
-        image, max_size=OPTIMIZATION_CONFIG["max_image_size"]
+    if stage is None:
+        stage = prepare_segmentation(image_path, profile=profile)
+
+    profile_name = stage.get("profile", "balanced")
+    config = stage.get("config", OPTIMIZATION_CONFIG)
+
+    original_size = stage["original_size"]
+    image_resized = stage["image"]
+    scale_factor = stage["scale"]
+    segmented = stage["segmented"]
+    low_memory = config.get("low_memory", False)
+    tracker = StageMemoryTracker("segment")
+
+    workspace.save_image(
+        workspace.segmented_dir, SEGMENTED_FILENAME, segmented,
+        [cv2.IMWRITE_PNG_COMPRESSION, 6]
     )
-    logger.info(f"   ⏱️  Resize: {time.time() - t0:.2f}s")
 
     # --------------------------------------------------
-    # STEP 2: BACKGROUND REMOVAL (GRABCUT + FALLBACK)
+    # STEP 3: DISEASE MASK (heatmap is rendered on demand from it)
     # --------------------------------------------------
     t0 = time.time()
-    segmented, mask_fg = fast_grabcut_segmentation(
-        image_resized,
-        iterations=OPTIMIZATION_CONFIG["grabcut_iterations"]
-    )
-    logger.info(f"   ✅ Segmentation: {time.time() - t0:.2f}s")
-
-    segmented_path = os.path.join(segmented_dir, "segmented_leaf.png")
-    cv2.imwrite(segmented_path, segmented, [cv2.IMWRITE_PNG_COMPRESSION, 6])
-
-    # --------------------------------------------------
-    # STEP 3: OPTIONAL HEATMAP
-    # --------------------------------------------------
-    if not OPTIMIZATION_CONFIG["skip_heatmap"]:
+    with tracker.stage("disease_mask"):
+        workspace.save_image(
+            workspace.segmented_dir, DISEASE_MASK_FILENAME, compute_disease_mask(segmented),
+            [cv2.IMWRITE_PNG_COMPRESSION, 9]
+        )
+    logger.info(f"   ✅ Disease mask: {time.time() - t0:.2f}s")
+
+    if not config["skip_heatmap"]:
         t0 = time.time()
-        heatmap_path = os.path.join(segmented_dir, "segmented_leaf_heatmap.png")
-        generate_disease_heatmap_fast(segmented, heatmap_path)
+        generate_disease_heatmap_fast(segmented, "segmented_leaf_heatmap.png", workspace)
         logger.info(f"   ✅ Heatmap: {time.time() - t0:.2f}s")
 
     # --------------------------------------------------
     # STEP 4: WATERSHED LEAF SEPARATION (+ FALLBACK)
     # --------------------------------------------------
     t0 = time.time()
-    markers = fast_watershed_segmentation(
-        segmented,
-        morph_iter=OPTIMIZATION_CONFIG["morph_iterations"]
-    )
+    with tracker.stage("watershed"):
+        markers = fast_watershed_segmentation(
+            segmented,
+            morph_iter=config["morph_iterations"],
+            low_memory=low_memory
+        )
     logger.info(f"   ✅ Watershed: {time.time() - t0:.2f}s")
 
     # --------------------------------------------------
@@ -422,30 +932,35 @@ def segment_analyze_plant(image_path):
     # --------------------------------------------------
     t0 = time.time()
 
-    unique_markers = np.unique(markers)
-    valid_markers = [m for m in unique_markers if m > 1]
+    with tracker.stage("region_stats"):
+        regions = compute_region_stats(
+            segmented, markers, band_rows=REGION_STATS_BAND_ROWS if low_memory else None
+        )
+    markers = None
+    valid_regions = [r for r in regions if r["area"] >= config["min_leaf_area"]]
 
-    logger.info(f"🍃 Processing {len(valid_markers)} candidate regions...")
+    logger.info(f"🍃 Processing {len(valid_regions)} of {len(regions)} candidate regions...")
 
     leaf_results = []
 
-    if OPTIMIZATION_CONFIG["parallel_processing"] and len(valid_markers) > 2:
+    if config["parallel_processing"] and len(valid_regions) > 2:
         args_list = [
-            (segmented, markers, mid, leaves_dir, idx)
-            for idx, mid in enumerate(valid_markers, 1)
+            (segmented, region, workspace, idx)
+            for idx, region in enumerate(valid_regions, 1)
         ]
-        with ThreadPoolExecutor(max_workers=4) as executor:
+        with ThreadPoolExecutor(max_workers=config["max_workers"]) as executor:
             results = list(executor.map(process_single_leaf, args_list))
         leaf_results = [r for r in results if r is not None]
     else:
-        for idx, mid in enumerate(valid_markers, 1):
-            result = process_single_leaf((segmented, markers, mid, leaves_dir, idx))
+        for idx, region in enumerate(valid_regions, 1):
+            result = process_single_leaf((segmented, region, workspace, idx))
             if result:
                 leaf_results.append(result)
 
     # Renumber sequentially
     for idx, result in enumerate(leaf_results, 1):
         result["leaf_number"] = idx
+        result["profile"] = profile_name
 
     logger.info(f"   ✅ Leaf extraction: {time.time() - t0:.2f}s | Valid leaves: {len(leaf_results)}")
 
@@ -456,28 +971,44 @@ def segment_analyze_plant(image_path):
     plant_severity, plant_level = calculate_plant_severity_fast(leaf_results)
     logger.info(f"   ✅ Severity calc: {time.time() - t0:.2f}s")
 
+    memory = tracker.log()
+    memory_peaks = [m["peak_mb"] for m in (stage.get("memory"), memory) if m]
+
     # --------------------------------------------------
     # GENERATE REPORT
     # --------------------------------------------------
-    report_path = os.path.join(report_dir, "severity_report.txt")
     try:
-        with open(report_path, "w") as f:
-            f.write("=" * 80 + "\n")
-            f.write("OPTIMIZED PLANT DISEASE SEVERITY ANALYSIS\n")
-            f.write("=" * 80 + "\n\n")
-            f.write(f"Image            : {image_path}\n")
-            f.write(f"Original Size    : {original_size[1]}x{original_size[0]}\n")
-            f.write(f"Processing Size  : {image_resized.shape[1]}x{image_resized.shape[0]}\n")
-            f.write(f"Scale Factor     : {scale_factor:.2f}x\n")
-            f.write(f"Total Time       : {time.time() - start_time:.2f}s\n\n")
-            f.write(f"Total Leaves     : {len(leaf_results)}\n\n")
-            f.write("LEAF SEVERITY:\n")
-            f.write("-" * 80 + "\n")
-            for r in leaf_results:
-                f.write(f"Leaf {r['leaf_number']:>3}: {r['severity_percent']:>6.2f}%  ({r['severity_level']})\n")
-            f.write("\n" + "=" * 80 + "\n")
-            f.write(f"PLANT SEVERITY   : {plant_severity}% ({plant_level})\n")
-            f.write("=" * 80 + "\n")
+        lines = [
+            "=" * 80,
+            "OPTIMIZED PLANT DISEASE SEVERITY ANALYSIS",
+            "=" * 80,
+            "",
+            f"Job ID           : {workspace.job_id}",
+            f"Image            : {image_path if isinstance(image_path, str) else '<in-memory>'}",
+            f"Original Size    : {original_size[1]}x{original_size[0]}",
+            f"Processing Size  : {image_resized.shape[1]}x{image_resized.shape[0]}",
+            f"Scale Factor     : {scale_factor:.2f}x",
+            f"Profile          : {profile_name}{' (low-memory)' if low_memory else ''}",
+            f"Total Time       : {time.time() - start_time:.2f}s",
+        ]
+        if memory_peaks:
+            lines.append(f"Memory Peak      : {max(memory_peaks):.1f} MB")
+        lines += [
+            "",
+            f"Total Leaves     : {len(leaf_results)}",
+            "",
+            "LEAF SEVERITY:",
+            "-" * 80,
+        ]
+        for r in leaf_results:
+            lines.append(f"Leaf {r['leaf_number']:>3}: {r['severity_percent']:>6.2f}%  ({r['severity_level']})")
+        lines += [
+            "",
+            "=" * 80,
+            f"PLANT SEVERITY   : {plant_severity}% ({plant_level})",
+            "=" * 80,
+        ]
+        workspace.save_text(workspace.report_dir, "severity_report.txt", "\n".join(lines) + "\n")
     except Exception as e:
         logger.error(f"❌ Failed to write report: {e}")
 
@@ -487,7 +1018,7 @@ def segment_analyze_plant(image_path):
     total_time = time.time() - start_time
     logger.info("=" * 80)
     logger.info("🎉 PIPELINE COMPLETE")
-    logger.info(f"   ⚡ Total Time    : {total_time:.2f}s")
+    logger.info(f"   ⚡ Total Time    : {total_time:.2f}s ({profile_name} profile)")
     logger.info(f"   📊 Leaves Found : {len(leaf_results)}")
     logger.info(f"   🌱 Plant Status : {plant_severity}% ({plant_level})")
     logger.info("=" * 80)
@@ -504,7 +1035,7 @@ if __name__ == "__main__":
         format="%(asctime)s - %(levelname)s - %(message)s"
     )
 
-    test_image = "test_plant.jpg"
+    test_image = sys.argv[1] if len(sys.argv) > 1 else "test_plant.jpg"
 
     if os.path.exists(test_image):
         print("\n🚀 Testing optimized segmentation...\n")
@@ -515,4 +1046,6 @@ if __name__ == "__main__":
         print(f"🌱 Plant Health : {severity}% ({level})")
         print(f"🍃 Leaves Found : {len(leaf_results)}\n")
     else:
-        print(f"❌ Test image not found: {test_image}\n")
+        print(f"❌ Test image not found: {test_image}")
+        print("   Usage: python segment2.py <image>")
+        print("   Synthetic benchmark: python benchmarks/bench_segment2.py\n")
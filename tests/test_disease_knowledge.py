@@ -0,0 +1,140 @@
+import json
+import os
+
+import pytest
+
+import disease_knowledge
+from conftest import ROOT
+from disease_classifier import CLASS_NAMES
+from disease_knowledge import DiseaseKnowledge, KnowledgeIndex, prepare_entry, thaw
+
+# Record every classifier label resolves to in disease_treatments.json
+# (None: no treatment record for that crop, and no cross-crop fallback)
+EXPECTED_CLASS_KEYS = {
+    "Apple_Apple_scab": "Apple_Apple_scab",
+    "Apple_Black_rot": "Apple_Black_rot",
+    "Apple_Cedar_apple_rust": "Apple_Cedar_apple_rust",
+    "Apple_healthy": "Apple_healthy",
+    "Blueberry_healthy": "Blueberry_healthy",
+    "Cherry_(including_sour)Powdery_mildew": "Cherry_Powdery_mildew",
+    "Cherry(including_sour)_healthy": "Cherry_healthy",
+    "Corn_(maize)Cercospora_leaf_spot_Gray_leaf_spot": "Corn_Cercospora_leaf_spot",
+    "Corn(maize)_Common_rust": "Corn(maize)_Common_rust",
+    "Corn_(maize)Northern_Leaf_Blight": "Corn_Northern_Leaf_Blight",
+    "Corn(maize)_healthy": "Corn_healthy",
+    "Grape_Black_rot": None,
+    "Grape_Esca_(Black_Measles)": "Grape_Esca_Black_Measles",
+    "Grape_Leaf_blight_(Isariopsis_Leaf_Spot)": "Grape_Leaf_blight_Isariopsis_Leaf_Spot",
+    "Grape_healthy": "Grape_healthy",
+    "Orange_Haunglongbing_(Citrus_greening)": "Orange_Haunglongbing_Citrus_greening",
+    "Peach_Bacterial_spot": "Peach_Bacterial_spot",
+    "Peach_healthy": "Peach_healthy",
+    "Pepper_bell_Bacterial_spot": "Pepper_bell_Bacterial_spot",
+    "Pepper_bell_healthy": "Pepper_bell_healthy",
+    "Potato_Early_blight": "Potato_Early_blight",
+    "Potato_Late_blight": "Potato_Late_blight",
+    "Potato_healthy": "Potato_healthy",
+    "Raspberry_healthy": "Raspberry_healthy",
+    "Soybean_healthy": "Soybean_healthy",
+    "Squash_Powdery_mildew": "Squash_Powdery_mildew",
+    "Strawberry_Leaf_scorch": "Strawberry_Leaf_scorch",
+    "Strawberry_healthy": "Strawberry_healthy",
+    "Tomato_Bacterial_spot": "Tomato_Bacterial_spot",
+    "Tomato_Early_blight": "Tomato_Early_blight",
+    "Tomato_Late_blight": "Tomato_Late_blight",
+    "Tomato_Leaf_Mold": "Tomato_Leaf_Mold",
+    "Tomato_Septoria_leaf_spot": "Tomato_Septoria_leaf_spot",
+    "Tomato_Spider_mites_Two-spotted_spider_mite": "Tomato_Spider_mites_Two-spotted_spider_mite",
+    "Tomato_Target_Spot": "Tomato_Target_Spot",
+    "Tomato_Tomato_Yellow_Leaf_Curl_Virus": "Tomato_Tomato_Yellow_Leaf_Curl_Virus",
+    "Tomato_Tomato_mosaic_virus": "Tomato_Tomato_mosaic_virus",
+    "Tomato_healthy": "Tomato_healthy",
+}
+
+
+@pytest.fixture(scope="module")
+def index():
+    return DiseaseKnowledge(os.path.join(ROOT, "disease_treatments.json")).index
+
+
+def test_expected_keys_cover_every_class():
+    assert sorted(EXPECTED_CLASS_KEYS) == sorted(CLASS_NAMES)
+
+
+@pytest.mark.parametrize("label", CLASS_NAMES)
+def test_class_names_resolve(index, label):
+    assert index.resolve(label) == EXPECTED_CLASS_KEYS[label]
+
+
+def test_grape_black_rot_does_not_fall_back_to_apple(index):
+    assert index.resolve("Grape_Black_rot") is None
+    assert index.get("Grape_Black_rot") is None
+
+
+@pytest.mark.parametrize("name", ["Tomato_Early_blight", "Tomato___Early_blight", "tomato early blight"])
+def test_normalized_spellings_resolve(index, name):
+    assert index.resolve(name) == "Tomato_Early_blight"
+
+
+def test_unknown_names_resolve_to_none(index):
+    assert index.resolve("") is None
+    assert index.resolve(None) is None
+    assert index.resolve("Banana_Panama_disease") is None
+
+
+def test_fuzzy_match_stays_within_crop():
+    index = KnowledgeIndex({"Apple_Black_rot": {}, "Grape_healthy": {}}, version="t")
+    assert index.resolve("Apple_Black_rot_leaf") == "Apple_Black_rot"
+    assert index.resolve("Grape_Black_rot") is None
+
+
+def test_ambiguous_fuzzy_match_resolves_to_none():
+    index = KnowledgeIndex({"Tomato_Leaf_spot": {}, "Tomato_Leaf_mold": {}}, version="t")
+    assert index.resolve("Tomato_Leaf") is None
+
+
+def test_display_names_and_aliases_resolve():
+    index = KnowledgeIndex({"Potato_Late_blight": {"name": "Late Blight of Potato", "aliases": ["Phytophthora"]}},
+                           version="t")
+    assert index.resolve("late blight of potato") == "Potato_Late_blight"
+    assert index.resolve("phytophthora") == "Potato_Late_blight"
+
+
+def test_entries_are_read_only(index):
+    entry = index.get("Tomato_Early_blight")
+    with pytest.raises(TypeError):
+        entry["name"] = "changed"
+    with pytest.raises(TypeError):
+        entry["pesticide"]["chemical"].update(dosage_per_hectare=0)
+
+    copy = thaw(entry)
+    copy["name"] = "changed"
+    assert index.get("Tomato_Early_blight")["name"] != "changed"
+
+
+def test_prepare_entry_fills_required_fields():
+    entry, fallbacks = prepare_entry("X", {"pesticide": {"chemical": {"name": "C", "dosage_per_hectare": 2}}})
+    chemical = entry["pesticide"]["chemical"]
+    assert chemical["unit"] == "L"
+    assert chemical["frequency"] == disease_knowledge.FALLBACK_FREQUENCY
+    assert chemical["safety"] == disease_knowledge.FALLBACK_SAFETY["chemical"]
+    assert chemical["usage"] == disease_knowledge.FALLBACK_USAGE
+    assert fallbacks == 4
+
+
+def test_changed_file_is_reloaded_and_broken_file_keeps_index(tmp_path, monkeypatch):
+    monkeypatch.setitem(disease_knowledge.KNOWLEDGE_CONFIG, "reload_check_s", 0.0)
+    path = tmp_path / "treatments.json"
+    path.write_text(json.dumps({"Tomato_healthy": {}}))
+    knowledge = DiseaseKnowledge(str(path))
+    first = knowledge.version
+    assert len(knowledge) == 1
+
+    path.write_text(json.dumps({"Tomato_healthy": {}, "Potato_healthy": {}}))
+    os.utime(path, ns=(0, 10 ** 18))
+    assert len(knowledge) == 2
+    assert knowledge.version != first
+
+    path.write_text("{ not json")
+    os.utime(path, ns=(0, 2 * 10 ** 18))
+    assert len(knowledge) == 2
@@ -0,0 +1,194 @@
+import json
+import os
+
+import numpy as np
+import pytest
+
+import dosage
+from conftest import ROOT
+from dosage import AREA_TO_HECTARE, plan_bulk_dosage, severity_multiplier, to_hectares
+from nutrition_analyzer import calculate_fertilizer_dosage
+
+PESTICIDES = {
+    "Tomato_Early_blight": {
+        "chemical": {"name": "Mancozeb", "dosage_per_hectare": 2.0, "unit": "kg"},
+        "organic": {"name": "Neem oil", "dosage_per_hectare": "5-10", "unit": "L"},
+    },
+    "Potato_Late_blight": {
+        "chemical": {"name": "Mancozeb", "dosage_per_hectare": 2.5, "unit": "kg"},
+        "organic": {"name": "Copper soap", "dosage_per_hectare": 3.0, "unit": "L"},
+    },
+}
+
+
+@pytest.fixture(scope="module")
+def fertilizers():
+    with open(os.path.join(ROOT, "nutrition_deficiency.json")) as f:
+        return {key: info["fertilizer"] for key, info in json.load(f).items()}
+
+
+def legacy_multiplier(pct):
+    """The if/elif ladder the band table replaced."""
+    if pct >= 75:
+        return 1.25
+    if pct >= 50:
+        return 1.10
+    if pct >= 25:
+        return 1.00
+    return 0.85
+
+
+def scalar_disease_dosage(rate, area, unit, infection_pct):
+    """app2.calculate_dosage: rate/ha × area ha × infection % × severity multiplier."""
+    pct = max(1.0, min(100.0, infection_pct))
+    return rate * to_hectares(area, unit) * (pct / 100.0) * severity_multiplier(pct)
+
+
+# =====================================================
+# UNIT CONVERSIONS
+# =====================================================
+@pytest.mark.parametrize("unit, hectares", [
+    ("hectare", 2.5),
+    ("acre", 2.5 * 0.404686),
+    ("square_meter", 2.5 * 0.0001),
+    ("square_feet", 2.5 * 0.0000092903),
+    ("square_foot", 2.5 * 0.0000092903),
+])
+def test_to_hectares(unit, hectares):
+    assert to_hectares(2.5, unit) == pytest.approx(hectares)
+
+
+def test_unknown_unit_counts_as_hectares():
+    assert to_hectares(3.0, "bigha") == 3.0
+
+
+def test_10000_square_meters_is_one_hectare():
+    assert to_hectares(10000, "square_meter") == pytest.approx(1.0)
+
+
+# =====================================================
+# SEVERITY BANDS
+# =====================================================
+@pytest.mark.parametrize("pct, multiplier", [
+    (0.0, 0.85), (1.0, 0.85), (24.99, 0.85),
+    (25.0, 1.00), (49.99, 1.00),
+    (50.0, 1.10), (74.99, 1.10),
+    (75.0, 1.25), (100.0, 1.25),
+])
+def test_band_boundaries(pct, multiplier):
+    assert severity_multiplier(pct) == multiplier
+    assert isinstance(severity_multiplier(pct), float)
+
+
+def test_bands_match_legacy_ladder():
+    pcts = np.linspace(0.0, 100.0, 2001)
+    expected = np.array([legacy_multiplier(p) for p in pcts])
+    np.testing.assert_array_equal(severity_multiplier(pcts), expected)
+
+
+# =====================================================
+# BULK PLANNER VS SCALAR PLANNERS
+# =====================================================
+def test_disease_plots_match_scalar_planner():
+    plots = [
+        {"id": "a", "area": 2, "area_unit": "acre", "disease_name": "Tomato_Early_blight", "infection_percent": 40},
+        {"id": "b", "area": 5000, "area_unit": "square_meter", "disease_name": "Potato_Late_blight",
+         "infection_percent": 10, "plant_severity": 80},
+        {"id": "c", "area": 1.5, "area_unit": "hectare", "disease_name": "Tomato_Early_blight",
+         "infection_percent": 75},
+        {"id": "d", "area": 1, "disease_name": "Potato_Late_blight", "infection_percent": 0},
+    ]
+    plan = plan_bulk_dosage(plots, PESTICIDES.get, lambda key: None)
+
+    for plot, result in zip(plots, plan["plots"]):
+        pct = max(plot["infection_percent"], plot.get("plant_severity", 0))
+        chemical = PESTICIDES[plot["disease_name"]]["chemical"]
+        expected = scalar_disease_dosage(chemical["dosage_per_hectare"], plot["area"],
+                                         plot.get("area_unit", "hectare"), pct)
+        assert result["chemical_dosage"]["amount"] == pytest.approx(expected, abs=1e-3)
+        assert result["severity_multiplier"] == severity_multiplier(max(1.0, pct))
+
+
+def test_missing_infection_uses_default():
+    plan = plan_bulk_dosage([{"area": 1, "disease_name": "Potato_Late_blight"}], PESTICIDES.get, lambda key: None)
+    default = dosage.DOSAGE_CONFIG["default_infection_percent"]
+    assert plan["plots"][0]["effective_infection_pct"] == default
+    assert plan["plots"][0]["chemical_dosage"]["amount"] == pytest.approx(
+        scalar_disease_dosage(2.5, 1, "hectare", default), abs=1e-3)
+
+
+def test_non_numeric_rate_gives_no_amount():
+    plan = plan_bulk_dosage([{"area": 1, "disease_name": "Tomato_Early_blight"}], PESTICIDES.get, lambda key: None)
+    assert plan["plots"][0]["organic_dosage"]["amount"] is None
+    assert plan["totals"]["organic"] == []
+
+
+def test_deficiency_plots_match_fertilizer_planner(fertilizers):
+    plots = [
+        {"area": area, "area_unit": unit, "deficiency_key": key}
+        for key in fertilizers
+        for area, unit in [(1, "hectare"), (3, "acre"), (2500, "square_meter")]
+    ]
+    plan = plan_bulk_dosage(plots, lambda name: None, fertilizers.get)
+
+    assert plan["summary"]["rejected"] == 0
+    for plot, result in zip(plots, plan["plots"]):
+        chemical, organic, hectares = calculate_fertilizer_dosage(
+            plot["area"], plot["area_unit"], fertilizers[plot["deficiency_key"]])
+        assert result["total_area_hectares"] == pytest.approx(hectares, abs=1e-4)
+        assert result["chemical_dosage"]["amount"] == pytest.approx(chemical["amount"], abs=0.01)
+        assert result["organic_dosage"]["amount"] == pytest.approx(organic["amount"], abs=0.01)
+        assert result["chemical_dosage"]["name"] == chemical["name"]
+
+
+# =====================================================
+# ERRORS AND TOTALS
+# =====================================================
+def test_invalid_plots_are_reported_and_left_out_of_totals():
+    plots = [
+        "not a plot",
+        {"area": -1, "disease_name": "Tomato_Early_blight"},
+        {"area": "abc", "disease_name": "Tomato_Early_blight"},
+        {"area": 1, "area_unit": "bigha", "disease_name": "Tomato_Early_blight"},
+        {"area": 1},
+        {"area": 1, "disease_name": "Banana_Panama_disease"},
+        {"area": 1, "disease_name": "Potato_Late_blight", "infection_percent": 100},
+    ]
+    plan = plan_bulk_dosage(plots, PESTICIDES.get, lambda key: None)
+    errors = [r.get("error") for r in plan["plots"]]
+
+    assert errors[0] == "Plot must be an object"
+    assert errors[1] == errors[2] == "Area must be a positive number"
+    assert errors[3] == "Unknown area unit 'bigha'"
+    assert errors[4] == "Plot needs a disease_name or deficiency_key"
+    assert errors[5] == "No treatment information for disease 'Banana_Panama_disease'"
+    assert errors[6] is None
+    assert plan["summary"] == {
+        "plots": 7, "computed": 1, "rejected": 6,
+        "total_area_hectares": 1.0, "treated_area_hectares": 1.0,
+    }
+    assert plan["totals"]["chemical"] == [{"name": "Mancozeb", "unit": "kg", "quantity": 3.125, "plots": 1}]
+
+
+def test_totals_sum_per_product_and_lookups_run_once_per_name():
+    calls = []
+
+    def lookup(name):
+        calls.append(name)
+        return PESTICIDES.get(name)
+
+    plots = [{"area": 1, "disease_name": name, "infection_percent": 100}
+             for name in ["Tomato_Early_blight", "Potato_Late_blight"] * 50]
+    plan = plan_bulk_dosage(plots, lookup, lambda key: None)
+
+    assert sorted(calls) == ["Potato_Late_blight", "Tomato_Early_blight"]
+    chemical = {(t["name"], t["unit"]): t for t in plan["totals"]["chemical"]}
+    assert chemical[("Mancozeb", "kg")]["plots"] == 100
+    assert chemical[("Mancozeb", "kg")]["quantity"] == pytest.approx(50 * (2.0 + 2.5) * 1.25)
+    assert sum(t["plots"] for t in plan["totals"]["organic"]) == 50
+
+
+def test_every_area_unit_is_accepted():
+    plots = [{"area": 1, "area_unit": unit, "disease_name": "Potato_Late_blight"} for unit in AREA_TO_HECTARE]
+    plan = plan_bulk_dosage(plots, PESTICIDES.get, lambda key: None)
+    assert plan["summary"]["rejected"] == 0
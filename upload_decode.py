@@ -0,0 +1,182 @@
+"""
+AgriPal - Upload decoding
+In-memory path for image uploads:
+
+- the request size is checked against Content-Length before the body is
+  parsed (see app2.reject_oversized_uploads)
+- the first bytes of the file are sniffed for a JPEG / PNG signature and
+  the image dimensions, so non-images, unsupported formats and
+  decompression bombs are rejected before the rest is read
+- the body is kept in memory and handed to the pipeline as bytes (JPEGs
+  are DCT-scaled when only a reduced resolution is needed); routes that
+  keep the original store it through upload_store
+"""
+
+import logging
+import os
+import struct
+
+from memory_budget import image_dimensions
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# UPLOAD SETTINGS
+# =====================================================
+UPLOAD_CONFIG = {
+    # Largest accepted image file
+    "max_image_mb": int(os.environ.get("AGRIPAL_MAX_UPLOAD_MB", 16)),
+
+    # Largest request body for single-image routes (image + form + audio)
+    "max_request_mb": int(os.environ.get("AGRIPAL_MAX_REQUEST_MB", 32)),
+
+    # Largest request body for /predict-batch (up to MAX_BATCH_IMAGES photos)
+    "max_batch_request_mb": int(os.environ.get("AGRIPAL_MAX_BATCH_REQUEST_MB", 128)),
+
+    # Hard cap on any request body (Flask MAX_CONTENT_LENGTH, covers videos)
+    "max_body_mb": int(os.environ.get("AGRIPAL_MAX_BODY_MB", 256)),
+
+    # Decompression-bomb guard: a 16 MB PNG can still expand to gigabytes
+    "max_pixels": 50_000_000,
+
+    # Bytes read up front for sniffing (covers JPEG EXIF / thumbnail blocks)
+    "header_bytes": 64 * 1024,
+}
+
+# Formats the analysis pipelines accept, with their canonical extension
+ALLOWED_FORMATS = {"JPEG": ".jpg", "PNG": ".png"}
+
+# Recognised but not accepted
+_OTHER_SIGNATURES = [
+    (b"GIF87a", "GIF"), (b"GIF89a", "GIF"), (b"BM", "BMP"),
+    (b"II*\x00", "TIFF"), (b"MM\x00*", "TIFF"),
+]
+
+_PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# JPEG start-of-frame markers carrying the dimensions (not DHT / JPG / DAC)
+_JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class UploadError(ValueError):
+    """Rejected upload; `error_type` is one of empty, not_image,
+    unsupported_format, too_large, too_many_pixels."""
+
+    def __init__(self, error_type, message):
+        super().__init__(message)
+        self.error_type = error_type
+
+
+# =====================================================
+# HEADER SNIFFING
+# =====================================================
+def _jpeg_dimensions(head):
+    """(width, height) from the first SOF segment in `head`, or None."""
+    i = 2
+    while i + 4 <= len(head):
+        if head[i] != 0xFF:
+            return None
+        marker = head[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # no length field
+            i += 2
+            continue
+        if marker == 0xDA:  # scan data before any frame header
+            return None
+        if marker in _JPEG_SOF:
+            if i + 9 > len(head):
+                return None
+            height, width = struct.unpack(">HH", head[i + 5:i + 9])
+            return width, height
+        (length,) = struct.unpack(">H", head[i + 2:i + 4])
+        i += 2 + length
+    return None
+
+
+def sniff_image(head):
+    """
+    (format, (width, height) or None) from the first bytes of a file.
+    format is "JPEG" / "PNG", another recognised image format, or None.
+    """
+    if head.startswith(_PNG_SIGNATURE):
+        if len(head) >= 24 and head[12:16] == b"IHDR":
+            return "PNG", struct.unpack(">II", head[16:24])
+        return "PNG", None
+    if head.startswith(b"\xff\xd8\xff"):
+        return "JPEG", _jpeg_dimensions(head)
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "WEBP", None
+    for signature, fmt in _OTHER_SIGNATURES:
+        if head.startswith(signature):
+            return fmt, None
+    return None, None
+
+
+# =====================================================
+# IN-MEMORY UPLOAD
+# =====================================================
+class ImageUpload:
+    """A validated image upload held in memory."""
+
+    def __init__(self, data, fmt, size, filename=""):
+        self.data = data
+        self.format = fmt
+        self.size = size  # (width, height) from the header
+        self.filename = filename
+
+
+def read_image_upload(file_storage, max_bytes=None):
+    """
+    Validate and read a werkzeug FileStorage into an ImageUpload.
+    Raises UploadError before reading past the header when the file is
+    not a JPEG / PNG or its dimensions exceed the pixel limit.
+    """
+    max_bytes = max_bytes or UPLOAD_CONFIG["max_image_mb"] * 1024 * 1024
+    if file_storage is None or not file_storage.filename:
+        raise UploadError("empty", "No image selected.")
+
+    stream = file_storage.stream
+    head = stream.read(UPLOAD_CONFIG["header_bytes"])
+    if not head:
+        raise UploadError("empty", "The uploaded file is empty.")
+
+    fmt, size = sniff_image(head)
+    if fmt is None:
+        raise UploadError("not_image", "The uploaded file is not an image.")
+    if fmt not in ALLOWED_FORMATS:
+        raise UploadError("unsupported_format", f"{fmt} images are not supported. Please upload PNG, JPG, or JPEG.")
+    _check_pixels(size)
+
+    data = head + stream.read(max(0, max_bytes + 1 - len(head)))
+    if len(data) > max_bytes:
+        raise UploadError("too_large", f"Image is larger than {max_bytes // (1024 * 1024)} MB.")
+
+    if size is None:
+        # Dimensions beyond the sniffed header (e.g. a very large EXIF block)
+        size = image_dimensions(data)
+        if size is None:
+            raise UploadError("not_image", "The uploaded image could not be read.")
+        _check_pixels(size)
+
+    return ImageUpload(data, fmt, tuple(size), file_storage.filename)
+
+
+def _check_pixels(size):
+    if size and size[0] * size[1] > UPLOAD_CONFIG["max_pixels"]:
+        raise UploadError(
+            "too_many_pixels",
+            f"Image is {size[0]}x{size[1]}; the limit is {UPLOAD_CONFIG['max_pixels'] // 1_000_000} megapixels."
+        )
+
+
+def request_size_limit(batch=False):
+    """Content-Length limit (bytes) for single-image (or batch) upload routes."""
+    key = "max_batch_request_mb" if batch else "max_request_mb"
+    return UPLOAD_CONFIG[key] * 1024 * 1024
+
+
+def max_body_size():
+    """Hard limit (bytes) for any request body."""
+    return UPLOAD_CONFIG["max_body_mb"] * 1024 * 1024
@@ -0,0 +1,308 @@
+"""
+AgriPal - Upload store
+Content-addressed storage for uploaded photos:
+
+- blobs live at static/uploads/cas/<ab>/<sha256>.jpg, keyed by the hash
+  of the uploaded bytes, so the same photo uploaded twice is stored once
+- originals are re-encoded at ingest: longest side capped, JPEG at a
+  fixed quality, EXIF (including GPS) dropped
+- a blob's age is its last upload: a re-upload touches a <sha256>.seen
+  sidecar rather than the blob, whose mtime derivative cache keys and
+  ETags are built from
+- a sweep removes blobs nothing refers to any more and blobs past the
+  retention period; a referenced blob is never removed to make room, so
+  a store still over its disk budget is only reported (log + stats) and
+  retention_days is the knob that bounds it
+
+References come from callables registered with register_reference_source()
+(app2 registers DiseaseDetection / WeeklyAssessment image_filename,
+expert_requests.image_path and the image_filename of queued / finished
+analysis jobs, which drops out once the job queue's retention purges the
+job); any string containing a blob hash counts.
+"""
+
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from hashlib import sha256
+
+import cv2
+
+from memory_budget import decode_image
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# STORE SETTINGS
+# =====================================================
+STORE_CONFIG = {
+    # Blob directory; names handed out are relative to static/uploads
+    "root": os.path.join("static", "uploads", "cas"),
+    "prefix": "cas",
+
+    # Ingest re-encoding
+    "max_side": int(os.environ.get("AGRIPAL_UPLOAD_MAX_SIDE", 2048)),
+    "jpeg_quality": int(os.environ.get("AGRIPAL_UPLOAD_JPEG_QUALITY", 85)),
+
+    # Disk budget for all blobs (exceeding it is reported, not enforced)
+    "budget_mb": int(os.environ.get("AGRIPAL_UPLOAD_BUDGET_MB", 1024)),
+
+    # Referenced blobs older than this are evicted (0 = kept while referenced)
+    "retention_days": int(os.environ.get("AGRIPAL_UPLOAD_RETENTION_DAYS", 0)),
+
+    # Unreferenced blobs are kept this long: result pages link them and the
+    # referencing rows are written after the blob
+    "grace_hours": 24,
+
+    # Minimum time between sweeps triggered by ingests
+    "sweep_interval_s": 600,
+}
+
+_BLOB_HASH = re.compile(r"([0-9a-f]{64})\.jpg")
+
+
+def reencode_image(data, max_side, quality):
+    """JPEG bytes of `data` with the longest side capped at `max_side`."""
+    img = decode_image(data, max_size=max_side)
+    if img is None:
+        raise ValueError("Upload could not be decoded for storage")
+    h, w = img.shape[:2]
+    if max(h, w) > max_side:
+        s = max_side / max(h, w)
+        img = cv2.resize(img, (max(1, int(w * s)), max(1, int(h * s))), interpolation=cv2.INTER_AREA)
+    ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality, cv2.IMWRITE_JPEG_OPTIMIZE, 1])
+    if not ok:
+        raise ValueError("Upload could not be re-encoded")
+    return buf.tobytes()
+
+
+class UploadStore:
+    """Content-addressed blob store with reference-tracked eviction."""
+
+    def __init__(self, config=None):
+        self.config = config or STORE_CONFIG
+        self.root = self.config["root"]
+        self._sources = {}
+        self._lock = threading.Lock()
+        self._sweep_lock = threading.Lock()
+        self._last_sweep = 0.0
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-store")
+        # Sweeps query every reference source and walk the store; they run
+        # here so an ingest (which requests wait on) never waits for one
+        self._sweeper = ThreadPoolExecutor(max_workers=1, thread_name_prefix="upload-sweep")
+        self._counters = {
+            "ingested": 0, "deduplicated": 0, "bytes_in": 0, "bytes_stored": 0,
+            "sweeps": 0, "evicted_unreferenced": 0, "evicted_expired": 0,
+        }
+        os.makedirs(self.root, exist_ok=True)
+
+    # ── naming ──────────────────────────────────────────────────────────────
+    def digest(self, data):
+        return sha256(data).hexdigest()
+
+    def path_for(self, digest):
+        return os.path.join(self.root, digest[:2], f"{digest}.jpg")
+
+    def seen_path_for(self, digest):
+        """Sidecar whose mtime records the latest re-upload of a blob."""
+        return os.path.join(self.root, digest[:2], f"{digest}.seen")
+
+    def name_for(self, digest):
+        """Name relative to static/uploads (what image_filename stores)."""
+        return f"{self.config['prefix']}/{digest[:2]}/{digest}.jpg"
+
+    # ── ingest ──────────────────────────────────────────────────────────────
+    def put(self, data):
+        """Store `data` (encoded image bytes); returns its name."""
+        digest = self.digest(data)
+        self._store(digest, data)
+        return self.name_for(digest)
+
+    def put_async(self, data):
+        """(name, Future): the name is known up front, the blob is written in the background."""
+        digest = self.digest(data)
+        return self.name_for(digest), self._writer.submit(self._store, digest, data)
+
+    def _store(self, digest, data):
+        path = self.path_for(digest)
+        if os.path.exists(path):
+            # Re-upload refreshes the blob's age without touching the blob itself
+            with open(self.seen_path_for(digest), "a"):
+                pass
+            os.utime(self.seen_path_for(digest))
+            self._count("deduplicated")
+            logger.info(f"♻️  Upload {digest[:12]} already stored")
+        else:
+            encoded = reencode_image(data, self.config["max_side"], self.config["jpeg_quality"])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(encoded)
+                os.replace(tmp_path, path)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            with self._lock:
+                self._counters["ingested"] += 1
+                self._counters["bytes_in"] += len(data)
+                self._counters["bytes_stored"] += len(encoded)
+            logger.info(f"💾 Stored upload {digest[:12]}: {len(data) / 1e6:.2f} MB → {len(encoded) / 1e6:.2f} MB")
+
+        self.maybe_sweep()
+        return path
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._counters[key] += n
+
+    # ── references ──────────────────────────────────────────────────────────
+    def register_reference_source(self, name, source):
+        """`source()` returns an iterable of stored names / paths still in use."""
+        self._sources[name] = source
+
+    def referenced_digests(self):
+        digests = set()
+        for name, source in self._sources.items():
+            try:
+                for ref in source():
+                    match = _BLOB_HASH.search(ref or "")
+                    if match:
+                        digests.add(match.group(1))
+            except Exception as e:
+                # Without a complete reference set nothing may be treated as unreferenced
+                raise RuntimeError(f"Reference source '{name}' failed: {e}") from e
+        return digests
+
+    # ── eviction ────────────────────────────────────────────────────────────
+    def _blobs(self):
+        """[(last upload time, size, digest, path)], oldest first."""
+        blobs = []
+        for dirpath, _, filenames in os.walk(self.root):
+            names = set(filenames)
+            for f in filenames:
+                match = _BLOB_HASH.fullmatch(f)
+                if not match:
+                    continue
+                path = os.path.join(dirpath, f)
+                try:
+                    st = os.stat(path)
+                    seen = f"{match.group(1)}.seen"
+                    uploaded = max(st.st_mtime, os.stat(os.path.join(dirpath, seen)).st_mtime) \
+                        if seen in names else st.st_mtime
+                except FileNotFoundError:
+                    continue
+                blobs.append((uploaded, st.st_size, match.group(1), path))
+        blobs.sort()
+        return blobs
+
+    def _sweep_due(self):
+        return time.time() - self._last_sweep >= self.config["sweep_interval_s"]
+
+    def maybe_sweep(self):
+        """Start a sweep on the sweeper thread if one is due; returns its Future or None."""
+        if not self._sweep_due() or self._sweep_lock.locked():
+            return None
+        return self._sweeper.submit(self._sweep_if_due)
+
+    def _sweep_if_due(self):
+        if not self._sweep_due():  # another queued sweep already ran
+            return None
+        try:
+            return self.sweep()
+        except Exception as e:
+            logger.warning(f"⚠️ Upload store sweep skipped: {e}")
+            return None
+
+    def sweep(self, now=None):
+        """
+        Evict unreferenced blobs past the grace period and referenced blobs
+        past the retention period. Returns what was removed and how far the
+        remaining blobs are over budget (0 when within it).
+        """
+        if not self._sweep_lock.acquire(blocking=False):
+            return None
+        try:
+            now = now or time.time()
+            self._last_sweep = now
+            referenced = self.referenced_digests()
+            grace = self.config["grace_hours"] * 3600
+            retention = self.config["retention_days"] * 86400
+            budget = self.config["budget_mb"] * 1024 * 1024
+
+            removed = {"unreferenced": 0, "expired": 0, "bytes": 0}
+            kept = []
+            for mtime, size, digest, path in self._blobs():
+                age = now - mtime
+                if digest not in referenced and age > grace:
+                    reason = "unreferenced"
+                elif retention and age > retention:
+                    reason = "expired"
+                else:
+                    kept.append((mtime, size, digest, path))
+                    continue
+                if self._remove(path):
+                    removed[reason] += 1
+                    removed["bytes"] += size
+
+            # What's left is referenced or still in its grace period: deleting
+            # it would break history pages, so over budget is only reported
+            total = sum(size for _, size, _, _ in kept)
+            removed["over_budget_bytes"] = max(0, total - budget)
+
+            with self._lock:
+                self._counters["sweeps"] += 1
+                for reason in ("unreferenced", "expired"):
+                    self._counters[f"evicted_{reason}"] += removed[reason]
+            if removed["bytes"]:
+                logger.info(f"🧹 Upload store sweep: {removed}")
+            if removed["over_budget_bytes"]:
+                logger.warning(
+                    f"⚠️ Upload store over budget by {removed['over_budget_bytes'] / 1e6:.1f} MB "
+                    f"({len(kept)} blobs still referenced or in grace); lower retention_days or raise budget_mb"
+                )
+            return removed
+        finally:
+            self._sweep_lock.release()
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"⚠️ Could not remove {path}: {e}")
+            return False
+        try:
+            os.remove(os.path.splitext(path)[0] + ".seen")
+        except OSError:
+            pass
+        return True
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+        blobs = self._blobs()
+        total = sum(size for _, size, _, _ in blobs)
+        budget = self.config["budget_mb"] * 1024 * 1024
+        counters.update({
+            "blobs": len(blobs),
+            "bytes": total,
+            "budget_bytes": budget,
+            "over_budget": total > budget,
+            "reencode_ratio": round(counters["bytes_stored"] / counters["bytes_in"], 3) if counters["bytes_in"] else None,
+        })
+        return counters
+
+
+upload_store = UploadStore()
+
+
+def store_stats():
+    return upload_store.stats()
+
@@ -0,0 +1,225 @@
+"""
+AgriPal - Field walk video analysis
+Samples frames from a walk-through video, drops near-duplicate frames with
+a difference hash (dHash), runs the segment2 leaf pipeline on the distinct
+frames in parallel and aggregates everything into one plant/field severity.
+"""
+
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import cv2
+
+from segment2 import AnalysisWorkspace, calculate_plant_severity_fast, segment_analyze_plant
+
+logger = logging.getLogger(__name__)
+
+# =====================================================
+# VIDEO SETTINGS
+# =====================================================
+VIDEO_CONFIG = {
+    # Frames per second of video to look at (others are grabbed, not decoded)
+    "sample_fps": 2.0,
+
+    # Hard cap on frames sent through the leaf pipeline; longer videos are
+    # sampled more sparsely so the kept frames still span the whole walk
+    "max_frames": 40,
+
+    # dHash grid (hash_size x hash_size bits) and Hamming distance at or
+    # below which a frame counts as a duplicate of one already kept
+    "hash_size": 8,
+    "duplicate_threshold": 6,
+
+    # Frames analysed concurrently
+    "max_workers": 2,
+
+    # segment2 profile used for each frame
+    "profile": "fast",
+}
+
+VIDEO_EXTENSIONS = {'mp4', 'mov', 'avi', 'mkv', 'webm', '3gp'}
+
+
+# =====================================================
+# PERCEPTUAL HASH
+# =====================================================
+def dhash(frame, hash_size=8):
+    """Difference hash: one bit per horizontal gradient sign on a tiny grey image."""
+    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame
+    small = cv2.resize(gray, (hash_size + 1, hash_size), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    value = 0
+    for bit in bits:
+        value = (value << 1) | int(bit)
+    return value
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+# =====================================================
+# FRAME SAMPLING
+# =====================================================
+def sample_distinct_frames(video_path, config=None, stats=None):
+    """
+    Yield (frame_index, timestamp_s, frame) for sampled frames that are not
+    near-duplicates of an earlier kept frame. Skipped frames are only
+    grabbed (demuxed), never decoded to BGR.
+
+    The sampling step is `sample_fps`, widened from the container's frame
+    count so at most `max_frames` samples cover the whole video. When the
+    count is missing or wrong and `max_frames` is reached before the end,
+    sampling stops and stats["truncated"] is set.
+
+    Sampling counters are written into `stats` (if given) as it runs.
+    """
+    config = config or VIDEO_CONFIG
+    stats = {} if stats is None else stats
+    stats.update({"frames_total": 0, "frames_sampled": 0, "duplicates_skipped": 0, "video_fps": 0.0,
+                  "sample_step": 1, "truncated": False})
+
+    cap = cv2.VideoCapture(video_path)
+    if not cap.isOpened():
+        raise ValueError(f"❌ Cannot open video: {video_path}")
+
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        frame_count = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        stats["video_fps"] = round(fps, 2)
+        step = max(1, int(round(fps / config["sample_fps"])))
+        if frame_count > 0:
+            step = max(step, -(-frame_count // config["max_frames"]))
+        stats["sample_step"] = step
+        kept_hashes = []
+        index = -1
+
+        while cap.grab():
+            index += 1
+            stats["frames_total"] = index + 1
+            if index % step:
+                continue
+            if len(kept_hashes) >= config["max_frames"]:
+                stats["truncated"] = True  # a sample point the cap leaves unlooked-at
+                break
+
+            ok, frame = cap.retrieve()
+            if not ok or frame is None:
+                continue
+            stats["frames_sampled"] += 1
+
+            h = dhash(frame, config["hash_size"])
+            if any(hamming(h, k) <= config["duplicate_threshold"] for k in kept_hashes):
+                stats["duplicates_skipped"] += 1
+                continue
+
+            kept_hashes.append(h)
+            yield index, round(index / fps, 2), frame
+    finally:
+        cap.release()
+
+
+# =====================================================
+# MAIN VIDEO PIPELINE
+# =====================================================
+def _analyze_frame(frame_index, timestamp, frame, profile):
+    leaf_results, severity, level = segment_analyze_plant(
+        frame, workspace=AnalysisWorkspace(in_memory=True), profile=profile
+    )
+    for leaf in leaf_results:
+        leaf["frame_index"] = frame_index
+    return {
+        "frame_index": frame_index,
+        "timestamp": timestamp,
+        "leaf_results": leaf_results,
+        "plant_severity": severity,
+        "plant_severity_level": level,
+    }
+
+
+def analyze_video(video_path, config=None):
+    """
+    🎥 Field-walk video → one aggregated plant/field severity.
+
+    Distinct frames are analysed while decoding continues, with at most
+    `max_workers` frames in flight. The aggregate (`plant_severity`,
+    `plant_severity_level`) is calculate_plant_severity_fast() over the
+    leaves of every analysed frame.
+    """
+    config = dict(VIDEO_CONFIG, **(config or {}))
+    start_time = time.time()
+
+    logger.info("=" * 80)
+    logger.info("🎥 FIELD WALK VIDEO ANALYSIS")
+    logger.info("=" * 80)
+
+    frames = []
+    stats = {}
+    max_workers = config["max_workers"]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = set()
+        for frame_index, timestamp, frame in sample_distinct_frames(video_path, config, stats):
+            pending.add(executor.submit(_analyze_frame, frame_index, timestamp, frame, config["profile"]))
+            if len(pending) >= max_workers:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                frames.extend(f.result() for f in done)
+        frames.extend(f.result() for f in pending)
+
+    frames.sort(key=lambda f: f["frame_index"])
+    all_leaves = [leaf for f in frames for leaf in f["leaf_results"]]
+    plant_severity, plant_level = calculate_plant_severity_fast(all_leaves)
+
+    elapsed = time.time() - start_time
+    throughput = {
+        "frames_read_per_s": round(stats["frames_total"] / elapsed, 2) if elapsed else 0.0,
+        "frames_analyzed_per_s": round(len(frames) / elapsed, 2) if elapsed else 0.0,
+    }
+
+    logger.info(f"🎞️  Frames: {stats['frames_total']} total, {stats['frames_sampled']} sampled "
+                f"(every {stats['sample_step']}), {stats['duplicates_skipped']} duplicates skipped, "
+                f"{len(frames)} analysed")
+    if stats["truncated"]:
+        logger.warning(f"⚠️ Video truncated: max_frames ({config['max_frames']}) reached after "
+                       f"{stats['frames_total']} frames; the rest of the walk was not analysed")
+    logger.info(f"🌱 Field severity: {plant_severity}% ({plant_level}) from {len(all_leaves)} leaves")
+    logger.info(f"⚡ {elapsed:.2f}s | {throughput['frames_read_per_s']} fps read, "
+                f"{throughput['frames_analyzed_per_s']} fps analysed")
+
+    return {
+        "plant_severity": plant_severity,
+        "plant_severity_level": plant_level,
+        "total_leaves": len(all_leaves),
+        "frames": [
+            dict({k: v for k, v in f.items() if k != "leaf_results"}, leaves=len(f["leaf_results"]))
+            for f in frames
+        ],
+        "frames_total": stats["frames_total"],  # frames read (all of them unless truncated)
+        "frames_sampled": stats["frames_sampled"],
+        "frames_analyzed": len(frames),
+        "duplicates_skipped": stats["duplicates_skipped"],
+        "video_fps": stats["video_fps"],
+        "sample_step": stats["sample_step"],
+        # True when max_frames was reached before the end of the video: the
+        # severity then only covers the walk up to covered_until_s
+        "truncated": stats["truncated"],
+        "covered_until_s": round(stats["frames_total"] / stats["video_fps"], 2) if stats["video_fps"] else 0.0,
+        "throughput": throughput,
+        "profile": config["profile"],
+        "processing_time": round(elapsed, 2),
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    if len(sys.argv) < 2:
+        print("Usage: python video_analysis.py <video>")
+        sys.exit(1)
+
+    result = analyze_video(sys.argv[1])
+    print(f"\n🌱 Field severity : {result['plant_severity']}% ({result['plant_severity_level']})")
+    print(f"🎞️  Frames        : {result['frames_analyzed']} analysed / {result['frames_total']} total")
+    print(f"⚡ Throughput     : {result['throughput']['frames_read_per_s']} fps\n")